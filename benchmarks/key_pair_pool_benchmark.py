@@ -0,0 +1,43 @@
+# ----------------------------------------------------
+# Compares generating key pairs on request with
+# taking them from a key pair pool that generates
+# them in the background.
+# Run from the repository root:
+#   python -m benchmarks.key_pair_pool_benchmark [key pairs] [workers]
+# Copyright (c) 2022 Berk Kırtay
+# ----------------------------------------------------
+
+from src.Transaction.TransactionSignature import generateKeyPair
+from src.KeyPairPool.KeyPairPool import KeyPairPool
+from datetime import datetime
+import sys
+import time
+
+
+def measureSeconds(function, numberOfKeyPairs: int) -> float:
+    initialTime = datetime.now()
+    for i in range(numberOfKeyPairs):
+        function()
+    return (datetime.now() - initialTime).total_seconds()
+
+
+# The program is idle for a while before it asks for key pairs, e.g.
+# a node that waits for requests, so the pool can fill up.
+
+def measurePoolSeconds(numberOfKeyPairs: int, workers: int) -> float:
+    pool = KeyPairPool(poolSize=numberOfKeyPairs, workerCount=workers)
+    pool.start()
+    while len(pool) < numberOfKeyPairs:
+        time.sleep(0.1)
+    seconds = measureSeconds(pool.getKeyPair, numberOfKeyPairs)
+    pool.stop()
+    return seconds
+
+
+if __name__ == "__main__":
+    numberOfKeyPairs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    directSeconds = measureSeconds(generateKeyPair, numberOfKeyPairs)
+    poolSeconds = measurePoolSeconds(numberOfKeyPairs, workers)
+    print(f"{numberOfKeyPairs} RSA key pairs: generated on request {directSeconds:.3f}s, " +
+          f"from a filled pool {poolSeconds:.4f}s")
@@ -0,0 +1,39 @@
+# ----------------------------------------------------
+# Measures the hash rate of block mining for blocks
+# with different numbers of transactions.
+# Run from the repository root:
+#   python -m benchmarks.mining_benchmark
+# Copyright (c) 2022 Berk Kırtay
+# ----------------------------------------------------
+
+from src.Blockchain.Blockchain import Block, searchNonces
+from src.Transaction.Transaction import Transaction
+from src.Transaction.TransactionSignature import generateGenesisSignerKeyPair
+from datetime import datetime
+
+NONCE_COUNT = 200000
+
+
+def createTransactions(numberOfTransactions: int) -> list:
+    publicKey, privateKey = generateGenesisSignerKeyPair()
+    transactions = []
+    for i in range(numberOfTransactions):
+        transaction = Transaction(publicKey, "null", i + 1, privateKey)
+        transaction.approve()
+        transactions.append(transaction)
+    return transactions
+
+
+# The difficulty is set to a value that can't be met, so that
+# exactly NONCE_COUNT hashes are generated by the miner.
+
+def measureHashRate(block: Block) -> float:
+    initialTime = datetime.now()
+    searchNonces(block.generateHeaderPrefix(), 65, 0, 1, NONCE_COUNT)
+    return NONCE_COUNT / (datetime.now() - initialTime).total_seconds()
+
+
+if __name__ == "__main__":
+    for numberOfTransactions in [1, 100, 1000]:
+        block = Block("0" * 64, 0, createTransactions(numberOfTransactions))
+        print(f"{numberOfTransactions} transactions: {measureHashRate(block):.0f} H/s")
@@ -0,0 +1,203 @@
+# ----------------------------------------------------
+# Runs a network of nodes on localhost and measures
+# how fast transactions and blocks spread, the
+# traffic of every node and the fork rate.
+# Run from the repository root:
+#   python -m benchmarks.network_simulator [nodes] [transactions]
+# Copyright (c) 2022 Berk Kırtay
+# ----------------------------------------------------
+
+from src.Blockchain.Blockchain import Blockchain
+from src.Transaction.Transaction import Transaction
+from src.Transaction.TransactionSignature import generateGenesisSignerKeyPair
+from src.DataConverter.DataConverter import DataConverter
+from src.blockchain_p2p_nodes.BlockchainNode import Node
+import asyncio
+import random
+import sys
+import time
+
+INITIAL_BALANCE = 1000000
+
+
+def getPercentile(values: list, percentile: float) -> float:
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+# All nodes run in one event loop and talk over localhost TCP
+# connections. Every node starts from a copy of the same chain, in which
+# the node's own key pair is funded. Then the nodes send transactions to
+# each other and mine blocks at random intervals. Listeners of the P2P
+# servers record when every node accepts a transaction or block.
+# Mining blocks the event loop, so a low hashDifficulty is used to keep
+# the measured latencies about the network and not the miners.
+
+class NetworkSimulator():
+    def __init__(self, nodeCount: int = 8, peerCount: int = 3, hashDifficulty: int = 1,
+                 transactionCount: int = 200, transactionInterval: float = 0.01,
+                 blockInterval: float = 0.5, settleTimeout: float = 30, seed: int = 0):
+        self.nodeCount = nodeCount
+        self.peerCount = peerCount
+        self.hashDifficulty = hashDifficulty
+        self.transactionCount = transactionCount
+        self.transactionInterval = transactionInterval
+        self.blockInterval = blockInterval
+        self.settleTimeout = settleTimeout
+        self.random = random.Random(seed)
+        self.nodes = []
+        self.keyPairs = []
+        self.originTimes = {}
+        self.arrivalTimes = {}
+        self.minedBlockHashes = []
+
+    def createBaseBlockchainData(self) -> bytes:
+        blockchain = Blockchain(self.hashDifficulty)
+        for publicKey, privateKey in self.keyPairs:
+            blockchain.forceTransaction(publicKey, INITIAL_BALANCE)
+        return DataConverter().dumpBlockchainDataAsBytes(blockchain)
+
+    async def startNodes(self):
+        self.keyPairs = [generateGenesisSignerKeyPair()
+                         for i in range(self.nodeCount)]
+        blockchainData = self.createBaseBlockchainData()
+        for publicKey, privateKey in self.keyPairs:
+            node = Node(publicKey)
+            await node.initializeNode("127.0.0.1", 0,
+                                      DataConverter().loadBlockchainDataFromBytes(blockchainData))
+            node.network.listeners.append(self.createListener(len(self.nodes)))
+            self.nodes.append(node)
+
+    def createListener(self, nodeIndex: int):
+        def recordArrival(itemType: int, itemHash: str):
+            self.arrivalTimes.setdefault(itemHash, {}).setdefault(
+                nodeIndex, time.perf_counter())
+        return recordArrival
+
+    # Every node connects to a random node before it, so the network
+    # is connected, and then to random nodes until it has peerCount
+    # outgoing connections.
+
+    async def connectNodes(self):
+        connections = {}
+        for i in range(1, self.nodeCount):
+            connections.setdefault(frozenset((i, self.random.randrange(i))), i)
+            others = [j for j in range(self.nodeCount) if j != i]
+            self.random.shuffle(others)
+            for j in others[:self.peerCount - 1]:
+                connections.setdefault(frozenset((i, j)), i)
+
+        for pair, i in connections.items():
+            j = min(pair - {i})
+            await self.nodes[i].connectToPeer("127.0.0.1", self.nodes[j].network.PORT)
+        while sum(len(node.network.peers) for node in self.nodes) < 2 * len(connections):
+            await asyncio.sleep(0.01)
+
+    async def sendTransactions(self):
+        for i in range(self.transactionCount):
+            sender = self.random.randrange(self.nodeCount)
+            receiver = (sender + self.random.randrange(1, self.nodeCount)) % self.nodeCount
+            publicKey, privateKey = self.keyPairs[sender]
+            transaction = Transaction(publicKey, self.keyPairs[receiver][0], 1, privateKey)
+            self.originTimes[transaction.getTransactionHashBytes().hex()] = \
+                (sender, time.perf_counter())
+            await self.nodes[sender].sendTransaction(transaction)
+            await asyncio.sleep(self.random.expovariate(1 / self.transactionInterval))
+
+    async def mineBlocks(self, nodeIndex: int, stopMining: asyncio.Event):
+        node = self.nodes[nodeIndex]
+        while not stopMining.is_set():
+            await asyncio.sleep(self.random.expovariate(
+                1 / (self.blockInterval * self.nodeCount)))
+            node.receiveUpdatedBlockchain()
+            if len(node.blockchain.pendingTransactions) == 0:
+                continue
+            minedTime = time.perf_counter()
+            for block in await node.mineBlock():
+                self.originTimes[block.blockHash] = (nodeIndex, minedTime)
+                self.minedBlockHashes.append(block.blockHash)
+
+    def getTips(self) -> set:
+        return set(node.network.blockchain.getCurrentBlock().blockHash
+                   for node in self.nodes)
+
+    # Nodes with chains of the same work keep their own chains, so the
+    # first node mines one more block to settle such ties.
+
+    async def settle(self):
+        deadline = time.perf_counter() + self.settleTimeout
+        tieBreakTime = time.perf_counter() + 2
+        while len(self.getTips()) > 1 and time.perf_counter() < deadline:
+            if time.perf_counter() > tieBreakTime:
+                node = self.nodes[0]
+                node.receiveUpdatedBlockchain()
+                node.blockchain.forceTransaction(self.keyPairs[0][0], 1)
+                await node.network.announceBlock(node.blockchain.getCurrentBlock())
+                tieBreakTime = time.perf_counter() + 2
+            await asyncio.sleep(0.05)
+
+    def getLatencies(self, itemHashes) -> list:
+        latencies = []
+        for itemHash in itemHashes:
+            originNode, originTime = self.originTimes[itemHash]
+            for nodeIndex, arrivalTime in self.arrivalTimes.get(itemHash, {}).items():
+                if nodeIndex != originNode:
+                    latencies.append(arrivalTime - originTime)
+        return latencies
+
+    async def run(self) -> dict:
+        await self.startNodes()
+        try:
+            await self.connectNodes()
+            stopMining = asyncio.Event()
+            miners = [asyncio.create_task(self.mineBlocks(i, stopMining))
+                      for i in range(self.nodeCount)]
+            await self.sendTransactions()
+            await asyncio.sleep(self.blockInterval)
+            stopMining.set()
+            await asyncio.gather(*miners)
+            await self.settle()
+            return self.getReport()
+        finally:
+            for node in self.nodes:
+                await node.stopNode()
+
+    def getReport(self) -> dict:
+        transactionHashes = [itemHash for itemHash in self.originTimes
+                             if itemHash not in self.minedBlockHashes]
+        finalChain = self.nodes[0].network.blockchain.blockchain
+        finalHashes = set(finalChain[height].blockHash for height in range(len(finalChain)))
+        orphanedBlocks = [blockHash for blockHash in self.minedBlockHashes
+                          if blockHash not in finalHashes]
+        traffic = [node.network.getTraffic() for node in self.nodes]
+        return {
+            "transactionLatencies": self.getLatencies(transactionHashes),
+            "blockLatencies": self.getLatencies(self.minedBlockHashes),
+            "bytesSent": [sent for sent, received in traffic],
+            "bytesReceived": [received for sent, received in traffic],
+            "minedBlocks": len(self.minedBlockHashes),
+            "forkRate": len(orphanedBlocks) / max(1, len(self.minedBlockHashes)),
+            "isConverged": len(self.getTips()) == 1
+        }
+
+
+def printLatencies(name: str, latencies: list):
+    print(f"{name} propagation ({len(latencies)} arrivals): " +
+          ", ".join(f"p{percentile} {getPercentile(latencies, percentile) * 1000:.1f}ms"
+                    for percentile in [50, 90, 99]))
+
+
+if __name__ == "__main__":
+    nodeCount = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    transactionCount = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print(f"Simulating {nodeCount} nodes with {transactionCount} transactions")
+    report = asyncio.run(NetworkSimulator(
+        nodeCount, transactionCount=transactionCount).run())
+    printLatencies("Transaction", report["transactionLatencies"])
+    printLatencies("Block", report["blockLatencies"])
+    for i, (sent, received) in enumerate(zip(report["bytesSent"], report["bytesReceived"])):
+        print(f"Node {i}: sent {sent / 1024:.1f} KiB, received {received / 1024:.1f} KiB")
+    print(f"Mined blocks: {report['minedBlocks']}, fork rate {report['forkRate']:.2%}, " +
+          f"converged: {report['isConverged']}")
@@ -0,0 +1,69 @@
+# ----------------------------------------------------
+# Compares the size and the encode/decode speed of the
+# JSON and the binary blockchain formats.
+# Run from the repository root:
+#   python -m benchmarks.serialization_benchmark
+# Copyright (c) 2022 Berk Kırtay
+# ----------------------------------------------------
+
+from src.Blockchain.Blockchain import Blockchain, Block
+from src.Transaction.Transaction import Transaction
+from src.Transaction.TransactionSignature import generateGenesisSignerKeyPair
+from src.DataConverter.DataConverter import DataConverter
+from datetime import datetime
+
+TRANSACTIONS_PER_BLOCK = 1000
+
+
+# Transactions are copied from one signed transaction, so that
+# large chains can be built without signing every transaction.
+
+def createBlockchain(numberOfTransactions: int) -> Blockchain:
+    publicKey, privateKey = generateGenesisSignerKeyPair()
+    template = Transaction(publicKey, "null", 1, privateKey)
+    template.calculateTransactionFee(1)
+    template.approve()
+
+    blocks = []
+    previousHash = "0" * 64
+    for blockNumber in range(numberOfTransactions // TRANSACTIONS_PER_BLOCK):
+        transactions = [Transaction.initializeTransaction(
+            template.source, template.destination, i + 1, template.gas, template.fee,
+            f"Transaction value: {i + 1}, sent by {template.source} to {template.destination}",
+            template.transactionHash,
+            template.transactionSignature, template.validationTime)
+            for i in range(TRANSACTIONS_PER_BLOCK)]
+        block = Block.initializeBlock(previousHash, "0" * 64, "0" * 64, 0, 2, 0, 0,
+                                      template.validationTime, transactions)
+        block.merkleRoot = block.generateMerkleRoot()
+        block.blockHash = block.generateBlockHash()
+        previousHash = block.blockHash
+        blocks.append(block)
+
+    return Blockchain.initializeBlockchain(2, 1, blocks, len(blocks))
+
+
+def measure(function, argument):
+    initialTime = datetime.now()
+    result = function(argument)
+    return result, (datetime.now() - initialTime).total_seconds()
+
+
+if __name__ == "__main__":
+    converter = DataConverter()
+    for numberOfTransactions in [1000, 10000, 100000]:
+        blockchain = createBlockchain(numberOfTransactions)
+
+        jsonData, jsonEncodeSeconds = measure(
+            converter.dumpBlochcainDataAsStr, blockchain)
+        jsonDecodeSeconds = measure(converter.loadBlockchainData, jsonData)[1]
+        binaryData, binaryEncodeSeconds = measure(
+            converter.dumpBlockchainDataAsBytes, blockchain)
+        binaryDecodeSeconds = measure(
+            converter.loadBlockchainDataFromBytes, binaryData)[1]
+
+        print(f"{numberOfTransactions} transactions:")
+        print(f"  json   {len(jsonData.encode('utf-8')):>11} bytes, " +
+              f"encode {jsonEncodeSeconds:.3f}s, decode {jsonDecodeSeconds:.3f}s")
+        print(f"  binary {len(binaryData):>11} bytes, " +
+              f"encode {binaryEncodeSeconds:.3f}s, decode {binaryDecodeSeconds:.3f}s")
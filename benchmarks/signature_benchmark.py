@@ -0,0 +1,41 @@
+# ----------------------------------------------------
+# Compares serial and batch signature validation of
+# pending transactions.
+# Run from the repository root:
+#   python -m benchmarks.signature_benchmark [processes]
+# Copyright (c) 2022 Berk Kırtay
+# ----------------------------------------------------
+
+from src.Transaction.Transaction import Transaction
+from src.Transaction.TransactionSignature import TransactionSignature, generateGenesisSignerKeyPair
+from datetime import datetime
+import os
+import sys
+
+
+def createValidationItems(numberOfTransactions: int, numberOfSenders: int = 50) -> list:
+    keyPairs = [generateGenesisSignerKeyPair() for i in range(numberOfSenders)]
+    items = []
+    for i in range(numberOfTransactions):
+        publicKey, privateKey = keyPairs[i % numberOfSenders]
+        transaction = Transaction(publicKey, "null", i + 1, privateKey)
+        items.append((transaction.transactionHash,
+                     transaction.transactionSignature, publicKey))
+    return items
+
+
+def measureSeconds(items: list, workers: int) -> float:
+    initialTime = datetime.now()
+    TransactionSignature().validateTransactions(items, workers)
+    return (datetime.now() - initialTime).total_seconds()
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    print(f"Batch validation with {workers} processes")
+    for numberOfTransactions in [100, 1000, 10000]:
+        items = createValidationItems(numberOfTransactions)
+        serialSeconds = measureSeconds(items, 1)
+        batchSeconds = measureSeconds(items, workers)
+        print(f"{numberOfTransactions} transactions: serial {serialSeconds:.3f}s, " +
+              f"batch {batchSeconds:.3f}s, speedup {serialSeconds / batchSeconds:.2f}x")
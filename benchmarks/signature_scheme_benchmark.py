@@ -0,0 +1,68 @@
+# ----------------------------------------------------
+# Compares the RSA and Ed25519 signature schemes: key
+# generation, signing and validation throughput and
+# the binary size of a transaction.
+# Run from the repository root:
+#   python -m benchmarks.signature_scheme_benchmark [transactions]
+# Copyright (c) 2022 Berk Kırtay
+# ----------------------------------------------------
+
+from src.Transaction.Transaction import Transaction
+from src.Transaction.TransactionSignature import TransactionSignature, generateKeyPair, \
+    clearKeyCache, SIGNATURE_SCHEMES
+from src.DataConverter import BinaryConverter
+from datetime import datetime
+import sys
+
+
+def measureSeconds(function, *args) -> float:
+    initialTime = datetime.now()
+    function(*args)
+    return (datetime.now() - initialTime).total_seconds()
+
+
+def generateKeyPairs(signatureScheme: int, numberOfKeyPairs: int) -> list:
+    return [generateKeyPair(signatureScheme) for i in range(numberOfKeyPairs)]
+
+
+# Keys are parsed once and then served from the key cache, the same
+# as a node that sees many transactions of the same wallets.
+
+def signTransactions(signatureScheme: int, keyPairs: list, numberOfTransactions: int) -> list:
+    transactions = []
+    for i in range(numberOfTransactions):
+        publicKey, privateKey = keyPairs[i % len(keyPairs)]
+        transactions.append(Transaction(publicKey, keyPairs[0][0], i + 1, privateKey,
+                                        signatureScheme=signatureScheme))
+    return transactions
+
+
+def validateTransactions(transactions: list):
+    TransactionSignature().validateTransactions(
+        [(transaction.transactionHash, transaction.transactionSignature, transaction.source,
+          transaction.signatureScheme) for transaction in transactions])
+
+
+def getTransactionSize(transaction) -> int:
+    return len(BinaryConverter.encodeTransaction(transaction.getApprovedCopy()))
+
+
+if __name__ == "__main__":
+    numberOfTransactions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    numberOfKeyPairs = 20
+    for signatureScheme, scheme in SIGNATURE_SCHEMES.items():
+        clearKeyCache()
+        keygenSeconds = measureSeconds(generateKeyPairs, signatureScheme, numberOfKeyPairs)
+        keyPairs = generateKeyPairs(signatureScheme, numberOfKeyPairs)
+
+        initialTime = datetime.now()
+        transactions = signTransactions(signatureScheme, keyPairs, numberOfTransactions)
+        signSeconds = (datetime.now() - initialTime).total_seconds()
+        validateSeconds = measureSeconds(validateTransactions, transactions)
+
+        print(f"{scheme.name}: keygen {numberOfKeyPairs / keygenSeconds:.0f}/s, " +
+              f"sign {numberOfTransactions / signSeconds:.0f}/s, " +
+              f"verify {numberOfTransactions / validateSeconds:.0f}/s, " +
+              f"public key {len(keyPairs[0][0])} chars, " +
+              f"signature {len(transactions[0].transactionSignature)} bytes, " +
+              f"transaction {getTransactionSize(transactions[0])} bytes")
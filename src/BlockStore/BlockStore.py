@@ -0,0 +1,122 @@
+# ---------------------------------------------------------
+# Append-only block store. Every new block is appended to a
+# segment file as a length prefixed record and its offset is
+# written to an index file with fixed size entries, so a
+# block is persisted in O(1) and any block is read by its
+# height without reading the rest of the chain.
+# Copyright (c) 2022 Berk Kırtay
+# ---------------------------------------------------------
+
+from src.DataConverter.DataConverter import DataConverter
+import mmap
+import os
+import pathlib
+import struct
+
+# Segment records: payload length and payload.
+# Index entries: segment offset and payload length of each block.
+RECORD_HEADER = struct.Struct(">I")
+INDEX_ENTRY = struct.Struct(">QI")
+
+
+class BlockStore():
+    folderName = './block_store/'
+    blockCount = 0
+    supportsQueries = False
+
+    def __init__(self, folderName: str = './block_store/'):
+        self.folderName = folderName
+        pathlib.Path(folderName).mkdir(parents=True, exist_ok=True)
+        self.segmentFile = open(folderName + 'blocks.dat', 'a+b')
+        self.indexFile = open(folderName + 'blocks.idx', 'a+b')
+        self.segmentMap = None
+        self.converter = DataConverter()
+        self.blockCount = os.fstat(
+            self.indexFile.fileno()).st_size // INDEX_ENTRY.size
+
+    def __len__(self) -> int:
+        return self.blockCount
+
+    def __iter__(self):
+        return self.readBlocks()
+
+    def appendBlock(self, block) -> int:
+        height = self.blockCount
+        payload = self.encodeBlock(block)
+
+        offset = self.segmentFile.seek(0, os.SEEK_END)
+        self.segmentFile.write(RECORD_HEADER.pack(len(payload)) + payload)
+        self.segmentFile.flush()
+
+        self.indexFile.write(INDEX_ENTRY.pack(offset, len(payload)))
+        self.indexFile.flush()
+
+        self.blockCount += 1
+        return height
+
+    def readBlock(self, height: int):
+        return self.decodeBlock(self.readPayload(height))
+
+    def readBlocks(self, firstHeight: int = 0):
+        for height in range(firstHeight, self.blockCount):
+            yield self.readBlock(height)
+
+    # Returns the stored record of a block as a memoryview
+    # over the memory mapped segment file.
+
+    def readPayload(self, height: int) -> memoryview:
+        if height < 0:
+            height += self.blockCount
+        if height < 0 or height >= self.blockCount:
+            raise IndexError("Block height is out of the block store!")
+
+        self.indexFile.seek(height * INDEX_ENTRY.size)
+        offset, length = INDEX_ENTRY.unpack(
+            self.indexFile.read(INDEX_ENTRY.size))
+
+        start = offset + RECORD_HEADER.size
+        return memoryview(self.getSegmentMap(start + length))[start:start + length]
+
+    # Removes the blocks from the given height to the end, e.g. when
+    # the blockchain drops its invalid blocks.
+
+    def truncate(self, height: int):
+        if height >= self.blockCount:
+            return
+
+        self.indexFile.seek(height * INDEX_ENTRY.size)
+        offset = INDEX_ENTRY.unpack(self.indexFile.read(INDEX_ENTRY.size))[0]
+
+        self.closeSegmentMap()
+        self.segmentFile.truncate(offset)
+        self.indexFile.truncate(height * INDEX_ENTRY.size)
+        self.blockCount = height
+
+    def close(self):
+        self.closeSegmentMap()
+        self.segmentFile.close()
+        self.indexFile.close()
+
+    # The segment file grows with every block, so it is mapped
+    # again when a record is beyond the current mapping.
+
+    def getSegmentMap(self, size: int) -> mmap.mmap:
+        if self.segmentMap is None or len(self.segmentMap) < size:
+            self.closeSegmentMap()
+            self.segmentMap = mmap.mmap(
+                self.segmentFile.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.segmentMap
+
+    def closeSegmentMap(self):
+        if self.segmentMap is not None:
+            self.segmentMap.close()
+            self.segmentMap = None
+
+    # Blocks are stored in the binary block format and decoded
+    # straight from the memory map.
+
+    def encodeBlock(self, block) -> bytes:
+        return self.converter.dumpBlockAsBytes(block)
+
+    def decodeBlock(self, payload: memoryview):
+        return self.converter.loadBlockFromBytes(payload)
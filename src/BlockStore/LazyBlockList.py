@@ -0,0 +1,89 @@
+# ----------------------------------------------------------
+# Block list of a blockchain that lives in a block store.
+# Only the tip and a bounded LRU cache of recently used
+# blocks are kept in memory, older blocks are read from the
+# store when they are needed. The list writes new blocks to
+# the store itself, so the chain's memory stays bounded.
+# Copyright (c) 2022 Berk Kırtay
+# ----------------------------------------------------------
+
+from collections import OrderedDict
+
+
+class LazyBlockList():
+    blockStore = None
+    cacheSize = 128
+    tip = None
+
+    def __init__(self, blockStore, cacheSize: int = 128):
+        self.blockStore = blockStore
+        self.cacheSize = cacheSize
+        self.blockCache = OrderedDict()
+        self.tip = None
+        if len(blockStore) > 0:
+            self.tip = blockStore.readBlock(-1)
+
+    def __len__(self) -> int:
+        return len(self.blockStore)
+
+    def __getitem__(self, index: int):
+        height = self.normalizeIndex(index)
+        if height == len(self) - 1:
+            return self.tip
+
+        if height in self.blockCache:
+            self.blockCache.move_to_end(height)
+            return self.blockCache[height]
+
+        block = self.blockStore.readBlock(height)
+        self.cacheBlock(height, block)
+        return block
+
+    # Iterating over the whole chain reads the blocks in order without
+    # putting them in the cache, so a full scan doesn't flush it.
+
+    def __iter__(self):
+        length = len(self)
+        for height in range(length - 1):
+            if height in self.blockCache:
+                yield self.blockCache[height]
+            else:
+                yield self.blockStore.readBlock(height)
+        if length > 0:
+            yield self.tip
+
+    def append(self, block):
+        if self.tip is not None:
+            self.cacheBlock(len(self) - 1, self.tip)
+        self.blockStore.appendBlock(block)
+        self.tip = block
+
+    def pop(self):
+        if len(self) == 0:
+            raise IndexError("pop from an empty blockchain")
+
+        block = self.tip
+        self.blockStore.truncate(len(self) - 1)
+        self.tip = None
+        if len(self) > 0:
+            self.tip = self.blockCache.pop(len(self) - 1, None)
+            if self.tip is None:
+                self.tip = self.blockStore.readBlock(-1)
+        return block
+
+    def clear(self):
+        self.blockStore.truncate(0)
+        self.blockCache.clear()
+        self.tip = None
+
+    def cacheBlock(self, height: int, block):
+        self.blockCache[height] = block
+        self.blockCache.move_to_end(height)
+        while len(self.blockCache) > self.cacheSize:
+            self.blockCache.popitem(last=False)
+
+    def normalizeIndex(self, index: int) -> int:
+        height = index + len(self) if index < 0 else index
+        if height < 0 or height >= len(self):
+            raise IndexError("Block index is out of the blockchain!")
+        return height
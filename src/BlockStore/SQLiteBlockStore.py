@@ -0,0 +1,180 @@
+# ---------------------------------------------------------
+# SQLite block store. Blocks and their transactions are kept
+# in indexed tables, so the transactions of an address or a
+# transaction hash are found without walking the chain.
+# It has the same interface as BlockStore and can be used
+# anywhere a block store is used.
+# Copyright (c) 2022 Berk Kırtay
+# ---------------------------------------------------------
+
+from src.DataConverter.DataConverter import DataConverter
+import sqlite3
+
+# Amount columns have no declared type, so SQLite keeps
+# integers and floats as they are given.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    height INTEGER PRIMARY KEY,
+    blockHash TEXT NOT NULL,
+    previousHash TEXT NOT NULL,
+    merkleRoot TEXT NOT NULL,
+    blockNonce INTEGER NOT NULL,
+    hashDifficulty INTEGER NOT NULL,
+    blockBalance,
+    blockFee,
+    validationTime TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    height INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    balance,
+    gas,
+    fee,
+    transactionMessage TEXT,
+    transactionHash TEXT NOT NULL,
+    transactionSignature TEXT,
+    validationTime TEXT,
+    signatureScheme INTEGER NOT NULL DEFAULT 0,
+    transactionNonce INTEGER,
+    PRIMARY KEY (height, position)
+);
+CREATE INDEX IF NOT EXISTS blockHashIndex ON blocks (blockHash);
+CREATE INDEX IF NOT EXISTS sourceIndex ON transactions (source);
+CREATE INDEX IF NOT EXISTS destinationIndex ON transactions (destination);
+CREATE INDEX IF NOT EXISTS transactionHashIndex ON transactions (transactionHash);
+"""
+
+TRANSACTION_COLUMNS = "height, source, destination, balance, gas, fee, transactionMessage, " + \
+    "transactionHash, transactionSignature, validationTime, signatureScheme, transactionNonce"
+
+
+class SQLiteBlockStore():
+    databasePath = './blockchain.db'
+    blockCount = 0
+    supportsQueries = True
+
+    def __init__(self, databasePath: str = './blockchain.db'):
+        self.databasePath = databasePath
+        self.connection = sqlite3.connect(databasePath)
+        self.connection.executescript(SCHEMA)
+        self.converter = DataConverter()
+        self.blockCount = self.connection.execute(
+            "SELECT COUNT(*) FROM blocks").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self.blockCount
+
+    def __iter__(self):
+        return self.readBlocks()
+
+    # A block and all of its transactions are inserted
+    # in a single database transaction.
+
+    def appendBlock(self, block) -> int:
+        height = self.blockCount
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (height, block.blockHash, block.previousBlockHash, block.merkleRoot,
+                 block.blockNonce, block.hashDifficulty, block.blockBalance,
+                 block.blockFee, block.validationTime))
+            self.connection.executemany(
+                "INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(height, position, transaction.source, transaction.destination,
+                  transaction.balance, transaction.gas, transaction.fee,
+                  transaction.transactionMessage, transaction.transactionHash,
+                  transaction.transactionSignature, transaction.validationTime,
+                  transaction.signatureScheme, transaction.transactionNonce)
+                 for position, transaction in enumerate(block.blockTransactions)])
+
+        self.blockCount += 1
+        return height
+
+    def readBlock(self, height: int):
+        if height < 0:
+            height += self.blockCount
+        if height < 0 or height >= self.blockCount:
+            raise IndexError("Block height is out of the block store!")
+
+        row = self.connection.execute(
+            "SELECT previousHash, blockHash, merkleRoot, blockNonce, hashDifficulty, " +
+            "blockBalance, blockFee, validationTime FROM blocks WHERE height = ?",
+            (height,)).fetchone()
+        transactionRows = self.connection.execute(
+            f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE height = ? ORDER BY position",
+            (height,)).fetchall()
+
+        return self.converter.loadBlock({
+            "previousHash": row[0],
+            "blockHash": row[1],
+            "merkleRoot": row[2],
+            "blockNonce": row[3],
+            "hashDifficulty": row[4],
+            "blockBalance": row[5],
+            "blockFee": row[6],
+            "validationTime": row[7],
+            "blockTransactions": [self.transactionRecord(transactionRow)
+                                  for transactionRow in transactionRows]
+        })
+
+    def readBlocks(self, firstHeight: int = 0):
+        for height in range(firstHeight, self.blockCount):
+            yield self.readBlock(height)
+
+    def truncate(self, height: int):
+        if height >= self.blockCount:
+            return
+
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM transactions WHERE height >= ?", (height,))
+            self.connection.execute(
+                "DELETE FROM blocks WHERE height >= ?", (height,))
+        self.blockCount = height
+
+    def close(self):
+        self.connection.close()
+
+    # Queries return {"blockNumber": ..., "transaction": ...} dicts,
+    # in the order of the chain.
+
+    def getTransactionsOfAddress(self, address: str) -> list:
+        rows = self.connection.execute(
+            f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE rowid IN (" +
+            "SELECT rowid FROM transactions WHERE source = ? " +
+            "UNION SELECT rowid FROM transactions WHERE destination = ?) " +
+            "ORDER BY height, position",
+            (address, address)).fetchall()
+        return [self.transactionResult(row) for row in rows]
+
+    def findTransaction(self, transactionHash: str):
+        row = self.connection.execute(
+            f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE transactionHash = ? " +
+            "ORDER BY height, position LIMIT 1",
+            (transactionHash,)).fetchone()
+        if row is None:
+            return None
+        return self.transactionResult(row)
+
+    def transactionResult(self, row) -> dict:
+        return {
+            "blockNumber": row[0],
+            "transaction": self.converter.loadTransaction(self.transactionRecord(row))
+        }
+
+    def transactionRecord(self, row) -> dict:
+        return {
+            "source": row[1],
+            "destination": row[2],
+            "balance": row[3],
+            "gas": row[4],
+            "fee": row[5],
+            "transactionMessage": row[6],
+            "transactionHash": row[7],
+            "transactionSignature": row[8],
+            "validationTime": row[9],
+            "signatureScheme": row[10],
+            "transactionNonce": row[11]
+        }
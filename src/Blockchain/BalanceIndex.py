@@ -0,0 +1,114 @@
+# -----------------------------------------------------
+# In-memory balance index of the blockchain addresses.
+# Confirmed balances are updated once per block and
+# pending balances once per pending transaction, so a
+# balance is read without walking the whole chain.
+# The hashes of the confirmed transactions of the
+# recent blocks are kept too, and the older ones are
+# remembered in a bloom filter, so a confirmed
+# transaction can't be replayed.
+# Copyright (c) 2022 Berk Kırtay
+# -----------------------------------------------------
+
+from src.BloomFilter.BloomFilter import BloomFilter
+from collections import deque
+
+# The filter of the older transactions has a fixed size. Past this many
+# transactions it gives more false positives, which only cost a lookup.
+OLDER_TRANSACTION_CAPACITY = 100000
+
+
+class BalanceIndex():
+    confirmedBalances = {}
+    pendingBalances = {}
+    recentBlockCount = 100
+
+    def __init__(self, recentBlockCount: int = 100):
+        self.confirmedBalances = {}
+        self.pendingBalances = {}
+        self.recentBlockCount = recentBlockCount
+        self.resetConfirmedTransactions()
+
+    def getBalance(self, address: str):
+        return self.confirmedBalances.get(address, 0) + \
+            self.pendingBalances.get(address, 0)
+
+    # Only the transactions of the recent blocks are kept,
+    # older ones are looked up with mayBeConfirmedBefore.
+
+    def isConfirmed(self, transactionHash: bytes) -> bool:
+        return transactionHash in self.recentTransactions
+
+    # False when the transaction isn't in a block before the recent ones.
+    # True means that it may be, the blocks have to be searched for it.
+
+    def mayBeConfirmedBefore(self, transactionHash: bytes) -> bool:
+        return transactionHash.hex() in self.olderTransactions
+
+    def applyBlock(self, block):
+        transactionHashes = []
+        for transaction in block.blockTransactions:
+            self.applyTransaction(self.confirmedBalances, transaction, 1)
+            transactionHashes.append(transaction.getTransactionHashBytes())
+        self.countTransactions(transactionHashes, 1)
+        self.recentBlocks.append(transactionHashes)
+
+        if len(self.recentBlocks) > self.recentBlockCount:
+            olderHashes = self.recentBlocks.popleft()
+            self.countTransactions(olderHashes, -1)
+            for transactionHash in olderHashes:
+                self.olderTransactions.add(transactionHash.hex())
+
+    # A block is reverted from the top of the chain. A block that is
+    # older than the recent blocks stays in the filter, its lookup
+    # doesn't find it in the blocks anymore.
+
+    def revertBlock(self, block):
+        for transaction in block.blockTransactions:
+            self.applyTransaction(self.confirmedBalances, transaction, -1)
+        if len(self.recentBlocks) > 0:
+            self.countTransactions(self.recentBlocks.pop(), -1)
+
+    def countTransactions(self, transactionHashes: list, direction: int):
+        for transactionHash in transactionHashes:
+            count = self.recentTransactions.get(transactionHash, 0) + direction
+            if count == 0:
+                self.recentTransactions.pop(transactionHash, None)
+            else:
+                self.recentTransactions[transactionHash] = count
+
+    def resetConfirmedTransactions(self):
+        self.recentBlocks = deque()
+        self.recentTransactions = {}
+        self.olderTransactions = BloomFilter(OLDER_TRANSACTION_CAPACITY)
+
+    def addPendingTransaction(self, transaction):
+        self.applyTransaction(self.pendingBalances, transaction, 1)
+
+    def removePendingTransaction(self, transaction):
+        self.applyTransaction(self.pendingBalances, transaction, -1)
+
+    def rebuild(self, blocks, pendingTransactions):
+        self.confirmedBalances = {}
+        self.pendingBalances = {}
+        self.resetConfirmedTransactions()
+        for block in blocks:
+            self.applyBlock(block)
+        for transaction in pendingTransactions:
+            self.addPendingTransaction(transaction)
+
+    # Destination receives the balance and source pays the balance
+    # with the fee. Direction is -1 when a transaction is taken back.
+
+    def applyTransaction(self, balances: dict, transaction, direction: int):
+        self.updateBalance(balances, transaction.destination,
+                           direction * transaction.balance)
+        self.updateBalance(balances, transaction.source,
+                           -direction * (transaction.balance + transaction.fee))
+
+    def updateBalance(self, balances: dict, address: str, amount):
+        balance = balances.get(address, 0) + amount
+        if balance == 0:
+            balances.pop(address, None)
+        else:
+            balances[address] = balance
@@ -33,19 +33,32 @@ SOFTWARE.
 from src.BlockchainExceptionHandler.BlockchainExceptionHandler import *
 from src.BlockchainLogger.BlockchainLogger import initializeLogger, logging
 from src.Transaction.Transaction import Transaction
-from src.Transaction.TransactionSignature import TransactionSignature, generateGenesisSignerKeyPair
+from src.Transaction.TransactionSignature import TransactionSignature
+from src.KeyPairPool.KeyPairPool import getKeyPairPool
+from src.MerkleTree.MerkleTree import MerkleTree, verifyMerkleProof
+from src.Blockchain.BalanceIndex import BalanceIndex
+from src.Mempool.Mempool import Mempool
+from src.BlockStore.LazyBlockList import LazyBlockList
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from Crypto.Hash import SHA256
 from datetime import datetime
+import hashlib
+import multiprocessing
 import random
 import string
+import struct
 
 
 class GenesisBlockKeyProvider():
     GENESIS_BLOCK_PRIVATE_KEY = ""
     GENESIS_BLOCK_PUBLIC_KEY = ""
 
+    # Key pairs come from the shared pool, which generates them in the background.
+
     def __init__(self):
-        key_pair = generateGenesisSignerKeyPair()
+        key_pair = getKeyPairPool().getKeyPair()
         self.GENESIS_BLOCK_PUBLIC_KEY = key_pair[0]
         self.GENESIS_BLOCK_PRIVATE_KEY = key_pair[1]
 
@@ -57,9 +70,150 @@ class GenesisBlockKeyProvider():
 
 
 KEY_PAIR = None
+MINING_EXECUTOR = None
+MINING_EXECUTOR_PROCESSES = 0
+MINING_STOP_EVENT = None
+
+# Set in the mining processes only, the main process searches to the end.
+SEARCH_STOP_EVENT = None
+
+# Nonces are checked in batches of this size between other work.
+NONCE_BATCH_SIZE = 2048
+
+# Each mining process checks up to this many nonces in a round of the
+# parallel proof of work before the results are collected. A round
+# ends early when one of the processes finds a valid hash.
+MINING_ROUND_SIZE = 8 * NONCE_BATCH_SIZE
+
+# Blocks are hashed over a fixed size binary header. The header commits
+# to the transactions with their merkle root, so the transactions are
+# serialized once per block instead of once per nonce. The nonce is
+# the last field, which lets miners cache the hash state of the prefix.
+# Layout: version, previous block hash, merkle root,
+# validation time (HH:MM:SS), hash difficulty and nonce.
+BLOCK_HEADER_VERSION = 1
+BLOCK_HEADER_PREFIX = struct.Struct(">B32s32s8sH")
+BLOCK_HEADER_NONCE = struct.Struct(">Q")
+BLOCK_HEADER_SIZE = BLOCK_HEADER_PREFIX.size + BLOCK_HEADER_NONCE.size
+
+# Undo entries are kept for this many of the last blocks.
+MAX_REORG_DEPTH = 100
 
 initializeLogger()
 
+
+# Block rewards and forced transactions are signed with the genesis key
+# pair. A chain that is loaded from stored data has no genesis key pair
+# of its own, so one is only generated when it is needed.
+
+def getGenesisKeyPair() -> GenesisBlockKeyProvider:
+    global KEY_PAIR
+    if KEY_PAIR is None:
+        KEY_PAIR = GenesisBlockKeyProvider()
+    return KEY_PAIR
+
+
+# Tries nonceCount nonces starting from startNonce and returns the first
+# nonce with its hash that meets the difficulty (or None) together with
+# the number of hashes generated. In a mining process, the stop event
+# is checked after every batch of nonces, so the search is given up
+# once another process has found a valid hash.
+
+def searchNonces(headerPrefix: bytes, hashDifficulty: int, startNonce: int,
+                 nonceStep: int, nonceCount: int):
+    target = "0" * hashDifficulty
+    prefixState = hashlib.sha256(headerPrefix)
+    packNonce = BLOCK_HEADER_NONCE.pack
+    nonce = startNonce
+    checkedCount = 0
+
+    while checkedCount < nonceCount:
+        if SEARCH_STOP_EVENT is not None and SEARCH_STOP_EVENT.is_set():
+            break
+        batchEnd = min(checkedCount + NONCE_BATCH_SIZE, nonceCount)
+        for i in range(checkedCount, batchEnd):
+            hashState = prefixState.copy()
+            hashState.update(packNonce(nonce))
+            blockHash = hashState.hexdigest()
+            if blockHash.startswith(target):
+                return nonce, blockHash, i + 1
+            nonce += nonceStep
+        checkedCount = batchEnd
+
+    return None, None, checkedCount
+
+
+def setSearchStopEvent(stopEvent):
+    global SEARCH_STOP_EVENT
+    SEARCH_STOP_EVENT = stopEvent
+
+
+# Mining processes are started once and reused for every block. A new
+# pool is started when the number of processes changes or when the
+# pool is shut down because one of its processes has died. Every pool
+# shares a stop event with its processes, which is handed to them when
+# they are started.
+
+def getMiningExecutor(processes: int) -> ProcessPoolExecutor:
+    global MINING_EXECUTOR, MINING_EXECUTOR_PROCESSES, MINING_STOP_EVENT
+    if MINING_EXECUTOR is None or MINING_EXECUTOR_PROCESSES != processes:
+        shutdownMiningExecutor()
+        MINING_STOP_EVENT = multiprocessing.Event()
+        MINING_EXECUTOR = ProcessPoolExecutor(
+            processes, initializer=setSearchStopEvent, initargs=(MINING_STOP_EVENT,))
+        MINING_EXECUTOR_PROCESSES = processes
+    return MINING_EXECUTOR
+
+
+def getMiningStopEvent():
+    return MINING_STOP_EVENT
+
+
+def shutdownMiningExecutor():
+    global MINING_EXECUTOR, MINING_EXECUTOR_PROCESSES, MINING_STOP_EVENT
+    if MINING_EXECUTOR is not None:
+        MINING_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    MINING_EXECUTOR = None
+    MINING_EXECUTOR_PROCESSES = 0
+    MINING_STOP_EVENT = None
+
+
+# Checks that a transaction is in a block by only using the block header
+# and the proof given by Block.getMerkleProof.
+
+def verifyTransactionProof(transactionHash: str, proof: list, blockHeader: bytes) -> bool:
+    merkleRoot = BLOCK_HEADER_PREFIX.unpack_from(blockHeader)[2].hex()
+    return verifyMerkleProof(transactionHash, proof, merkleRoot)
+
+
+# A block hash must start with hashDifficulty zero hex digits, so a
+# block takes 16 ** hashDifficulty hashes on average. The chain with
+# the most accumulated work is the best chain, not the longest one.
+
+def getBlockWork(hashDifficulty: int) -> int:
+    return 16 ** hashDifficulty
+
+
+# The lowest difficulty a block at the given height can have. It follows
+# insertBlockAndReevaluateDifficulty, which raises the difficulty by one
+# for every 100 blocks after the genesis block, unless it starts at 0.
+
+def getExpectedHashDifficulty(genesisHashDifficulty: int, height: int) -> int:
+    if genesisHashDifficulty == 0 or height == 0:
+        return genesisHashDifficulty
+    return max(genesisHashDifficulty, (height - 1) // 100 + 1)
+
+
+# Splits a block header into the previous block hash, merkle root,
+# hash difficulty and nonce. The block hash is the hash of the header.
+
+def decodeBlockHeader(blockHeader: bytes):
+    version, previousBlockHash, merkleRoot, validationTime, hashDifficulty = \
+        BLOCK_HEADER_PREFIX.unpack_from(blockHeader)
+    blockNonce = BLOCK_HEADER_NONCE.unpack_from(
+        blockHeader, BLOCK_HEADER_PREFIX.size)[0]
+    return previousBlockHash.hex(), merkleRoot.hex(), hashDifficulty, blockNonce
+
 # Every block keeps previous block's hash for validation between blocks.
 # We create a hash code based on previous block's hash,
 # block's validation time and transactions.
@@ -76,23 +230,84 @@ class Block():
     validationTime = None
     blockTransactionCapacity = 1000
     blockTransactions = []
+    merkleRoot = ''
+    merkleTree = None
+    miningProcesses = 1
 
     # Each block has its unique hash string which is being generated
     # with all the essential information in the block.
 
-    def __init__(self, previousBlockHash: str, hashDifficulty: int, blockTransactions: list):
+    def __init__(self, previousBlockHash: str, hashDifficulty: int, blockTransactions: list,
+                 miningProcesses: int = 1):
         self.hashDifficulty = hashDifficulty
+        self.miningProcesses = miningProcesses
         self.previousBlockHash = previousBlockHash
         self.blockTransactions = blockTransactions
         self.validationTime = datetime.now().strftime("%H:%M:%S")
         self.calculateBlockFeeAndBalance()
+        self.merkleRoot = self.generateMerkleRoot()
         self.blockHash = self.generateBlockHash()
         self.proofOfWork()
 
+    # Builds a block directly from its stored fields,
+    # without mining or hashing it again.
+
+    @classmethod
+    def initializeBlock(self, previousBlockHash: str, blockHash: str, merkleRoot: str,
+                        blockNonce: int, hashDifficulty: int, blockBalance, blockFee,
+                        validationTime: str, blockTransactions: list):
+        block = self.__new__(self)
+        block.previousBlockHash = previousBlockHash
+        block.blockHash = blockHash
+        block.merkleRoot = merkleRoot
+        block.blockNonce = blockNonce
+        block.hashDifficulty = hashDifficulty
+        block.blockBalance = blockBalance
+        block.blockFee = blockFee
+        block.validationTime = validationTime
+        block.blockTransactions = blockTransactions
+        return block
+
     def generateBlockHash(self):
-        stream = str(self.previousBlockHash) + self.validationTime + \
-            str(self.blockTransactions) + str(self.blockNonce)
-        return SHA256.new(stream.encode('utf-8')).hexdigest()
+        return hashlib.sha256(self.generateBlockHeader()).hexdigest()
+
+    def generateBlockHeader(self) -> bytes:
+        return self.generateHeaderPrefix() + BLOCK_HEADER_NONCE.pack(self.blockNonce)
+
+    # Everything in the block header except the nonce.
+    def generateHeaderPrefix(self) -> bytes:
+        return BLOCK_HEADER_PREFIX.pack(
+            BLOCK_HEADER_VERSION,
+            bytes.fromhex(self.previousBlockHash),
+            bytes.fromhex(self.merkleRoot),
+            self.validationTime.encode('ascii'),
+            self.hashDifficulty)
+
+    # The merkle root is always rebuilt from the transactions,
+    # so it can be compared against the root in the header.
+
+    def generateMerkleRoot(self) -> str:
+        return MerkleTree([transaction.getTransactionHashBytes()
+                           for transaction in self.blockTransactions]).getRoot()
+
+    # A transaction can't be confirmed twice by the same block.
+
+    def hasRepeatedTransactions(self) -> bool:
+        transactionHashes = set(transaction.getTransactionHashBytes()
+                                for transaction in self.blockTransactions)
+        return len(transactionHashes) != len(self.blockTransactions)
+
+    # Returns the merkle proof of a transaction in this block
+    # or None if the transaction isn't in the block.
+
+    def getMerkleProof(self, transactionHash: str):
+        for i in range(len(self.blockTransactions)):
+            if self.blockTransactions[i].transactionHash == transactionHash:
+                if self.merkleTree is None:
+                    self.merkleTree = MerkleTree([transaction.getTransactionHashBytes()
+                                                  for transaction in self.blockTransactions])
+                return self.merkleTree.getProof(i)
+        return None
 
     # This is the block mining section. It generates hashes according to the difficulty
     # and guarantees the security of the blockchain with the work done.
@@ -101,13 +316,68 @@ class Block():
 
     def proofOfWork(self):
         initialTime = datetime.now()
-        while self.blockHash[:self.hashDifficulty] != "0" * self.hashDifficulty:
-            self.blockNonce += 1
-            self.blockHash = self.generateBlockHash()
+        hashCount = 1
+        if self.miningProcesses > 1 and not self.isHashValid(self.blockHash):
+            try:
+                hashCount += self.parallelProofOfWork()
+            except BrokenProcessPool:
+                shutdownMiningExecutor()
+                logging.warning("A mining process has died, the block is mined in this process.")
+
+        if not self.isHashValid(self.blockHash):
+            headerPrefix = self.generateHeaderPrefix()
+            while not self.isHashValid(self.blockHash):
+                nonce, blockHash, batchHashCount = searchNonces(
+                    headerPrefix, self.hashDifficulty, self.blockNonce + 1, 1, NONCE_BATCH_SIZE)
+                hashCount += batchHashCount
+                if nonce is None:
+                    self.blockNonce += NONCE_BATCH_SIZE
+                else:
+                    self.blockNonce, self.blockHash = nonce, blockHash
 
         finalTime = datetime.now() - initialTime
+        miningSeconds = finalTime.total_seconds()
+        hashRate = hashCount / miningSeconds if miningSeconds > 0 else hashCount
         logging.info(
-            f"Block hash = {self.blockHash} is mined in {finalTime.total_seconds()} seconds.")
+            f"Block hash = {self.blockHash} is mined in {miningSeconds} seconds. " +
+            f"Hash rate: {hashRate:.0f} H/s with {self.miningProcesses} process(es).")
+
+    # Splits the nonce search between a reused pool of processes and
+    # returns the total number of hashes they have generated. In every
+    # round, each process starts from a different nonce and jumps by the
+    # number of processes, so the nonce space is split between them
+    # without any overlap. As soon as one process finds a valid hash, the
+    # stop event is set and the other processes give up the rest of the
+    # round. The pool raises BrokenProcessPool when one of its processes
+    # dies, so a lost process can't make the miner wait.
+
+    def parallelProofOfWork(self) -> int:
+        headerPrefix = self.generateHeaderPrefix()
+        executor = getMiningExecutor(self.miningProcesses)
+        stopEvent = getMiningStopEvent()
+        roundNonce = self.blockNonce + 1
+        hashCount = 0
+        foundNonces = []
+        while len(foundNonces) == 0:
+            stopEvent.clear()
+            searches = [executor.submit(searchNonces, headerPrefix, self.hashDifficulty,
+                                        roundNonce + i, self.miningProcesses, MINING_ROUND_SIZE)
+                        for i in range(self.miningProcesses)]
+            for search in as_completed(searches):
+                nonce, blockHash, searchHashCount = search.result()
+                hashCount += searchHashCount
+                if nonce is not None:
+                    stopEvent.set()
+                    foundNonces.append((nonce, blockHash))
+            roundNonce += self.miningProcesses * MINING_ROUND_SIZE
+
+        # More than one process can find a hash before they stop, the
+        # smallest nonce is kept to stay close to the serial search.
+        self.blockNonce, self.blockHash = min(foundNonces)
+        return hashCount
+
+    def isHashValid(self, blockHash: str) -> bool:
+        return blockHash[:self.hashDifficulty] == "0" * self.hashDifficulty
 
     def calculateBlockFeeAndBalance(self):
         for transaction in self.blockTransactions:
@@ -115,6 +385,25 @@ class Block():
             self.blockBalance += transaction.balance
 
 
+# What is needed to roll back a block besides its transactions:
+# the difficulty and chain size before the block and the transactions
+# of the block that go back to the mempool, which are all of them
+# except the block reward.
+
+class BlockUndoEntry():
+    blockHash = ''
+    hashDifficulty = 0
+    chainSize = 0
+    mempoolTransactions = []
+
+    def __init__(self, blockHash: str, hashDifficulty: int, chainSize: int,
+                 mempoolTransactions: list):
+        self.blockHash = blockHash
+        self.hashDifficulty = hashDifficulty
+        self.chainSize = chainSize
+        self.mempoolTransactions = mempoolTransactions
+
+
 class Blockchain():
     blockchain = []
     hashDifficulty = 0
@@ -122,13 +411,49 @@ class Blockchain():
     chainSize = 0
     pendingTransactions = []
     lastBlockLog = ''
+    miningProcesses = 1
+    verificationProcesses = 1
+    validatedHeight = 0
+    balanceIndex = None
+    blockStore = None
+    chainWork = 0
+    undoJournal = None
 
     # Setting up blockchain's general features.
-
-    def __init__(self, hashDifficulty: int, gasPrice: int = 1):
+    # Blocks are mined with a pool of miningProcesses
+    # processes when it is greater than one. Pending transactions
+    # are kept in a fee ordered mempool of mempoolCapacity and their
+    # signatures are validated by verificationProcesses processes.
+    # When a blockStore is given, every new block is also appended to it.
+    # With a blockCacheSize, the blocks are only kept in the store and
+    # at most blockCacheSize of them are cached in memory.
+    # A new blockchain starts the store over from its genesis block, so a
+    # store that has blocks is only overwritten with overwriteBlockStore.
+    # Use initializeBlockchain to go on with the blocks of a store.
+
+    def __init__(self, hashDifficulty: int, gasPrice: int = 1, miningProcesses: int = 1,
+                 mempoolCapacity: int = 10000, verificationProcesses: int = 1,
+                 blockStore=None, blockCacheSize: int = 0, overwriteBlockStore: bool = False):
+        if blockStore is not None and len(blockStore) > 0 and not overwriteBlockStore:
+            raise BlockStoreError(
+                "Block store has blocks! Load them with initializeBlockchain instead.")
         self.hashDifficulty = hashDifficulty
         self.gasPrice = gasPrice
-        self.blockchain = [self.createGenesisBlock()]
+        self.miningProcesses = miningProcesses
+        self.verificationProcesses = verificationProcesses
+        self.pendingTransactions = Mempool(mempoolCapacity)
+        self.balanceIndex = BalanceIndex(MAX_REORG_DEPTH)
+        self.blockStore = blockStore
+        self.undoJournal = deque(maxlen=MAX_REORG_DEPTH)
+        self.blockchain = []
+        if blockStore is not None and blockCacheSize > 0:
+            self.blockchain = LazyBlockList(blockStore, blockCacheSize)
+            self.blockchain.clear()
+
+        self.blockchain.append(self.createGenesisBlock())
+        self.balanceIndex.applyBlock(self.blockchain[0])
+        self.chainWork = getBlockWork(self.blockchain[0].hashDifficulty)
+        self.storeBlocksFrom(0)
         logging.info("Blockchain has been initialized...")
         logging.info(
             f"Block hashing difficulty is {hashDifficulty}. Block fee rate is {gasPrice}.")
@@ -137,6 +462,64 @@ class Blockchain():
 
         logging.info("Genesis block is initialized successfully.")
 
+    # Builds a blockchain from stored blocks without creating a genesis
+    # block or key pair. The blocks aren't validated here, they are
+    # checked by auditBlockchain or before the next block is mined.
+    # With a blockStore, a node goes on from the blocks of the store and
+    # appends its new blocks to it. The blocks are read from the store
+    # when none are given, lazily with a blockCacheSize.
+
+    @classmethod
+    def initializeBlockchain(self, hashDifficulty: int, gasPrice: int, blocks: list = None,
+                             chainSize: int = 0, miningProcesses: int = 1,
+                             mempoolCapacity: int = 10000, verificationProcesses: int = 1,
+                             blockStore=None, blockCacheSize: int = 0):
+        if blocks is None:
+            blocks = LazyBlockList(blockStore, blockCacheSize) if blockCacheSize > 0 \
+                else list(blockStore)
+        elif blockStore is not None and len(blocks) != len(blockStore):
+            raise BlockStoreError("Blocks aren't the blocks of the block store!")
+        if isinstance(blocks, LazyBlockList):
+            blockStore = blocks.blockStore
+
+        blockchain = self.__new__(self)
+        blockchain.hashDifficulty = hashDifficulty
+        blockchain.gasPrice = gasPrice
+        blockchain.chainSize = chainSize
+        blockchain.miningProcesses = miningProcesses
+        blockchain.verificationProcesses = verificationProcesses
+        blockchain.pendingTransactions = Mempool(mempoolCapacity)
+        blockchain.balanceIndex = BalanceIndex(MAX_REORG_DEPTH)
+        blockchain.blockchain = blocks
+        blockchain.blockStore = blockStore
+        blockchain.validatedHeight = 0
+        blockchain.validationFlag = True
+        blockchain.undoJournal = deque(maxlen=MAX_REORG_DEPTH)
+        blockchain.chainWork = sum(getBlockWork(block.hashDifficulty)
+                                   for block in blocks)
+        blockchain.rebuildBalanceIndex()
+        logging.info(
+            f"Blockchain is loaded with {len(blocks)} blocks.")
+        return blockchain
+
+    # Builds a blockchain from the blocks of another node. Unlike stored
+    # blocks, every block after the genesis block is connected like a
+    # received block, so the difficulty schedule, the transactions and
+    # the balances of the whole chain are checked before it is used.
+
+    @classmethod
+    def initializeReceivedBlockchain(self, gasPrice: int, blocks: list, miningProcesses: int = 1,
+                                     mempoolCapacity: int = 10000, verificationProcesses: int = 1):
+        if len(blocks) == 0:
+            raise BlockchainSequenceError("Received blockchain has no genesis block!")
+        blockchain = self.initializeBlockchain(
+            blocks[0].hashDifficulty, gasPrice, blocks[:1], 0, miningProcesses,
+            mempoolCapacity, verificationProcesses)
+        blockchain.auditBlockchain()
+        for block in blocks[1:]:
+            blockchain.appendReceivedBlock(block)
+        return blockchain
+
     # Genesis block is the first node of the blockchain,
     # so, we generated a random string for the starting point(hash).
 
@@ -154,25 +537,48 @@ class Blockchain():
 
         self.validationFlag = True
         return Block(SHA256.new(randomKey.encode('utf-8')).hexdigest(),
-                     self.hashDifficulty, genericTransactions)
+                     self.hashDifficulty, genericTransactions, self.miningProcesses)
 
     def getCurrentBlock(self):
         return self.blockchain[-1]
 
-    def mineNewBlock(self, transactions: list):
+    # mempoolTransactions are the transactions taken from
+    # the mempool, they are journaled to undo the block.
+
+    def mineNewBlock(self, transactions: list, mempoolTransactions: list = None):
         self.insertBlockAndReevaluateDifficulty(
-            Block(self.getCurrentBlock().blockHash, self.hashDifficulty, transactions))
+            Block(self.getCurrentBlock().blockHash, self.hashDifficulty, transactions,
+                  self.miningProcesses), mempoolTransactions)
 
         self.validateBlockchain()
 
+    # Makes the block store match the chain from the given height:
+    # stored blocks from that height are dropped and the chain's
+    # blocks from that height are appended.
+
+    def storeBlocksFrom(self, height: int):
+        # The lazy block list writes to the store by itself.
+        if self.blockStore is None or isinstance(self.blockchain, LazyBlockList):
+            return
+
+        self.blockStore.truncate(height)
+        for i in range(height, len(self.blockchain)):
+            self.blockStore.appendBlock(self.blockchain[i])
+
     # Blockchain will make mining harder as it has more blocks.
     # This is a similar procedure for all other famous blockchain applications.
     # To be more precise, this implementation should be changed based on
     # peer numbers who actively mine blocks. I will change this
     # feature once I implement peer to peer network properly.
 
-    def insertBlockAndReevaluateDifficulty(self, newBlock: Block):
+    def insertBlockAndReevaluateDifficulty(self, newBlock: Block, mempoolTransactions: list = None):
+        self.undoJournal.append(BlockUndoEntry(
+            newBlock.blockHash, self.hashDifficulty, self.chainSize,
+            [] if mempoolTransactions is None else mempoolTransactions))
         self.blockchain.append(newBlock)
+        self.balanceIndex.applyBlock(newBlock)
+        self.chainWork += getBlockWork(newBlock.hashDifficulty)
+        self.storeBlocksFrom(len(self.blockchain) - 1)
         self.chainSize += 1
         if self.hashDifficulty == 0:
             return
@@ -186,16 +592,30 @@ class Blockchain():
 
     # To secure our blocks, we need to validate our blockchain.
     # We do that by simply checking hash data of the blocks.
-
-    def validateBlockchain(self):
-        for i in range(len(self.blockchain) - 1):
+    # Blocks below validatedHeight are already checked, so a new block
+    # only checks its own hash, proof of work and its link to the previous
+    # block. The claimed difficulty of a block gives the work of the chain,
+    # so it can't be lower than the difficulty expected at its height.
+    # A full audit checks the whole chain from the genesis block again,
+    # it should be used after imports or when a corruption is suspected.
+
+    def validateBlockchain(self, fullAudit: bool = False):
+        if fullAudit == True:
+            self.validatedHeight = 0
+
+        for i in range(self.validatedHeight, len(self.blockchain)):
             try:
                 validationHash = self.blockchain[i].generateBlockHash()
-                if validationHash != self.blockchain[i].blockHash:
+                if validationHash != self.blockchain[i].blockHash or \
+                        self.blockchain[i].generateMerkleRoot() != self.blockchain[i].merkleRoot or \
+                        self.blockchain[i].hasRepeatedTransactions() or \
+                        not self.blockchain[i].isHashValid(validationHash) or \
+                        self.blockchain[i].hashDifficulty < getExpectedHashDifficulty(
+                            self.blockchain[0].hashDifficulty, i):
                     self.validationFlag = False
                     raise IllegalAccessError()
 
-                if self.blockchain[i].blockHash != self.blockchain[i + 1].previousBlockHash:
+                if i > 0 and self.blockchain[i - 1].blockHash != self.blockchain[i].previousBlockHash:
                     self.validationFlag = False
                     raise BlockchainSequenceError(
                         "Blockchain sequence isn't valid!")
@@ -206,24 +626,197 @@ class Blockchain():
                 raise IllegalAccessError(
                     "Changed block properties found! The corresponding block is corrupted!")
             except BlockchainSequenceError:
-                self.handleInvalidBlock()
+                self.handleInvalidBlock(i)
+                return
+
+            self.validatedHeight = i + 1
 
         self.validationFlag = True
 
-    def handleInvalidBlock(self):
-        while self.validationFlag == False:
+    def auditBlockchain(self):
+        self.validateBlockchain(fullAudit=True)
+
+    # The blockchain is recovered to the version before the block that
+    # isn't linked to its previous block. Blocks below it are already
+    # validated, so they are all dropped at once.
+
+    def handleInvalidBlock(self, invalidHeight: int):
+        self.restorePendingTransactions(self.disconnectBlocks(invalidHeight))
+        self.validationFlag = True
+        self.lastBlockLog = f"Trying to recover the blockchain to the previous version. Last block index is {len(self.blockchain)}\n"
+        logging.warning(f"BlockchainSequenceError: {self.lastBlockLog}")
+
+    # Rolls back the blocks from the given height. Balances are reverted
+    # block by block and the undo journal gives back the difficulty,
+    # the chain size and the transactions of the blocks, so the cost
+    # depends on the number of blocks rolled back. Returns the rolled
+    # back transactions to be restored to the mempool.
+
+    def disconnectBlocks(self, height: int) -> list:
+        restoredTransactions = []
+        while len(self.blockchain) > height:
+            block = self.blockchain.pop()
+            self.balanceIndex.revertBlock(block)
+            self.chainWork -= getBlockWork(block.hashDifficulty)
+            if len(self.undoJournal) > 0 and self.undoJournal[-1].blockHash == block.blockHash:
+                undoEntry = self.undoJournal.pop()
+                self.hashDifficulty = undoEntry.hashDifficulty
+                self.chainSize = undoEntry.chainSize
+                restoredTransactions = undoEntry.mempoolTransactions + restoredTransactions
+            else:
+                self.chainSize -= 1
+
+        self.validatedHeight = min(self.validatedHeight, height)
+        self.storeBlocksFrom(height)
+        return restoredTransactions
+
+    # Rolled back transactions go through the balance checks again, so
+    # a transaction that is confirmed or double spent by the new blocks
+    # is dropped instead of overdrawing its source.
+
+    def restorePendingTransactions(self, transactions: list):
+        for transaction in transactions:
+            pendingTransaction = transaction.getPendingCopy()
+            if self.isConfirmedTransaction(pendingTransaction.getTransactionHashBytes()):
+                continue
             try:
-                self.blockchain.pop()
-                self.lastBlockLog = f"Trying to recover the blockchain to the previous version. Last block index is {len(self.blockchain)}\n"
-                logging.WARNING(
-                    f"BlockchainSequenceError: {self.lastBlockLog}")
-                self.validateBlockchain()
-            except:
-                self.lastBlockLog = "There is no block left! Creating a new genesis block.."
-                logging.critical(f"IllegalAccessError: {self.lastBlockLog}")
-                self.blockchain = [self.createGenesisBlock()]
-                break
-        return
+                self.addTransaction(pendingTransaction)
+            except (BalanceError, MempoolError, TransactionDataConflictError):
+                logging.warning("A rolled back transaction is dropped from the mempool.")
+
+    # Fork choice: switches to a branch that forks after the block at
+    # forkHeight - 1 when the branch has more work than the blocks it
+    # replaces. Only the blocks after the fork are rolled back and
+    # applied. Returns whether the branch is taken.
+
+    def reorganize(self, forkHeight: int, blocks: list) -> bool:
+        if forkHeight < 1 or forkHeight > len(self.blockchain):
+            raise BlockchainSequenceError("Branch doesn't fork from the blockchain!")
+        self.validateBlockchain()
+        self.validateBranch(self.blockchain[forkHeight - 1].blockHash, blocks, forkHeight)
+
+        replacedWork = sum(getBlockWork(self.blockchain[height].hashDifficulty)
+                           for height in range(forkHeight, len(self.blockchain)))
+        branchWork = sum(getBlockWork(block.hashDifficulty)
+                         for block in blocks)
+        if branchWork <= replacedWork:
+            return False
+
+        # Transactions of a branch block are checked against the balances
+        # before it, so the branch is applied first. When any of its blocks
+        # fails, the connected branch blocks are rolled back, the replaced
+        # blocks are connected again and the transactions that the branch
+        # took from the mempool are put back.
+        replacedBlocks = [self.blockchain[height]
+                          for height in range(forkHeight, len(self.blockchain))]
+        restoredTransactions = self.disconnectBlocks(forkHeight)
+        removedTransactions = []
+        try:
+            for block in blocks:
+                self.validateBlockTransactions(block)
+                removedTransactions += self.connectBlock(block)
+        except Exception:
+            self.disconnectBlocks(forkHeight)
+            for block in replacedBlocks:
+                self.connectBlock(block)
+            self.validatedHeight = len(self.blockchain)
+            self.restorePendingTransactions(removedTransactions)
+            raise
+        self.validatedHeight = len(self.blockchain)
+        self.restorePendingTransactions(restoredTransactions)
+        logging.info(
+            f"Blockchain is reorganized from block {forkHeight} with {len(blocks)} new block(s)")
+        return True
+
+    # Checks the hash, merkle root, proof of work and difficulty of blocks
+    # and that they are linked to each other from previousBlockHash.
+    # The first block is at firstHeight.
+
+    def validateBranch(self, previousBlockHash: str, blocks: list, firstHeight: int):
+        for i, block in enumerate(blocks):
+            if block.previousBlockHash != previousBlockHash:
+                raise BlockchainSequenceError(
+                    "Received block doesn't follow the previous block!")
+            if block.generateBlockHash() != block.blockHash or \
+                    block.generateMerkleRoot() != block.merkleRoot or \
+                    block.hasRepeatedTransactions() or \
+                    not block.isHashValid(block.blockHash) or \
+                    block.hashDifficulty < getExpectedHashDifficulty(
+                        self.blockchain[0].hashDifficulty, firstHeight + i):
+                raise IllegalAccessError("Received block isn't valid!")
+            previousBlockHash = block.blockHash
+
+    # Checks the transactions of a block from another node before it is
+    # connected: all of them are signed by their sources, none is
+    # confirmed already, their fees are the fees this chain charges and
+    # every source can pay for its transactions, in the same way
+    # addTransaction checks them. The last transaction is the block
+    # reward, which is signed by the genesis key of the miner, so its
+    # source has no balance. The reward is paid from the fees of the block
+    # only. Transactions of the genesis key of the chain are forced
+    # transactions, which aren't paid from a balance. Rewards of chains
+    # from before the transaction nonce have the same hash for the same
+    # amount in the same second, so they aren't checked against the
+    # confirmed transactions either.
+
+    def validateBlockTransactions(self, block: Block):
+        # An unknown signature scheme or a broken signature raises
+        # SignatureError or ValueError while the hash is generated again.
+        try:
+            pendingTransactions = []
+            for transaction in block.blockTransactions:
+                pendingTransaction = transaction.getApprovedCopy()
+                if not pendingTransaction.restorePendingState():
+                    raise IllegalAccessError("Received block has an invalid transaction!")
+                pendingTransactions.append(pendingTransaction)
+            validationResults = self.validateTransactions(pendingTransactions)
+        except (SignatureError, ValueError):
+            raise IllegalAccessError("Received block has an invalid transaction!")
+
+        if not all(isValid == True for isValid in validationResults):
+            raise IllegalAccessError("Received block has an invalid transaction!")
+
+        genesisPublicKey = self.getGenesisPublicKey()
+        spentBalances = {}
+        blockFees = 0
+        for transaction in block.blockTransactions[:-1]:
+            if self.isConfirmedTransaction(transaction.getTransactionHashBytes()):
+                raise IllegalAccessError("Received block has an invalid transaction!")
+            if transaction.source == genesisPublicKey:
+                continue
+            if type(transaction.balance) is not int or transaction.balance <= 0 or \
+                    transaction.gas != transaction.calculateGas() or \
+                    transaction.fee != transaction.gas * self.gasPrice:
+                raise IllegalAccessError("Received block has an invalid transaction!")
+            sourceBalance = self.balanceIndex.confirmedBalances.get(transaction.source, 0) - \
+                spentBalances.get(transaction.source, 0)
+            if sourceBalance < transaction.balance:
+                raise IllegalAccessError("Received block spends more than the balance!")
+            spentBalances[transaction.source] = spentBalances.get(transaction.source, 0) + \
+                transaction.balance + transaction.fee
+            blockFees += transaction.fee
+
+        blockReward = block.blockTransactions[-1]
+        if blockReward.source != genesisPublicKey and \
+                (blockReward.balance != blockFees or blockReward.fee != 0):
+            raise IllegalAccessError("Received block reward isn't the fees of the block!")
+
+    # The genesis block holds a transaction of the genesis key of the
+    # chain, the only key that can force transactions.
+
+    def getGenesisPublicKey(self) -> str:
+        return self.blockchain[0].blockTransactions[0].source
+
+    # Appends a valid block from another node. Its transactions are
+    # removed from the mempool and all of them but the block reward,
+    # which is the last one, are journaled to undo the block.
+    # Returns the transactions removed from the mempool.
+
+    def connectBlock(self, block: Block) -> list:
+        removedTransactions = self.removeConfirmedTransactions(block)
+        self.insertBlockAndReevaluateDifficulty(
+            block, block.blockTransactions[:-1])
+        return removedTransactions
 
     # This function is responsible for adding transactions to
     # the blockchain and checking them if they are valid.
@@ -247,7 +840,7 @@ class Blockchain():
             logging.warning(self.lastBlockLog)
             raise BalanceError("Insufficient balance in the source!")
 
-        self.pendingTransactions.append(newTransaction)
+        self.addPendingTransaction(newTransaction)
         logging.info(
             f"A new transaction has been added to blockchain.")  # by {newTransaction.source}
 
@@ -258,17 +851,38 @@ class Blockchain():
     # transaction with the genesis block's signature.
 
     def forceTransaction(self, publicAddress: str, balance: float):
-        newTransaction = Transaction(KEY_PAIR.public_key(),
+        newTransaction = Transaction(getGenesisKeyPair().public_key(),
                                      publicAddress,
                                      balance,
-                                     KEY_PAIR.private_key())
+                                     getGenesisKeyPair().private_key())
 
-        self.pendingTransactions.append(newTransaction)
-        self.handleTransactions(KEY_PAIR.public_key())
+        self.addPendingTransaction(newTransaction)
+        self.handleTransactions(getGenesisKeyPair().public_key())
 
         logging.info(
             f"A forced transaction is added to the chain. Amount: {balance}")
 
+    # When the mempool is full, the lowest fee transactions are evicted
+    # and their balances are given back to their sources. A transaction
+    # that the mempool refuses raises a MempoolError. It can be evicted
+    # with an earlier transaction of its sender, so the balances of the
+    # evicted transactions are given back before it is refused.
+
+    def addPendingTransaction(self, newTransaction: Transaction):
+        evictedTransactions = self.pendingTransactions.push(newTransaction)
+        for evictedTransaction in evictedTransactions:
+            if evictedTransaction is newTransaction:
+                continue
+            self.balanceIndex.removePendingTransaction(evictedTransaction)
+            self.lastBlockLog = "Mempool is full! A transaction with the lowest fee is evicted."
+            logging.warning(self.lastBlockLog)
+
+        if newTransaction in evictedTransactions:
+            self.lastBlockLog = "Transaction is already pending or the mempool is full!"
+            logging.warning(self.lastBlockLog)
+            raise MempoolError(self.lastBlockLog)
+        self.balanceIndex.addPendingTransaction(newTransaction)
+
     # When there is pending transactions, those transactions
     # should be handled by a miner. This is implemented in the
     # function below.
@@ -278,22 +892,27 @@ class Blockchain():
         self.validateBlockchain()
         while not len(self.pendingTransactions) == 0:
             limitedTransactions = []
-            transactionsSize = 0
+            mempoolTransactions = []
 
-            if self.getCurrentBlock().blockTransactionCapacity > len(self.pendingTransactions):
-                transactionsSize = len(self.pendingTransactions)
-            else:
-                transactionsSize = self.getCurrentBlock().blockTransactionCapacity
+            # The mempool gives the highest fee transactions first.
+            nextTransactions = self.pendingTransactions.popTransactions(
+                self.getCurrentBlock().blockTransactionCapacity)
+
+            validationResults = self.validateTransactions(nextTransactions)
 
+            # A transaction whose validation raises a SignatureError is
+            # dropped like an invalid one, the rest of the batch is mined.
             currentReward = 0
-            for i in range(transactionsSize):
-                nextTransaction = self.pendingTransactions.pop()
-                isValid = self.validateTransaction(
-                    nextTransaction, nextTransaction.source)
+            for nextTransaction, isValid in zip(nextTransactions, validationResults):
+                self.balanceIndex.removePendingTransaction(nextTransaction)
+                if isValid is None:
+                    self.lastBlockLog = "A transaction with a broken signature is dropped from the mempool."
+                    logging.warning(self.lastBlockLog)
 
                 if isValid == True:
                     nextTransaction.approve()
                     limitedTransactions.append(nextTransaction)
+                    mempoolTransactions.append(nextTransaction)
                     currentReward += nextTransaction.fee
 
                 # else:
@@ -306,22 +925,23 @@ class Blockchain():
             # genesis key pair. This key pair is the authorized to
             # give block rewards and force transactions to test blockchain.
 
-            if rewardAddress != KEY_PAIR.public_key():
+            if rewardAddress != getGenesisKeyPair().public_key():
                 blockReward = Transaction(
-                    KEY_PAIR.public_key(),
+                    getGenesisKeyPair().public_key(),
                     rewardAddress,
                     currentReward,
-                    KEY_PAIR.private_key())
+                    getGenesisKeyPair().private_key())
 
                 blockReward.approve()
                 limitedTransactions.append(blockReward)
 
-            self.mineNewBlock(limitedTransactions.copy())
+            self.mineNewBlock(limitedTransactions.copy(), mempoolTransactions)
 
     def validateTransaction(self, newTransaction: Transaction, publicKey: str):
         transactionSigner = TransactionSignature()
         validator = transactionSigner.validateTransaction(
-            newTransaction.transactionHash, newTransaction.transactionSignature, publicKey)
+            newTransaction.transactionHash, newTransaction.transactionSignature, publicKey,
+            newTransaction.signatureScheme)
 
         if validator == True:
             logging.info(
@@ -329,26 +949,166 @@ class Blockchain():
             return True
         return False
 
-    # This function gets the balance of specified address
-    # with checking all Transactions within the blockchain.
+    # Validates the signatures of a block's worth of transactions at once.
+    # The results are in the same order as the transactions, None stands
+    # for a transaction whose validation raises a SignatureError.
+
+    def validateTransactions(self, transactions: list) -> list:
+        transactionSigner = TransactionSignature()
+        validationResults = transactionSigner.validateTransactions(
+            [(transaction.transactionHash, transaction.transactionSignature, transaction.source,
+              transaction.signatureScheme)
+             for transaction in transactions],
+            self.verificationProcesses)
+
+        for transaction, isValid in zip(transactions, validationResults):
+            if isValid == True:
+                logging.info(
+                    f'Transaction is validated! -> {transaction.transactionHash.hexdigest()}')
+        return validationResults
+
+    # This function gets the balance of specified address from the
+    # balance index. The index is kept up to date with the blocks
+    # and the pending transactions, so no chain walk is needed.
 
     def getBalance(self, addressofBalance: str):
-        availableBalance = 0
+        return self.balanceIndex.getBalance(addressofBalance)
 
-        for i in range(len(self.blockchain)):
-            for j in range(len(self.blockchain[i].blockTransactions)):
-                if self.blockchain[i].blockTransactions[j].destination == addressofBalance:
-                    availableBalance += self.blockchain[i].blockTransactions[j].balance
-                if self.blockchain[i].blockTransactions[j].source == addressofBalance:
-                    availableBalance -= (self.blockchain[i].blockTransactions[j].balance +
-                                         self.blockchain[i].blockTransactions[j].fee)
+    # Appends a block that is loaded from stored data. The block isn't
+    # mined or validated here, only the balance index is updated.
 
-        # Check if current source has any pending transaction.
+    def appendStoredBlock(self, block: Block):
+        self.blockchain.append(block)
+        self.balanceIndex.applyBlock(block)
+        self.chainWork += getBlockWork(block.hashDifficulty)
 
-        for transaction in self.pendingTransactions:
-            if transaction.destination == addressofBalance:
-                availableBalance += transaction.balance
-            if transaction.source == addressofBalance:
-                availableBalance -= (transaction.balance + transaction.fee)
+    # Appends a block received from a peer. It is checked like a
+    # mined block: its hash, merkle root, proof of work and its link
+    # to the current block, so only the new block is hashed.
+
+    def appendReceivedBlock(self, block: Block):
+        self.validateBlockchain()
+        self.validateBranch(self.getCurrentBlock().blockHash, [block], len(self.blockchain))
+        if block.hashDifficulty < self.hashDifficulty:
+            raise IllegalAccessError("Received block isn't valid!")
+        self.validateBlockTransactions(block)
+
+        self.connectBlock(block)
+        self.validatedHeight = len(self.blockchain)
+
+    # Transactions of a block mined by another node shouldn't be
+    # mined again from the mempool. Returns the removed transactions.
+
+    def removeConfirmedTransactions(self, block: Block) -> list:
+        removedTransactions = []
+        for transaction in block.blockTransactions:
+            pendingTransaction = self.pendingTransactions.remove(
+                transaction.transactionHash)
+            if pendingTransaction is not None:
+                self.balanceIndex.removePendingTransaction(pendingTransaction)
+                removedTransactions.append(pendingTransaction)
+        return removedTransactions
+
+    # Adds a transaction received from a peer. Its hash is generated
+    # again and its signature is checked before it is added like a
+    # local transaction. A transaction that is already pending or
+    # confirmed is refused, so a peer can't replay it.
+
+    def addReceivedTransaction(self, transaction: Transaction):
+        transactionHash = transaction.getTransactionHashBytes()
+        if transactionHash.hex() in self.pendingTransactions or \
+                self.isConfirmedTransaction(transactionHash):
+            self.lastBlockLog = "Transaction is already pending or confirmed!"
+            logging.warning(self.lastBlockLog)
+            raise MempoolError(self.lastBlockLog)
+
+        if not transaction.restorePendingState() or \
+                not self.validateTransaction(transaction, transaction.source):
+            raise SignatureError()
+        self.addTransaction(transaction)
+
+    # A block locator lists the hashes of the last blocks and then
+    # goes back in doubling steps down to the genesis block. A peer
+    # finds the common ancestor with the first hash it has.
+
+    def getBlockLocator(self) -> list:
+        locator = []
+        height = len(self.blockchain) - 1
+        step = 1
+        while height > 0:
+            locator.append(self.blockchain[height].blockHash)
+            if len(locator) >= 10:
+                step *= 2
+            height -= step
+        locator.append(self.blockchain[0].blockHash)
+        return locator
+
+    # Returns the height of the highest block in the locator
+    # or None if the chains don't share any block.
+
+    def findLocatorAncestor(self, locator: list):
+        locatorHashes = set(locator)
+        for height in range(len(self.blockchain) - 1, -1, -1):
+            if self.blockchain[height].blockHash in locatorHashes:
+                return height
+        return None
+
+    # Rebuilds the balance index with checking all Transactions
+    # within the blockchain, e.g. after the blocks are replaced.
+
+    def rebuildBalanceIndex(self):
+        self.balanceIndex.rebuild(self.blockchain, self.pendingTransactions)
+
+    # Finds the block of a transaction and returns what a wallet service
+    # needs to confirm the payment: the block header and the merkle proof.
+    # The proof can be checked with verifyTransactionProof.
+
+    def getTransactionProof(self, transactionHash: str):
+        for i, block in enumerate(self.blockchain):
+            proof = block.getMerkleProof(transactionHash)
+            if proof is not None:
+                return {
+                    "blockNumber": i,
+                    "blockHash": block.blockHash,
+                    "blockHeader": block.generateBlockHeader(),
+                    "proof": proof
+                }
+        return None
+
+    # Transaction queries. A block store that supports queries (like
+    # SQLiteBlockStore) answers them from its indexes, otherwise
+    # every transaction in the chain is checked.
+    # Results are {"blockNumber": ..., "transaction": ...} dicts.
+
+    def getTransactionsOfAddress(self, address: str) -> list:
+        if self.canQueryBlockStore():
+            return self.blockStore.getTransactionsOfAddress(address)
+
+        return [{"blockNumber": i, "transaction": transaction}
+                for i, block in enumerate(self.blockchain)
+                for transaction in block.blockTransactions
+                if transaction.source == address or transaction.destination == address]
+
+    def findTransaction(self, transactionHash: str):
+        if self.canQueryBlockStore():
+            return self.blockStore.findTransaction(transactionHash)
+
+        for i, block in enumerate(self.blockchain):
+            for transaction in block.blockTransactions:
+                if transaction.transactionHash == transactionHash:
+                    return {"blockNumber": i, "transaction": transaction}
+        return None
+
+    # A replayed transaction is looked up among the transactions of the
+    # recent blocks first. The older blocks, or the index of the block
+    # store, are only searched when the filter of the older transactions
+    # may have it.
+
+    def isConfirmedTransaction(self, transactionHash: bytes) -> bool:
+        if self.balanceIndex.isConfirmed(transactionHash):
+            return True
+        return self.balanceIndex.mayBeConfirmedBefore(transactionHash) and \
+            self.findTransaction(transactionHash.hex()) is not None
 
-        return availableBalance
+    def canQueryBlockStore(self) -> bool:
+        return self.blockStore is not None and self.blockStore.supportsQueries == True
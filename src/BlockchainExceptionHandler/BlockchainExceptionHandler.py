@@ -42,3 +42,27 @@ class TransactionDataConflictError(Exception):
 
     def __str__(self) -> str:
         return self.err_str
+
+
+class MempoolError(Exception):
+    def __call__(self, *args) -> Exception:
+        return super().__call__(*(self.args + args))
+
+    def __str__(self) -> str:
+        return super().__str__()
+
+
+class NetworkProtocolError(Exception):
+    def __call__(self, *args) -> Exception:
+        return super().__call__(*(self.args + args))
+
+    def __str__(self) -> str:
+        return super().__str__()
+
+
+class BlockStoreError(Exception):
+    def __call__(self, *args) -> Exception:
+        return super().__call__(*(self.args + args))
+
+    def __str__(self) -> str:
+        return super().__str__()
@@ -0,0 +1,72 @@
+# -----------------------------------------------------
+# Bloom filters to remember which objects are already
+# seen with a fixed amount of memory. A filter can give
+# false positives at the chosen rate but never misses
+# an item that was added.
+# Copyright (c) 2022 Berk Kırtay
+# -----------------------------------------------------
+
+import hashlib
+import math
+
+
+class BloomFilter():
+    bitCount = 0
+    hashCount = 0
+    itemCount = 0
+
+    # The filter is sized for the capacity and false positive rate.
+
+    def __init__(self, capacity: int, falsePositiveRate: float = 0.001):
+        self.bitCount = max(8, math.ceil(
+            -capacity * math.log(falsePositiveRate) / (math.log(2) ** 2)))
+        self.hashCount = max(1, round(
+            self.bitCount / capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.bitCount / 8))
+        self.itemCount = 0
+
+    def __contains__(self, item: str) -> bool:
+        for position in self.getPositions(item):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, item: str):
+        for position in self.getPositions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.itemCount += 1
+
+    # Positions come from two halves of one sha256 digest
+    # combined as h1 + i * h2 (double hashing).
+
+    def getPositions(self, item: str):
+        digest = hashlib.sha256(item.encode('utf-8')).digest()
+        firstHash = int.from_bytes(digest[:8], 'big')
+        secondHash = int.from_bytes(digest[8:16], 'big') | 1
+        return [(firstHash + i * secondHash) % self.bitCount
+                for i in range(self.hashCount)]
+
+
+# Keeps two generations of filters. Items are added to the current
+# filter and looked up in both. When the current filter is full, it
+# becomes the previous one and a new filter is started, so at least
+# the last capacity items are always remembered.
+
+class RotatingBloomFilter():
+    capacity = 0
+
+    def __init__(self, capacity: int, falsePositiveRate: float = 0.001):
+        self.capacity = capacity
+        self.falsePositiveRate = falsePositiveRate
+        self.currentFilter = BloomFilter(capacity, falsePositiveRate)
+        self.previousFilter = BloomFilter(capacity, falsePositiveRate)
+
+    def __contains__(self, item: str) -> bool:
+        return item in self.currentFilter or item in self.previousFilter
+
+    def add(self, item: str):
+        if self.currentFilter.itemCount >= self.capacity:
+            self.previousFilter = self.currentFilter
+            self.currentFilter = BloomFilter(
+                self.capacity, self.falsePositiveRate)
+        self.currentFilter.add(item)
@@ -0,0 +1,205 @@
+# ----------------------------------------------------------
+# Versioned binary encoding of blocks and transactions.
+# Hashes are raw 32 bytes, signatures are raw bytes, keys and
+# messages are length prefixed and numbers have fixed widths.
+# Decoding works on memoryviews, so a block can be read
+# straight from a memory map or a network buffer.
+# Copyright (c) 2022 Berk Kırtay
+# ----------------------------------------------------------
+
+from src.Blockchain.Blockchain import Blockchain, Block
+from src.Transaction.Transaction import Transaction
+import base64
+import struct
+
+BINARY_FORMAT_VERSION = 1
+BLOCKCHAIN_MAGIC = b'BCB'
+
+# Chain: magic, version, hash difficulty, gas price, chain size, block count.
+BLOCKCHAIN_HEADER = struct.Struct(">3sBH9sQQ")
+# Block: version, previous hash, block hash, merkle root, nonce, hash difficulty,
+# block balance, block fee, validation time, transaction count.
+BLOCK_HEADER = struct.Struct(">B32s32s32sQH9s9s8sI")
+# Transaction: hash, balance, gas, fee, validation time, nonce, signature scheme
+# and the lengths of source, destination, signature and message which follow it.
+# Amounts are a type tag and 8 bytes, so integer and float amounts keep their type.
+# A transaction without a nonce is written with 0.
+TRANSACTION_HEADER = struct.Struct(">32sBqIBq8sqBHHHI")
+BLOCK_LENGTH = struct.Struct(">I")
+
+NUMBER = struct.Struct(">Bq")
+FLOAT_NUMBER = struct.Struct(">Bd")
+INTEGER_TAG = 0
+FLOAT_TAG = 1
+
+# Most transactions keep the message that is generated from their fields,
+# it is written with this length and rebuilt while decoding.
+DEFAULT_MESSAGE_LENGTH = 0xFFFFFFFF
+
+
+def packNumber(number) -> bytes:
+    if isinstance(number, float):
+        return FLOAT_NUMBER.pack(FLOAT_TAG, number)
+    return NUMBER.pack(INTEGER_TAG, number)
+
+
+def unpackNumber(data: bytes):
+    return toNumber(*NUMBER.unpack(data))
+
+
+def toNumber(tag: int, value: int):
+    if tag == FLOAT_TAG:
+        return FLOAT_NUMBER.unpack(NUMBER.pack(tag, value))[1]
+    return value
+
+
+def defaultMessage(balance, source: str, destination: str) -> str:
+    return f"Transaction value: {balance}, sent by {source} to {destination}"
+
+
+def packTime(validationTime: str) -> bytes:
+    return validationTime.encode('ascii')
+
+
+def encodeTransaction(transaction) -> bytes:
+    source = transaction.source.encode('ascii')
+    destination = transaction.destination.encode('ascii')
+    signature = transaction.transactionSignature
+    if isinstance(signature, str):
+        signature = base64.b64decode(signature)
+    message = b''
+    messageLength = DEFAULT_MESSAGE_LENGTH
+    if transaction.transactionMessage != defaultMessage(
+            transaction.balance, transaction.source, transaction.destination):
+        message = transaction.transactionMessage.encode('utf-8')
+        messageLength = len(message)
+
+    return TRANSACTION_HEADER.pack(
+        transaction.getTransactionHashBytes(),
+        *NUMBER.unpack(packNumber(transaction.balance)),
+        transaction.gas,
+        *NUMBER.unpack(packNumber(transaction.fee)),
+        packTime(transaction.validationTime),
+        transaction.transactionNonce or 0,
+        transaction.signatureScheme,
+        len(source), len(destination), len(signature), messageLength) + \
+        source + destination + signature + message
+
+
+# Returns the decoded transaction and the offset after it.
+
+def decodeTransaction(buffer: memoryview, offset: int = 0):
+    transactionHash, balanceTag, balance, gas, feeTag, fee, validationTime, transactionNonce, \
+        signatureScheme, sourceLength, destinationLength, signatureLength, messageLength = \
+        TRANSACTION_HEADER.unpack_from(buffer, offset)
+    offset += TRANSACTION_HEADER.size
+    if offset + sourceLength + destinationLength + signatureLength + \
+            (0 if messageLength == DEFAULT_MESSAGE_LENGTH else messageLength) > len(buffer):
+        raise ValueError("Transaction data is cut short!")
+    if balanceTag != INTEGER_TAG:
+        balance = toNumber(balanceTag, balance)
+    if feeTag != INTEGER_TAG:
+        fee = toNumber(feeTag, fee)
+
+    source = str(buffer[offset:offset + sourceLength], 'ascii')
+    offset += sourceLength
+    destination = str(buffer[offset:offset + destinationLength], 'ascii')
+    offset += destinationLength
+    signature = base64.b64encode(
+        buffer[offset:offset + signatureLength]).decode('ascii')
+    offset += signatureLength
+    if messageLength == DEFAULT_MESSAGE_LENGTH:
+        message = defaultMessage(balance, source, destination)
+    else:
+        message = str(buffer[offset:offset + messageLength], 'utf-8')
+        offset += messageLength
+
+    transaction = Transaction.initializeTransaction(
+        source, destination, balance, gas, fee, message,
+        transactionHash.hex(), signature, validationTime.decode('ascii'), signatureScheme,
+        transactionNonce or None)
+    return transaction, offset
+
+
+def encodeBlock(block) -> bytes:
+    encodedBlock = [encodeBlockFields(block, len(block.blockTransactions))]
+    for transaction in block.blockTransactions:
+        encodedBlock.append(encodeTransaction(transaction))
+    return b''.join(encodedBlock)
+
+
+# Returns the decoded block and the offset after it.
+
+def decodeBlock(buffer, offset: int = 0):
+    buffer = memoryview(buffer)
+    blockFields, transactionCount, offset = decodeBlockFields(buffer, offset)
+
+    transactions = []
+    for i in range(transactionCount):
+        transaction, offset = decodeTransaction(buffer, offset)
+        transactions.append(transaction)
+
+    return Block.initializeBlock(*blockFields, transactions), offset
+
+
+# Everything in a block except its transactions. The fields are
+# decoded in the argument order of Block.initializeBlock.
+
+def encodeBlockFields(block, transactionCount: int) -> bytes:
+    return BLOCK_HEADER.pack(
+        BINARY_FORMAT_VERSION,
+        bytes.fromhex(block.previousBlockHash),
+        bytes.fromhex(block.blockHash),
+        bytes.fromhex(block.merkleRoot),
+        block.blockNonce,
+        block.hashDifficulty,
+        packNumber(block.blockBalance),
+        packNumber(block.blockFee),
+        packTime(block.validationTime),
+        transactionCount)
+
+
+def decodeBlockFields(buffer, offset: int = 0):
+    version, previousHash, blockHash, merkleRoot, blockNonce, hashDifficulty, blockBalance, \
+        blockFee, validationTime, transactionCount = BLOCK_HEADER.unpack_from(
+            buffer, offset)
+    if version != BINARY_FORMAT_VERSION:
+        raise ValueError(f"Unsupported binary block version: {version}")
+
+    blockFields = (previousHash.hex(), blockHash.hex(), merkleRoot.hex(), blockNonce,
+                   hashDifficulty, unpackNumber(blockBalance), unpackNumber(blockFee),
+                   validationTime.decode('ascii'))
+    return blockFields, transactionCount, offset + BLOCK_HEADER.size
+
+
+def encodeBlockchain(blockchain) -> bytes:
+    encodedBlockchain = [BLOCKCHAIN_HEADER.pack(
+        BLOCKCHAIN_MAGIC,
+        BINARY_FORMAT_VERSION,
+        blockchain.hashDifficulty,
+        packNumber(blockchain.gasPrice),
+        blockchain.chainSize,
+        len(blockchain.blockchain))]
+    for block in blockchain.blockchain:
+        encodedBlock = encodeBlock(block)
+        encodedBlockchain.append(BLOCK_LENGTH.pack(len(encodedBlock)))
+        encodedBlockchain.append(encodedBlock)
+    return b''.join(encodedBlockchain)
+
+
+def decodeBlockchain(buffer) -> Blockchain:
+    buffer = memoryview(buffer)
+    magic, version, hashDifficulty, gasPrice, chainSize, blockCount = \
+        BLOCKCHAIN_HEADER.unpack_from(buffer, 0)
+    if magic != BLOCKCHAIN_MAGIC or version != BINARY_FORMAT_VERSION:
+        raise ValueError("Data isn't a supported binary blockchain!")
+    offset = BLOCKCHAIN_HEADER.size
+
+    blocks = []
+    for i in range(blockCount):
+        offset += BLOCK_LENGTH.size
+        block, offset = decodeBlock(buffer, offset)
+        blocks.append(block)
+
+    return Blockchain.initializeBlockchain(
+        hashDifficulty, unpackNumber(gasPrice), blocks, chainSize)
@@ -7,6 +7,9 @@
 import pathlib
 from src.Blockchain.Blockchain import Blockchain, Block
 from src.Transaction.Transaction import Transaction
+from src.Transaction.TransactionSignature import RSA_SIGNATURE_SCHEME
+from src.DataConverter import BinaryConverter
+from src.BlockchainExceptionHandler.BlockchainExceptionHandler import BlockchainSequenceError
 import json
 
 
@@ -15,91 +18,129 @@ class DataConverter:
         data = self.dumpBlockchainData(blockchain)
         return json.dumps(data)
 
+    # Compact binary form of the blockchain, see BinaryConverter.
+
+    def dumpBlockchainDataAsBytes(self, blockchain) -> bytes:
+        return BinaryConverter.encodeBlockchain(blockchain)
+
+    def loadBlockchainDataFromBytes(self, blockchainData, verify: bool = False) -> Blockchain:
+        loadedBlockchain = BinaryConverter.decodeBlockchain(blockchainData)
+        if verify == True:
+            loadedBlockchain.auditBlockchain()
+        return loadedBlockchain
+
+    def dumpBlockAsBytes(self, block) -> bytes:
+        return BinaryConverter.encodeBlock(block)
+
+    def loadBlockFromBytes(self, blockData) -> Block:
+        return BinaryConverter.decodeBlock(blockData)[0]
+
     def dumpBlockchainData(self, blockchain) -> list:
-        blocks = []
-        blockCounter = 0
-
-        for block in blockchain.blockchain:
-            transactions = []
-            for blockTransaction in block.blockTransactions:
-                newTransaction = {
-                    "source":  blockTransaction.source,
-                    "destination": blockTransaction.destination,
-                    "balance": blockTransaction.balance,
-                    "gas": blockTransaction.gas,
-                    "fee": blockTransaction.fee,
-                    "transactionMessage": blockTransaction.transactionMessage,
-                    "transactionHash": blockTransaction.transactionHash,
-                    "transactionSignature": blockTransaction.transactionSignature,
-                    "validationTime": blockTransaction.validationTime
-                }
-                transactions.append(newTransaction)
-
-            newBlock = {
-                "blockNumber": blockCounter,
-                "previousHash": block.previousBlockHash,
-                "blockHash": block.blockHash,
-                "blockNonce": block.blockNonce,
-                "hashDifficulty": block.hashDifficulty,
-                "blockBalance": block.blockBalance,
-                "blockFee": block.blockFee,
-                "validationTime": block.validationTime,
-                "numberOFTransactions": len(transactions),
-                "blockTransactions": transactions.copy()
-            }
-            blockCounter += 1
-            blocks.append({
-                "block": newBlock})
-
-        jsonData = {
+        jsonData = self.dumpBlockchainPreferences(blockchain)
+        jsonData["Blocks"] = list(self.dumpBlockRecords(blockchain))
+        return jsonData
+
+    def dumpBlockchainPreferences(self, blockchain) -> dict:
+        return {
             "HashDifficulty": blockchain.hashDifficulty,
             "GasPrice": blockchain.gasPrice,
-            "ChainSize": blockchain.chainSize,
-            "Blocks": blocks.copy()
+            "ChainSize": blockchain.chainSize
         }
 
-        return jsonData
+    # Generates the block records one by one, so that the
+    # whole chain is never built as a single nested dict.
+
+    def dumpBlockRecords(self, blockchain, firstBlockNumber: int = 0):
+        for blockNumber in range(firstBlockNumber, len(blockchain.blockchain)):
+            yield {"block": self.dumpBlock(blockchain.blockchain[blockNumber], blockNumber)}
+
+    def dumpBlock(self, block, blockNumber: int) -> dict:
+        transactions = [self.dumpTransaction(blockTransaction)
+                        for blockTransaction in block.blockTransactions]
+        return {
+            "blockNumber": blockNumber,
+            "previousHash": block.previousBlockHash,
+            "blockHash": block.blockHash,
+            "merkleRoot": block.merkleRoot,
+            "blockNonce": block.blockNonce,
+            "hashDifficulty": block.hashDifficulty,
+            "blockBalance": block.blockBalance,
+            "blockFee": block.blockFee,
+            "validationTime": block.validationTime,
+            "numberOFTransactions": len(transactions),
+            "blockTransactions": transactions
+        }
+
+    def dumpTransaction(self, blockTransaction) -> dict:
+        return {
+            "source":  blockTransaction.source,
+            "destination": blockTransaction.destination,
+            "balance": blockTransaction.balance,
+            "gas": blockTransaction.gas,
+            "fee": blockTransaction.fee,
+            "transactionMessage": blockTransaction.transactionMessage,
+            "transactionHash": blockTransaction.transactionHash,
+            "transactionSignature": blockTransaction.transactionSignature,
+            "validationTime": blockTransaction.validationTime,
+            "signatureScheme": blockTransaction.signatureScheme,
+            "transactionNonce": blockTransaction.transactionNonce
+        }
 
-    def loadBlockchainData(self, blockchainData) -> Blockchain:
+    # Blocks and transactions are rebuilt directly from their stored
+    # fields, nothing is mined, hashed or signed while loading. The
+    # loaded chain is only validated when verify is set, otherwise it
+    # can be checked later with auditBlockchain.
+
+    def loadBlockchainData(self, blockchainData, verify: bool = False) -> Blockchain:
         blockchainData = json.loads(blockchainData)
 
-        hashDifficulty = blockchainData["HashDifficulty"]
-        gasPrice = blockchainData["GasPrice"]
-
-        loadedBlockchain = Blockchain(hashDifficulty, gasPrice)
-        loadedBlockchain.transactions = []
-        loadedBlockchain.blockchain = []
-
-        for block in blockchainData["Blocks"]:
-            tempBlock = Block(block["block"]["previousHash"],
-                              0, {})
-            tempBlock.hashDifficulty = block["block"]["hashDifficulty"]
-            tempBlock.blockHash = block["block"]["blockHash"]
-            tempBlock.blockNonce = block["block"]["blockNonce"]
-            tempBlock.blockBalance = block["block"]["blockBalance"]
-            tempBlock.blockFee = block["block"]["blockFee"]
-            tempBlock.validationTime = block["block"]["validationTime"]
-            tempBlock.blockTransactions = []
-
-            for transaction in block["block"]["blockTransactions"]:
-                tempTransaction = Transaction.initializeTransaction(
-                    transaction["source"],
-                    transaction["destination"],
-                    transaction["balance"],
-                    transaction["gas"],
-                    transaction["fee"],
-                    transaction["transactionMessage"],
-                    transaction["transactionHash"],
-                    transaction["transactionSignature"],
-                    transaction["validationTime"]
-                )
-
-                tempBlock.blockTransactions.append(tempTransaction)
-
-            loadedBlockchain.blockchain.append(tempBlock)
+        blocks = [self.loadBlock(block["block"])
+                  for block in blockchainData["Blocks"]]
+        loadedBlockchain = Blockchain.initializeBlockchain(
+            blockchainData["HashDifficulty"],
+            blockchainData["GasPrice"],
+            blocks,
+            blockchainData.get("ChainSize", len(blocks) - 1))
 
+        if verify == True:
+            loadedBlockchain.auditBlockchain()
         return loadedBlockchain
 
+    def loadBlock(self, block: dict) -> Block:
+        blockTransactions = [self.loadTransaction(transaction)
+                             for transaction in block["blockTransactions"]]
+        loadedBlock = Block.initializeBlock(
+            block["previousHash"],
+            block["blockHash"],
+            block.get("merkleRoot", ""),
+            block["blockNonce"],
+            block["hashDifficulty"],
+            block["blockBalance"],
+            block["blockFee"],
+            block["validationTime"],
+            blockTransactions)
+
+        # Exports without a merkle root are from before the blocks
+        # committed to one, the root is rebuilt for them.
+        if loadedBlock.merkleRoot == "":
+            loadedBlock.merkleRoot = loadedBlock.generateMerkleRoot()
+        return loadedBlock
+
+    def loadTransaction(self, transaction: dict) -> Transaction:
+        return Transaction.initializeTransaction(
+            transaction["source"],
+            transaction["destination"],
+            transaction["balance"],
+            transaction["gas"],
+            transaction["fee"],
+            transaction["transactionMessage"],
+            transaction["transactionHash"],
+            transaction["transactionSignature"],
+            transaction["validationTime"],
+            transaction.get("signatureScheme", RSA_SIGNATURE_SCHEME),
+            transaction.get("transactionNonce")
+        )
+
 
 class BlockDataIO():
     folderName = './blockchain_data/'
@@ -107,14 +148,126 @@ class BlockDataIO():
     def __init__(self):
         pathlib.Path(self.folderName).mkdir(exist_ok=True)
 
-    def importData(self, path) -> Blockchain:
+    def importData(self, path, verify: bool = False) -> Blockchain:
         with open(self.folderName + path, 'r') as f:
-            return self.importDataGenerateBlockchain(f.read())
+            return self.importDataGenerateBlockchain(f.read(), verify)
 
-    def importDataGenerateBlockchain(self, blockchainData) -> Blockchain:
-        return DataConverter().loadBlockchainData(blockchainData)
+    def importDataGenerateBlockchain(self, blockchainData, verify: bool = False) -> Blockchain:
+        return DataConverter().loadBlockchainData(blockchainData, verify)
 
     def exportData(self, blockchain, path):
         jsonData = DataConverter().dumpBlockchainData(blockchain)
         with open(self.folderName + path, 'w', encoding='utf-8') as f:
             json.dump(jsonData, f, ensure_ascii=False, indent=4)
+
+    # Streaming format: the first line keeps the blockchain preferences
+    # and every following line keeps one block record. Blocks are written
+    # and read one at a time, so the memory used by the IO doesn't grow
+    # with the length of the chain.
+
+    def exportStream(self, blockchain, path):
+        preferences = DataConverter().dumpBlockchainPreferences(blockchain)
+        self.writeStream(blockchain, path, preferences, 0)
+
+    def writeStream(self, blockchain, path, preferences: dict, firstBlockNumber: int):
+        converter = DataConverter()
+        with open(self.folderName + path, 'w', encoding='utf-8') as f:
+            self.writeStreamLine(f, preferences)
+            for blockRecord in converter.dumpBlockRecords(blockchain, firstBlockNumber):
+                self.writeStreamLine(f, blockRecord)
+
+    def importStream(self, path, verify: bool = False) -> Blockchain:
+        with open(self.folderName + path, 'r', encoding='utf-8') as f:
+            preferences = json.loads(f.readline())
+            loadedBlockchain = Blockchain.initializeBlockchain(
+                preferences["HashDifficulty"],
+                preferences["GasPrice"],
+                [],
+                preferences["ChainSize"])
+
+            for block in self.readStreamBlocks(f):
+                loadedBlockchain.appendStoredBlock(block)
+
+        if verify == True:
+            loadedBlockchain.auditBlockchain()
+        return loadedBlockchain
+
+    # Incremental export. A snapshot is a stream file of the whole chain,
+    # a delta is a stream file of the blocks mined since the last export.
+    # The checkpoint file keeps the height and the hash of the last
+    # exported block, and every delta starts with the height and the hash
+    # it continues from. So a delta is only applied on top of the chain it
+    # was exported from, which is checked without rehashing any block.
+
+    def exportSnapshot(self, blockchain, path, checkpointPath='export_checkpoint.json'):
+        self.exportStream(blockchain, path)
+        self.writeCheckpoint(blockchain, checkpointPath)
+
+    def exportDelta(self, blockchain, path, checkpointPath='export_checkpoint.json'):
+        with open(self.folderName + checkpointPath, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+
+        baseHeight = checkpoint["height"]
+        if baseHeight > len(blockchain.blockchain) or \
+                blockchain.blockchain[baseHeight - 1].blockHash != checkpoint["blockHash"]:
+            raise BlockchainSequenceError(
+                "Blockchain doesn't continue from the last exported block!")
+
+        preferences = DataConverter().dumpBlockchainPreferences(blockchain)
+        preferences["BaseHeight"] = baseHeight
+        preferences["BaseHash"] = checkpoint["blockHash"]
+        self.writeStream(blockchain, path, preferences, baseHeight)
+        self.writeCheckpoint(blockchain, checkpointPath)
+
+    def importWithDeltas(self, snapshotPath, deltaPaths: list, verify: bool = False) -> Blockchain:
+        loadedBlockchain = self.importStream(snapshotPath)
+
+        for deltaPath in deltaPaths:
+            with open(self.folderName + deltaPath, 'r', encoding='utf-8') as f:
+                preferences = json.loads(f.readline())
+                if preferences["BaseHeight"] != len(loadedBlockchain.blockchain) or \
+                        preferences["BaseHash"] != loadedBlockchain.getCurrentBlock().blockHash:
+                    raise BlockchainSequenceError(
+                        f"Delta {deltaPath} doesn't continue from the loaded blockchain!")
+
+                for block in self.readStreamBlocks(f):
+                    if block.previousBlockHash != loadedBlockchain.getCurrentBlock().blockHash:
+                        raise BlockchainSequenceError(
+                            f"Delta {deltaPath} has a block that isn't linked to the previous block!")
+                    loadedBlockchain.appendStoredBlock(block)
+
+            loadedBlockchain.hashDifficulty = preferences["HashDifficulty"]
+            loadedBlockchain.gasPrice = preferences["GasPrice"]
+            loadedBlockchain.chainSize = preferences["ChainSize"]
+
+        if verify == True:
+            loadedBlockchain.auditBlockchain()
+        return loadedBlockchain
+
+    def writeCheckpoint(self, blockchain, checkpointPath):
+        checkpoint = {
+            "height": len(blockchain.blockchain),
+            "blockHash": blockchain.getCurrentBlock().blockHash
+        }
+        with open(self.folderName + checkpointPath, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+
+    # Yields the blocks of a stream file without building the chain.
+
+    def streamBlocks(self, path):
+        with open(self.folderName + path, 'r', encoding='utf-8') as f:
+            f.readline()
+            yield from self.readStreamBlocks(f)
+
+    # Yields the blocks of an open stream file, starting from its
+    # current position.
+
+    def readStreamBlocks(self, f):
+        converter = DataConverter()
+        for line in f:
+            if line.strip() != "":
+                yield converter.loadBlock(json.loads(line)["block"])
+
+    def writeStreamLine(self, f, record: dict):
+        f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        f.write("\n")
@@ -0,0 +1,75 @@
+# -----------------------------------------------------
+# A pool of key pairs that are generated in the
+# background, so wallets and blockchains don't wait
+# for a new key pair to be generated.
+# Copyright (c) 2022 Berk Kırtay
+# -----------------------------------------------------
+
+from src.Transaction.TransactionSignature import generateKeyPair, getSignatureScheme, \
+    RSA_SIGNATURE_SCHEME
+import queue
+import threading
+
+KEY_PAIR_POOL_SIZE = 32
+
+KEY_PAIR_POOLS = {}
+KEY_PAIR_POOLS_LOCK = threading.Lock()
+
+
+# Worker threads keep up to poolSize key pairs ready and generate a new
+# one whenever one is taken. The workers start with the first request
+# or with start(). They are daemon threads, so they never keep the
+# program from exiting. Key generation mostly runs in native code,
+# which lets the workers run beside the main thread.
+
+class KeyPairPool():
+    def __init__(self, signatureScheme: int = RSA_SIGNATURE_SCHEME,
+                 poolSize: int = KEY_PAIR_POOL_SIZE, workerCount: int = 1):
+        # Unknown schemes are rejected here instead of in the workers.
+        getSignatureScheme(signatureScheme)
+        self.signatureScheme = signatureScheme
+        self.workerCount = workerCount
+        self.keyPairs = queue.Queue(poolSize)
+        self.workers = []
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.keyPairs.qsize()
+
+    def start(self):
+        with self.lock:
+            self.stopped.clear()
+            self.workers = [worker for worker in self.workers if worker.is_alive()]
+            while len(self.workers) < self.workerCount:
+                worker = threading.Thread(target=self.generateKeyPairs, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def stop(self):
+        self.stopped.set()
+
+    def generateKeyPairs(self):
+        while not self.stopped.is_set():
+            keyPair = generateKeyPair(self.signatureScheme)
+            while not self.stopped.is_set():
+                try:
+                    self.keyPairs.put(keyPair, timeout=0.5)
+                    break
+                except queue.Full:
+                    pass
+
+    # Waits for a key pair when the pool is empty.
+
+    def getKeyPair(self) -> list:
+        self.start()
+        return self.keyPairs.get()
+
+
+# Wallets and genesis blocks share one pool per signature scheme.
+
+def getKeyPairPool(signatureScheme: int = RSA_SIGNATURE_SCHEME) -> KeyPairPool:
+    with KEY_PAIR_POOLS_LOCK:
+        if signatureScheme not in KEY_PAIR_POOLS:
+            KEY_PAIR_POOLS[signatureScheme] = KeyPairPool(signatureScheme)
+        return KEY_PAIR_POOLS[signatureScheme]
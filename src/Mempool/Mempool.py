@@ -0,0 +1,191 @@
+# -------------------------------------------------------
+# Fee ordered pool of the pending transactions. Higher fee
+# transactions are mined first while every sender's own
+# transactions keep their order. The pool has a capacity
+# and the lowest fee transactions are evicted when full.
+# Copyright (c) 2022 Berk Kırtay
+# -------------------------------------------------------
+
+from collections import deque
+import heapq
+import itertools
+
+
+class MempoolEntry():
+    transaction = None
+    sequence = 0
+    isRemoved = False
+
+    def __init__(self, transaction, sequence: int):
+        self.transaction = transaction
+        self.sequence = sequence
+        self.isRemoved = False
+
+
+# Every sender has a queue of its transactions in arrival order. Only the
+# head of each queue is in the ready heap, so a later transaction of a
+# sender is never mined before an earlier one. All transactions are in the
+# eviction heap. Both heaps delete lazily: removed entries are flagged and
+# skipped when they reach the top, and the heaps are compacted when the
+# flagged entries outnumber the live ones.
+
+class Mempool():
+    capacity = 10000
+    size = 0
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self.size = 0
+        self.senderQueues = {}
+        self.entries = {}
+        self.readyHeap = []
+        self.evictionHeap = []
+        self.sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        for senderQueue in self.senderQueues.values():
+            for entry in senderQueue:
+                yield entry.transaction
+
+    def __contains__(self, transactionHash: str) -> bool:
+        return transactionHash in self.entries
+
+    # Returns the pending transaction with the given hash or None.
+
+    def get(self, transactionHash: str):
+        entry = self.entries.get(transactionHash)
+        return None if entry is None else entry.transaction
+
+    # Removes a transaction by its hash, e.g. when it is already mined
+    # in a block from another node. Returns the removed transaction
+    # or None if it isn't in the pool.
+
+    def remove(self, transactionHash: str):
+        entry = self.entries.pop(transactionHash, None)
+        if entry is None:
+            return None
+
+        senderQueue = self.senderQueues[entry.transaction.source]
+        isReady = senderQueue[0] is entry
+        senderQueue.remove(entry)
+        entry.isRemoved = True
+        self.size -= 1
+
+        if len(senderQueue) == 0:
+            del self.senderQueues[entry.transaction.source]
+        elif isReady:
+            nextEntry = senderQueue[0]
+            heapq.heappush(self.readyHeap,
+                           (-nextEntry.transaction.fee, nextEntry.sequence, nextEntry))
+
+        self.compactHeaps()
+        return entry.transaction
+
+    # Adds a transaction and returns the transactions that are evicted
+    # to stay within the capacity. When the transaction is already in the
+    # pool, or the pool is full and the new transaction doesn't pay more
+    # than the cheapest one, the new transaction itself is returned as evicted.
+
+    def push(self, transaction) -> list:
+        if transaction.getTransactionHashBytes().hex() in self.entries:
+            return [transaction]
+
+        if self.size >= self.capacity:
+            lowestEntry = self.peekLowestFeeEntry()
+            if lowestEntry is None or lowestEntry.transaction.fee >= transaction.fee:
+                return [transaction]
+
+        entry = MempoolEntry(transaction, next(self.sequence))
+        self.entries[transaction.getTransactionHashBytes().hex()] = entry
+        senderQueue = self.senderQueues.setdefault(transaction.source, deque())
+        senderQueue.append(entry)
+        if len(senderQueue) == 1:
+            heapq.heappush(self.readyHeap,
+                           (-transaction.fee, entry.sequence, entry))
+        heapq.heappush(self.evictionHeap,
+                       (transaction.fee, -entry.sequence, entry))
+        self.size += 1
+
+        evictedTransactions = []
+        while self.size > self.capacity:
+            evictedTransactions += self.evictLowestFee()
+        self.compactHeaps()
+        return evictedTransactions
+
+    # Removes and returns the highest fee transaction that is ready to
+    # be mined. Equal fees are popped in arrival order.
+
+    def pop(self):
+        while len(self.readyHeap) > 0:
+            entry = heapq.heappop(self.readyHeap)[2]
+            if entry.isRemoved:
+                continue
+
+            senderQueue = self.senderQueues[entry.transaction.source]
+            senderQueue.popleft()
+            self.removeEntry(entry)
+            self.size -= 1
+
+            if len(senderQueue) > 0:
+                nextEntry = senderQueue[0]
+                heapq.heappush(self.readyHeap,
+                               (-nextEntry.transaction.fee, nextEntry.sequence, nextEntry))
+            else:
+                del self.senderQueues[entry.transaction.source]
+
+            self.compactHeaps()
+            return entry.transaction
+
+        raise IndexError("pop from an empty mempool")
+
+    def popTransactions(self, count: int) -> list:
+        transactions = []
+        while len(transactions) < count and self.size > 0:
+            transactions.append(self.pop())
+        return transactions
+
+    def peekLowestFeeEntry(self):
+        while len(self.evictionHeap) > 0 and self.evictionHeap[0][2].isRemoved:
+            heapq.heappop(self.evictionHeap)
+        if len(self.evictionHeap) == 0:
+            return None
+        return self.evictionHeap[0][2]
+
+    # Evicts the lowest fee transaction. The later transactions of the
+    # same sender are evicted with it, since they can't be mined before it.
+
+    def evictLowestFee(self) -> list:
+        lowestEntry = self.peekLowestFeeEntry()
+        senderQueue = self.senderQueues[lowestEntry.transaction.source]
+
+        evictedTransactions = []
+        while True:
+            entry = senderQueue.pop()
+            self.removeEntry(entry)
+            self.size -= 1
+            evictedTransactions.append(entry.transaction)
+            if entry is lowestEntry:
+                break
+
+        if len(senderQueue) == 0:
+            del self.senderQueues[lowestEntry.transaction.source]
+
+        evictedTransactions.reverse()
+        return evictedTransactions
+
+    def removeEntry(self, entry: MempoolEntry):
+        entry.isRemoved = True
+        self.entries.pop(entry.transaction.getTransactionHashBytes().hex(), None)
+
+    def compactHeaps(self):
+        if len(self.evictionHeap) > 2 * self.size + 64:
+            self.evictionHeap = [item for item in self.evictionHeap
+                                 if not item[2].isRemoved]
+            heapq.heapify(self.evictionHeap)
+        if len(self.readyHeap) > 2 * len(self.senderQueues) + 64:
+            self.readyHeap = [item for item in self.readyHeap
+                              if not item[2].isRemoved]
+            heapq.heapify(self.readyHeap)
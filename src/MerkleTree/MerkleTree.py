@@ -0,0 +1,75 @@
+# ---------------------------------------------------
+# Merkle tree over the transaction hashes of a block.
+# A block header commits to the root of this tree, so
+# a single transaction can be proven to be in a block
+# with log(n) hashes instead of the whole block.
+# Copyright (c) 2022 Berk Kırtay
+# ---------------------------------------------------
+
+import hashlib
+
+# Leaves and inner nodes are hashed with different prefixes,
+# so an inner node can never be presented as a transaction.
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+# Odd levels are padded with this hash instead of repeating their last
+# node, so repeating the last transactions of a block changes the root.
+EMPTY_NODE = hashlib.sha256(b'\x02').digest()
+
+
+def hashLeaf(transactionHash: bytes) -> bytes:
+    return hashlib.sha256(LEAF_PREFIX + transactionHash).digest()
+
+
+def hashNodes(leftNode: bytes, rightNode: bytes) -> bytes:
+    return hashlib.sha256(NODE_PREFIX + leftNode + rightNode).digest()
+
+
+class MerkleTree:
+    levels = []
+
+    # Every level of the tree is kept to generate proofs. When a level
+    # has an odd number of nodes, the last node is paired with EMPTY_NODE.
+
+    def __init__(self, transactionHashes: list):
+        level = [hashLeaf(transactionHash)
+                 for transactionHash in transactionHashes]
+        if len(level) == 0:
+            level = [hashlib.sha256(b'').digest()]
+
+        self.levels = [level]
+        while len(level) > 1:
+            if len(level) % 2 == 1:
+                level = level + [EMPTY_NODE]
+            level = [hashNodes(level[i], level[i + 1])
+                     for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    def getRoot(self) -> str:
+        return self.levels[-1][0].hex()
+
+    # A proof is the list of sibling hashes from the leaf to the root.
+    # Each step is a (siblingHash, isLeftSibling) pair.
+
+    def getProof(self, leafIndex: int) -> list:
+        proof = []
+        index = leafIndex
+        for level in self.levels[:-1]:
+            siblingIndex = index ^ 1
+            if siblingIndex >= len(level):
+                proof.append((EMPTY_NODE.hex(), False))
+            else:
+                proof.append((level[siblingIndex].hex(), siblingIndex < index))
+            index //= 2
+        return proof
+
+
+def verifyMerkleProof(transactionHash: str, proof: list, merkleRoot: str) -> bool:
+    node = hashLeaf(bytes.fromhex(transactionHash))
+    for siblingHash, isLeftSibling in proof:
+        if isLeftSibling:
+            node = hashNodes(bytes.fromhex(siblingHash), node)
+        else:
+            node = hashNodes(node, bytes.fromhex(siblingHash))
+    return node.hex() == merkleRoot
@@ -8,7 +8,13 @@
 from datetime import datetime
 from Crypto.Hash import SHA256
 import base64
-from src.Transaction.TransactionSignature import TransactionSignature
+import secrets
+from src.Transaction.TransactionSignature import TransactionSignature, getSignatureScheme, \
+    RSA_SIGNATURE_SCHEME
+
+# Transaction nonces are 1 to 2^63 - 1, so they fit the signed 64 bit
+# integers of the binary format and SQLite, where 0 means no nonce.
+MAX_TRANSACTION_NONCE = 2 ** 63 - 1
 
 
 class Transaction:
@@ -21,27 +27,41 @@ class Transaction:
     transactionHash = ''
     transactionSignature = ''
     validationTime = None
+    signatureScheme = RSA_SIGNATURE_SCHEME
+    transactionNonce = None
     isNew = True
 
+    # Builds a transaction directly from its stored fields,
+    # without hashing or signing it again.
+
     @classmethod
     def initializeTransaction(self, source: str, destination: str, balance: float,
                               gas: int, fee: int, transactionMessage: str, transactionHash: str,
-                              transactionSignature: str, validationTime: str):
-        self.gas = gas
-        self.fee = fee
-        self.transactionMessage = transactionMessage
-        self.transactionHash = transactionHash
-        self.transactionSignature = transactionSignature
-        self.validationTime = validationTime
-        self.isNew = False
-        return self(source, destination, balance, None)
+                              transactionSignature: str, validationTime: str,
+                              signatureScheme: int = RSA_SIGNATURE_SCHEME,
+                              transactionNonce: int = None):
+        transaction = self.__new__(self)
+        transaction.source = source
+        transaction.destination = destination
+        transaction.balance = balance
+        transaction.gas = gas
+        transaction.fee = fee
+        transaction.transactionMessage = transactionMessage
+        transaction.transactionHash = transactionHash
+        transaction.transactionSignature = transactionSignature
+        transaction.validationTime = validationTime
+        transaction.signatureScheme = signatureScheme
+        transaction.transactionNonce = transactionNonce
+        transaction.isNew = False
+        return transaction
 
     def __init__(self, source: str, destination: str,
                  balance: float, sourcePrivateKey: str,
-                 transactionMessage=None):
+                 transactionMessage=None, signatureScheme: int = RSA_SIGNATURE_SCHEME):
         self.source = source
         self.destination = destination
         self.balance = balance
+        self.signatureScheme = signatureScheme
         if transactionMessage == None:
             self.transactionMessage = f"Transaction value: {balance}, sent by {source} to {destination}"
         if self.isNew == True:
@@ -49,24 +69,76 @@ class Transaction:
 
     def setTransaction(self, sourcePrivateKey: str):
         self.validationTime = datetime.now().strftime("%H:%M:%S")
+        self.transactionNonce = secrets.randbelow(MAX_TRANSACTION_NONCE) + 1
         self.generateTransactionHash()
 
         transactionSigner = TransactionSignature()
         self.transactionSignature = transactionSigner.signTransaction(
-            self.transactionHash, sourcePrivateKey)
+            self.transactionHash, sourcePrivateKey, self.signatureScheme)
+
+    # The hash commits to the signature scheme of the transaction, except
+    # for RSA, so the hashes of RSA transactions stay the same. The time
+    # only has seconds, so a random nonce keeps the hashes of the same
+    # payment in the same second apart. Transactions of chains from
+    # before the nonce have none and keep their hashes.
 
     def generateTransactionHash(self):
         stream = self.source + self.destination + \
             str(self.balance) + self.validationTime
+        if self.transactionNonce is not None:
+            stream += str(self.transactionNonce)
+        if self.signatureScheme != RSA_SIGNATURE_SCHEME:
+            stream += getSignatureScheme(self.signatureScheme).name
         self.transactionHash = SHA256.new(stream.encode("utf-8"))
 
+    # Raw bytes of the transaction hash, before and after approval.
+    def getTransactionHashBytes(self) -> bytes:
+        if isinstance(self.transactionHash, str):
+            return bytes.fromhex(self.transactionHash)
+        return self.transactionHash.digest()
+
     def approve(self):
         self.transactionHashByte = self.transactionHash
         self.transactionHash = self.transactionHash.hexdigest()
         self.transactionSignature = base64.b64encode(
             self.transactionSignature).decode("ascii")
 
+    # Returns an approved copy of a pending transaction,
+    # the pending transaction itself isn't changed.
+
+    def getApprovedCopy(self):
+        transactionSignature = self.transactionSignature
+        if isinstance(transactionSignature, bytes):
+            transactionSignature = base64.b64encode(
+                transactionSignature).decode("ascii")
+        return Transaction.initializeTransaction(
+            self.source, self.destination, self.balance, self.gas, self.fee,
+            self.transactionMessage, self.getTransactionHashBytes().hex(),
+            transactionSignature, self.validationTime, self.signatureScheme,
+            self.transactionNonce)
+
+    # Returns a pending copy of a transaction in any form, e.g. to
+    # put the transactions of a rolled back block back to the mempool.
+
+    def getPendingCopy(self):
+        transaction = self.getApprovedCopy()
+        transaction.restorePendingState()
+        return transaction
+
+    # Puts an approved transaction, e.g. one received from a peer,
+    # back to its pending form. The hash is generated again from the
+    # fields, so False is returned when it doesn't match the given hash.
+
+    def restorePendingState(self) -> bool:
+        transactionHash = self.transactionHash
+        self.generateTransactionHash()
+        self.transactionSignature = base64.b64decode(self.transactionSignature)
+        return self.transactionHash.hexdigest() == transactionHash
+
     def calculateTransactionFee(self, gasPrice: int):
-        self.gas = len(str(self.balance)) + \
-            round(len(self.transactionMessage) / 100)
+        self.gas = self.calculateGas()
         self.fee = self.gas * gasPrice
+
+    def calculateGas(self) -> int:
+        return len(str(self.balance)) + \
+            round(len(self.transactionMessage) / 100)
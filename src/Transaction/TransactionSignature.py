@@ -7,35 +7,89 @@
 # Handler will validate transaction by decrypting the hash with
 # the source's public key and compare it with the original transaction
 # hash. If they are same, then validation will be successful.
+# Ed25519 can be used instead of RSA, every transaction records
+# the signature scheme of its source's key pair.
 # Copyright (c) 2022 Berk Kırtay
 # --------------------------------------------------------------------
 
 from Crypto import Random
-from Crypto.PublicKey import RSA
+from Crypto.PublicKey import RSA, ECC
 from Crypto.Signature import PKCS1_v1_5 as signer
+from Crypto.Signature import eddsa
+from Crypto.Hash import SHA256
 from src.BlockchainExceptionHandler.BlockchainExceptionHandler import SignatureError
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 import base64
 
+# Parsing a key takes most of the signing and validation time, so the
+# ready signer and verifier objects are kept in LRU caches by their
+# encoded keys. The caches are shared by all TransactionSignatures.
+KEY_CACHE_SIZE = 1024
+
+# Batches smaller than this are validated in the calling process,
+# since starting the worker processes would cost more than it saves.
+BATCH_VALIDATION_THRESHOLD = 64
+
+RSA_KEY_SIZE = 1024
+
+VALIDATION_EXECUTOR = None
+VALIDATION_EXECUTOR_WORKERS = 0
+
+# Signature schemes are stored with the transactions by these ids.
+RSA_SIGNATURE_SCHEME = 0
+ED25519_SIGNATURE_SCHEME = 1
+
 
 class TransactionSignature:
     def __init__(self):
         pass
 
-    def signTransaction(self, transactionHash: str, privateKey: str) -> bytes:
-        privateKey = self.decodeKeyPairs(privateKey)
-        signature = signer.new(RSA.importKey(privateKey)).sign(transactionHash)
+    def signTransaction(self, transactionHash: str, privateKey: str,
+                        signatureScheme: int = RSA_SIGNATURE_SCHEME) -> bytes:
+        signature = getSignatureScheme(signatureScheme).sign(
+            loadSigner(privateKey, signatureScheme), transactionHash)
         return signature
 
     def validateTransaction(self, transactionHash,
-                            signedTransactionHash: bytes, publicKey: str) -> bool:
-        publicKey = self.decodePublicKey(publicKey)
+                            signedTransactionHash: bytes, publicKey: str,
+                            signatureScheme: int = RSA_SIGNATURE_SCHEME) -> bool:
         try:
-            validator = signer.new(RSA.importKey(publicKey)).verify(
-                transactionHash, signedTransactionHash)
+            validator = getSignatureScheme(signatureScheme).verify(
+                loadVerifier(publicKey, signatureScheme), transactionHash, signedTransactionHash)
             return validator
         except:
             raise SignatureError()
 
+    # Validates a batch of (transactionHash, signedTransactionHash, publicKey)
+    # items and returns the results in the same order. An item can have
+    # its signature scheme as a fourth field, RSA is used otherwise. An
+    # item that would raise SignatureError in validateTransaction gets None.
+    # Large batches are split between a pool of worker processes, which
+    # is kept for the next batches, so the processes and their key caches
+    # are reused. A batch is validated here when a worker process dies.
+
+    def validateTransactions(self, items: list, workers: int = 1) -> list:
+        if workers <= 1 or len(items) < BATCH_VALIDATION_THRESHOLD:
+            return validateSignatureBatch(items)
+
+        # Hash objects can't be sent to other processes, only their digests.
+        items = [(item[0].digest() if hasattr(item[0], "digest") else item[0],) + tuple(item[1:])
+                 for item in items]
+        chunkSize = -(-len(items) // workers)
+        chunks = [items[i:i + chunkSize]
+                  for i in range(0, len(items), chunkSize)]
+
+        results = []
+        try:
+            for chunkResults in getValidationExecutor(workers).map(validateSignatureBatch, chunks):
+                results += chunkResults
+        except BrokenProcessPool:
+            shutdownValidationExecutor()
+            return validateSignatureBatch(items)
+        return results
+
     def decodeKeyPairs(self, key: str) -> bytes:
         return base64.b64decode(key)
 
@@ -46,13 +100,163 @@ class TransactionSignature:
         return base64.b64decode(key)
 
 
-def generateGenesisSignerKeyPair() -> list:
-    randomGenerator = Random.new().read
-    keyPair = RSA.generate(1024, randomGenerator)
-    privateKey = keyPair.exportKey('PEM')
-    privateKey = base64.b64encode(privateKey).decode("ascii")
+# RSA-1024 with PKCS#1 v1.5. Public keys are PEM keys without
+# their trivial parts, private keys are base64 encoded PEM keys.
+
+class RSASignatureScheme():
+    name = "RSA"
+
+    def generateKeyPair(self) -> list:
+        randomGenerator = Random.new().read
+        keyPair = RSA.generate(RSA_KEY_SIZE, randomGenerator)
+        privateKey = keyPair.exportKey('PEM')
+        privateKey = base64.b64encode(privateKey).decode("ascii")
+        return [self.getPublicKey(privateKey), privateKey]
+
+    def getPublicKey(self, privateKey: str) -> str:
+        keyPair = RSA.import_key(TransactionSignature().decodeKeyPairs(privateKey))
+        publicKey = keyPair.publickey().exportKey('PEM')
+        return base64.b64encode(publicKey).decode("ascii")[87:-44]
+
+    def loadSigner(self, privateKey: str):
+        privateKey = TransactionSignature().decodeKeyPairs(privateKey)
+        return signer.new(RSA.importKey(privateKey))
+
+    def loadVerifier(self, publicKey: str):
+        publicKey = TransactionSignature().decodePublicKey(publicKey)
+        return signer.new(RSA.importKey(publicKey))
+
+    def sign(self, transactionSigner, transactionHash) -> bytes:
+        return transactionSigner.sign(transactionHash)
+
+    def verify(self, verifier, transactionHash, signature: bytes) -> bool:
+        return verifier.verify(transactionHash, signature)
+
+
+# Ed25519 as in RFC 8032, it signs the digest of the transaction hash.
+# Keys are the base64 encoded 32 byte public key and private seed and
+# signatures are 64 bytes, which makes it faster and smaller than RSA.
+
+class Ed25519SignatureScheme():
+    name = "Ed25519"
+
+    def generateKeyPair(self) -> list:
+        privateKey = base64.b64encode(
+            ECC.generate(curve='Ed25519').seed).decode("ascii")
+        return [self.getPublicKey(privateKey), privateKey]
+
+    def getPublicKey(self, privateKey: str) -> str:
+        keyPair = eddsa.import_private_key(base64.b64decode(privateKey))
+        return base64.b64encode(
+            keyPair.public_key().export_key(format='raw')).decode("ascii")
+
+    def loadSigner(self, privateKey: str):
+        return eddsa.new(eddsa.import_private_key(base64.b64decode(privateKey)), 'rfc8032')
+
+    def loadVerifier(self, publicKey: str):
+        return eddsa.new(eddsa.import_public_key(base64.b64decode(publicKey)), 'rfc8032')
+
+    def sign(self, transactionSigner, transactionHash) -> bytes:
+        return transactionSigner.sign(transactionHash.digest())
+
+    def verify(self, verifier, transactionHash, signature: bytes) -> bool:
+        try:
+            verifier.verify(transactionHash.digest(), signature)
+            return True
+        except ValueError:
+            return False
+
+
+# A new scheme only needs an id here and the methods above.
+SIGNATURE_SCHEMES = {
+    RSA_SIGNATURE_SCHEME: RSASignatureScheme(),
+    ED25519_SIGNATURE_SCHEME: Ed25519SignatureScheme()
+}
+
+
+def getSignatureScheme(signatureScheme: int):
+    if signatureScheme not in SIGNATURE_SCHEMES:
+        raise SignatureError(f"Unknown signature scheme: {signatureScheme}")
+    return SIGNATURE_SCHEMES[signatureScheme]
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def loadSigner(privateKey: str, signatureScheme: int = RSA_SIGNATURE_SCHEME):
+    return getSignatureScheme(signatureScheme).loadSigner(privateKey)
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def loadVerifier(publicKey: str, signatureScheme: int = RSA_SIGNATURE_SCHEME):
+    return getSignatureScheme(signatureScheme).loadVerifier(publicKey)
+
+
+# Stands in for a SHA256 object when only its digest is known, e.g. in
+# a worker process. PKCS#1 v1.5 only uses the digest and the hash oid,
+# Ed25519 only uses the digest.
+
+class PrecomputedHash():
+    oid = SHA256.new().oid
+    digest_size = SHA256.digest_size
+
+    def __init__(self, hashDigest: bytes):
+        self.hashDigest = hashDigest
+
+    def digest(self) -> bytes:
+        return self.hashDigest
+
+
+def validateSignatureBatch(items: list) -> list:
+    transactionSigner = TransactionSignature()
+    results = []
+    for item in items:
+        transactionHash, signedTransactionHash, publicKey = item[:3]
+        signatureScheme = item[3] if len(item) > 3 else RSA_SIGNATURE_SCHEME
+        if isinstance(transactionHash, bytes):
+            transactionHash = PrecomputedHash(transactionHash)
+        try:
+            results.append(transactionSigner.validateTransaction(
+                transactionHash, signedTransactionHash, publicKey, signatureScheme))
+        except SignatureError:
+            results.append(None)
+    return results
+
+
+def getValidationExecutor(workers: int) -> ProcessPoolExecutor:
+    global VALIDATION_EXECUTOR, VALIDATION_EXECUTOR_WORKERS
+    if VALIDATION_EXECUTOR is None or VALIDATION_EXECUTOR_WORKERS != workers:
+        shutdownValidationExecutor()
+        VALIDATION_EXECUTOR = ProcessPoolExecutor(workers)
+        VALIDATION_EXECUTOR_WORKERS = workers
+    return VALIDATION_EXECUTOR
+
+
+def shutdownValidationExecutor():
+    global VALIDATION_EXECUTOR, VALIDATION_EXECUTOR_WORKERS
+    if VALIDATION_EXECUTOR is not None:
+        VALIDATION_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    VALIDATION_EXECUTOR = None
+    VALIDATION_EXECUTOR_WORKERS = 0
+
+
+def getKeyCacheInfo() -> dict:
+    signerInfo = loadSigner.cache_info()
+    verifierInfo = loadVerifier.cache_info()
+    return {
+        "signerHits": signerInfo.hits,
+        "signerMisses": signerInfo.misses,
+        "verifierHits": verifierInfo.hits,
+        "verifierMisses": verifierInfo.misses
+    }
+
+
+def clearKeyCache():
+    loadSigner.cache_clear()
+    loadVerifier.cache_clear()
+
+
+def generateKeyPair(signatureScheme: int = RSA_SIGNATURE_SCHEME) -> list:
+    return getSignatureScheme(signatureScheme).generateKeyPair()
 
-    publicKey = keyPair.publickey().exportKey('PEM')
-    publicKey = base64.b64encode(publicKey).decode("ascii")[87:-44]
 
-    return [publicKey, privateKey]
+def generateGenesisSignerKeyPair(signatureScheme: int = RSA_SIGNATURE_SCHEME) -> list:
+    return generateKeyPair(signatureScheme)
@@ -4,6 +4,9 @@
 # ----------------------------------------
 
 from src.Blockchain.Blockchain import Blockchain
+from src.Transaction.TransactionSignature import getSignatureScheme, RSA_SIGNATURE_SCHEME, \
+    RSA_KEY_SIZE
+from src.KeyPairPool.KeyPairPool import getKeyPairPool
 from datetime import datetime
 from Crypto.PublicKey import RSA
 from Crypto import Random
@@ -18,10 +21,15 @@ class Wallet():
     privateKey = ''
     balance = 0
     creationTime = None
-    keySize = 1024
+    keySize = RSA_KEY_SIZE
+    signatureScheme = RSA_SIGNATURE_SCHEME
 
-    def __init__(self, ownerName: str):
+    # Transactions of a wallet must be signed with the wallet's
+    # signature scheme, e.g. Transaction(..., signatureScheme=wallet.signatureScheme).
+
+    def __init__(self, ownerName: str, signatureScheme: int = RSA_SIGNATURE_SCHEME):
         self.ownerName = ownerName
+        self.signatureScheme = signatureScheme
         self.createNewWallet()
 
     def createNewWallet(self):
@@ -30,7 +38,15 @@ class Wallet():
         self.exportKeyPair()
         self.done()
 
+    # Key pairs are taken from a pool that generates them in the
+    # background. Only RSA keys of another size are generated here.
+
     def generateKeyPair(self):
+        if self.signatureScheme != RSA_SIGNATURE_SCHEME or self.keySize == RSA_KEY_SIZE:
+            self.publicKey, self.privateKey = getKeyPairPool(
+                self.signatureScheme).getKeyPair()
+            return
+
         randomGenerator = Random.new().read
         keyPair = RSA.generate(self.keySize, randomGenerator)
         privateKey = keyPair.exportKey('PEM')
@@ -45,12 +61,27 @@ class Wallet():
     def exportKeyPair(self):
         keypair = {
             "wallet_user_name": self.ownerName,
-            "private_key": self.privateKey
+            "private_key": self.privateKey,
+            "signature_scheme": self.signatureScheme
         }
         pathlib.Path('./key_pair_exports').mkdir(exist_ok=True)
         with open('./key_pair_exports/' + self.ownerName + '_key_pair.json', 'w', encoding='utf-8') as f:
             json.dump(keypair, f, ensure_ascii=False, indent=4)
 
+    # Builds a wallet from an existing key pair, no key pair
+    # is generated or exported.
+
+    @classmethod
+    def initializeWallet(self, ownerName: str, publicKey: str, privateKey: str,
+                         signatureScheme: int = RSA_SIGNATURE_SCHEME):
+        wallet = self.__new__(self)
+        wallet.ownerName = ownerName
+        wallet.publicKey = publicKey
+        wallet.privateKey = privateKey
+        wallet.signatureScheme = signatureScheme
+        wallet.creationTime = datetime.now().strftime("%H:%M:%S")
+        return wallet
+
     @classmethod
     def importWallet(self, ownerName):
         keypair = dict()
@@ -58,15 +89,13 @@ class Wallet():
         with open('./key_pair_exports/' + ownerName + '_key_pair.json', 'r', encoding='utf-8') as f:
             keypair = json.load(f)
 
-        keyPair = RSA.import_key(base64.b64decode(keypair["private_key"]))
-        private_key = keyPair.export_key('PEM')
-        public_key = keyPair.publickey().exportKey('PEM')
-
-        wallet = Wallet(ownerName)
+        # Key pairs exported before the signature schemes are RSA key pairs.
+        signatureScheme = keypair.get("signature_scheme", RSA_SIGNATURE_SCHEME)
+        privateKey = keypair["private_key"]
+        publicKey = getSignatureScheme(signatureScheme).getPublicKey(privateKey)
 
-        wallet.privateKey = base64.b64encode(private_key).decode("ascii")
-        wallet.publicKey = base64.b64encode(public_key).decode("ascii")
-        wallet.publicKey = wallet.publicKey[87:-44]
+        wallet = Wallet.initializeWallet(
+            ownerName, publicKey, privateKey, signatureScheme)
 
         logging.info(f"Wallet: A new wallet named {ownerName} is imported.")
         return wallet
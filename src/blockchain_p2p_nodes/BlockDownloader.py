@@ -0,0 +1,99 @@
+# ---------------------------------------------
+# Parallel download of block bodies for the
+# headers-first sync of the P2P server.
+# Copyright (c) 2022 Berk Kırtay
+# ---------------------------------------------
+
+import asyncio
+import logging
+from collections import deque
+from src.BlockchainExceptionHandler.BlockchainExceptionHandler import NetworkProtocolError
+
+# A peer isn't asked for more blocks after this many failed requests.
+MAX_PEER_FAILURES = 3
+
+
+# The header chain tells which block must be at every height, so block
+# bodies can be fetched in ranges from different peers at the same time
+# and every body is checked against its header. Every peer has a window
+# of requests in flight. A range that times out or comes back invalid
+# goes back to the queue, where a faster peer picks it up.
+
+class BlockDownloader():
+    def __init__(self, server, peers: list, firstHeight: int, blockHashes: list,
+                 rangeSize: int = 16, peerWindow: int = 4, requestTimeout: float = 10):
+        self.server = server
+        self.peers = peers
+        self.firstHeight = firstHeight
+        self.blockHashes = blockHashes
+        self.rangeSize = rangeSize
+        self.peerWindow = peerWindow
+        self.requestTimeout = requestTimeout
+        self.ranges = deque()
+        self.requestsInFlight = 0
+        self.downloadedBlocks = {}
+        self.peerFailures = {}
+        self.peerBlockCounts = {}
+        self.rangesChanged = None
+
+    async def download(self) -> list:
+        self.rangesChanged = asyncio.Condition()
+        for start in range(0, len(self.blockHashes), self.rangeSize):
+            self.ranges.append(
+                (start, min(self.rangeSize, len(self.blockHashes) - start)))
+
+        await asyncio.gather(*[self.downloadFromPeer(peer)
+                               for peer in self.peers
+                               for i in range(self.peerWindow)])
+
+        if len(self.ranges) > 0:
+            raise NetworkProtocolError(
+                "Block bodies couldn't be downloaded from the peers!")
+
+        return [self.downloadedBlocks[i] for i in range(len(self.blockHashes))]
+
+    async def downloadFromPeer(self, peer):
+        while self.peerFailures.get(peer, 0) < MAX_PEER_FAILURES:
+            async with self.rangesChanged:
+                while len(self.ranges) == 0 and self.requestsInFlight > 0:
+                    await self.rangesChanged.wait()
+                if len(self.ranges) == 0:
+                    return
+                start, count = self.ranges.popleft()
+                self.requestsInFlight += 1
+
+            isDownloaded = False
+            try:
+                blocks = await self.server.requestBlockBodies(
+                    peer, self.firstHeight + start, count, self.requestTimeout)
+                isDownloaded = self.storeBlocks(start, count, blocks)
+            except (asyncio.TimeoutError, ConnectionError, NetworkProtocolError) as err:
+                logging.warning(
+                    f"Block request to {peer.address} failed: {type(err).__name__}")
+
+            async with self.rangesChanged:
+                self.requestsInFlight -= 1
+                if isDownloaded == False:
+                    self.ranges.appendleft((start, count))
+                    self.peerFailures[peer] = self.peerFailures.get(
+                        peer, 0) + 1
+                else:
+                    self.peerBlockCounts[peer] = self.peerBlockCounts.get(
+                        peer, 0) + count
+                self.rangesChanged.notify_all()
+
+    # Every block must have the hash of its header and the merkle
+    # root of its transactions must match the header.
+
+    def storeBlocks(self, start: int, count: int, blocks: list) -> bool:
+        if len(blocks) != count:
+            return False
+        for i, block in enumerate(blocks):
+            if block.blockHash != self.blockHashes[start + i] or \
+                    block.generateBlockHash() != block.blockHash or \
+                    block.generateMerkleRoot() != block.merkleRoot:
+                return False
+
+        for i, block in enumerate(blocks):
+            self.downloadedBlocks[start + i] = block
+        return True
@@ -1,15 +1,10 @@
 # Copyright (c) 2022 Berk Kırtay
 
-from Blockchain import *
-from Wallet import *
-from Transaction import Transaction
-from DataConverter import *
-from P2PServer import P2PServer
-
-
-from hashlib import new
+from src.Blockchain.Blockchain import Blockchain
+from src.Wallet.Wallet import Wallet
+from src.Transaction.Transaction import Transaction
+from src.blockchain_p2p_nodes.P2PServer import P2PServer
 import asyncio
-import time
 
 # TODO
 
@@ -22,32 +17,59 @@ class Node:
     def __init__(self, public_key):
         self.nodePublicAddress = public_key
 
-    def initializeNode(self):
-        self.network = P2PServer(None, 8001)
-        self.blockchain = Blockchain(2, 3)
-        asyncio.run(self.network.addBlockchainData(self.blockchain))
+    async def initializeNode(self, address=None, PORT=8001, blockchain=None):
+        self.blockchain = Blockchain(2, 3) if blockchain is None else blockchain
+        self.network = P2PServer(address, PORT, self.blockchain)
+        await self.network.initializeNetwork()
+
+    async def connectToPeer(self, address, PORT):
+        self.network.peerManager.addPeerAddress(address, PORT)
+
+    async def stopNode(self):
+        await self.network.stopNetwork()
 
-    def mineBlock(self):
-        self.blockchain.handleTransaction(self.nodePublicAddress)
+    # Newly mined blocks are announced to the peers and returned.
+    # Blocks are mined in a thread, so the node keeps serving its peers.
 
-    def sendUpdatedBlockchain(self):
-        asyncio.run(self.network.addBlockchainData(self.blockchain))
+    async def mineBlock(self) -> list:
+        minedBlocks = await self.network.runBlockchainTask(self.mineTransactions)
+        for block in minedBlocks:
+            await self.network.announceBlock(block)
+        return minedBlocks
+
+    def mineTransactions(self) -> list:
+        self.receiveUpdatedBlockchain()
+        minedHeight = len(self.blockchain.blockchain)
+        self.blockchain.handleTransactions(self.nodePublicAddress)
+        return [self.blockchain.blockchain[height]
+                for height in range(minedHeight, len(self.blockchain.blockchain))]
 
     def receiveUpdatedBlockchain(self):
         self.blockchain = self.network.blockchain
 
-    def sendTransaction(self, transaction):
-        self.blockchain.addTransaction(transaction)
-        self.sendUpdatedBlockchain()
+    # Only the hash of the transaction is announced, the peers
+    # request the transaction if they haven't seen it yet.
+
+    async def sendTransaction(self, transaction):
+        async with self.network.blockchainLock:
+            self.receiveUpdatedBlockchain()
+            self.blockchain.addTransaction(transaction)
+        await self.network.announceTransaction(transaction)
+
+
+async def runNode():
+    wallet = Wallet("berk")
+    wallet.createNewWallet()
 
+    node = Node(wallet.publicKey)
+    await node.initializeNode()
+    node.blockchain.forceTransaction(wallet.publicKey, 1000)
+    await node.mineBlock()
+    await node.sendTransaction(Transaction(
+        wallet.publicKey, "kimse", 1000, wallet.privateKey))
+    await node.mineBlock()
+    await node.network.serveForever()
 
-wallet = Wallet("berk")
-wallet.createNewWallet()
 
-node = Node(wallet.publicKey)
-node.initializeNode()
-node.blockchain.forceTransaction(wallet.publicKey, 1000)
-node.mineBlock()
-node.sendTransaction(Transaction(
-    wallet.publicKey, "kimse", 1000, wallet.privateKey))
-node.mineBlock()
+if __name__ == "__main__":
+    asyncio.run(runNode())
@@ -3,102 +3,987 @@
 # This module is still under development.
 # ----------------------------------------
 
-from hashlib import new
-import socket
-import threading
 import asyncio
-import time
-from Blockchain import *
-from DataConverter import DataConverter
+import functools
+import hashlib
+import logging
+import struct
+from src.Blockchain.Blockchain import Blockchain, Block, BLOCK_HEADER_SIZE, decodeBlockHeader, \
+    getBlockWork, getExpectedHashDifficulty
+from src.DataConverter.DataConverter import DataConverter
+from src.DataConverter import BinaryConverter
+from src.blockchain_p2p_nodes.BlockDownloader import BlockDownloader
+from src.blockchain_p2p_nodes.PeerManager import PeerManager, PING, PONG
+from src.BloomFilter.BloomFilter import RotatingBloomFilter
+from src.BlockchainExceptionHandler.BlockchainExceptionHandler import NetworkProtocolError, \
+    BlockchainSequenceError, IllegalAccessError, SignatureError, BalanceError, \
+    TransactionDataConflictError, MempoolError
 
+# Every message on the wire is framed as a u32 body length, a u8 message
+# type and the body itself. Frames are read with readexactly, so a chain
+# of any size arrives in one piece instead of being cut at a recv size.
+MESSAGE_HEADER = struct.Struct(">IB")
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+GET_BLOCKCHAIN = 1
+BLOCKCHAIN = 2
+STATUS = 3
+GET_BLOCKS = 4
+BLOCKS = 5
+GET_HEADERS = 6
+HEADERS = 7
+GET_BLOCK_BODIES = 8
+BLOCK_BODIES = 9
+INVENTORY = 10
+GET_DATA = 11
+TRANSACTION = 12
+BLOCK = 13
+COMPACT_BLOCK = 14
+GET_BLOCK_TRANSACTIONS = 15
+BLOCK_TRANSACTIONS = 16
+# PING and PONG (17, 18) are handled by the PeerManager.
+
+# Status: chain height, tip hash and the accumulated work of the chain.
+# Blocks: height of the first block and the number of blocks, each
+# block follows with its length.
+STATUS_BODY = struct.Struct(">Q32s48s")
+LOCATOR_LENGTH = struct.Struct(">H")
+BLOCKS_HEADER = struct.Struct(">QI")
+BLOCK_LENGTH = struct.Struct(">I")
+MAX_BLOCKS_PER_MESSAGE = 500
+# Headers: height of the first header and the number of headers,
+# followed by the fixed size block headers.
+HEADERS_HEADER = struct.Struct(">QI")
+MAX_HEADERS_PER_MESSAGE = 2000
+# Block bodies: height of the first block and the number of blocks.
+BLOCK_RANGE = struct.Struct(">QI")
+# Inventory and get data: number of items, then the type and hash of each.
+INVENTORY_LENGTH = struct.Struct(">I")
+INVENTORY_ITEM = struct.Struct(">B32s")
+INVENTORY_TRANSACTION = 1
+INVENTORY_BLOCK = 2
+INVENTORY_COMPACT_BLOCK = 3
+# Objects are remembered as seen in a rotating bloom filter of this size.
+SEEN_INVENTORY_CAPACITY = 50000
+# Requested blocks are only looked up among this many recent blocks.
+MAX_RELAY_DEPTH = 100
+# Compact block: the block fields, a short id of every transaction and
+# the transactions that are sent in full with their index in the block.
+# Missing transactions are requested by their indexes.
+SHORT_ID_SIZE = 6
+PREFILLED_LENGTH = struct.Struct(">H")
+TRANSACTION_INDEX = struct.Struct(">I")
+BLOCK_TRANSACTIONS_HEADER = struct.Struct(">32sI")
+# At most this many compact blocks wait for their missing transactions.
+MAX_PARTIAL_BLOCKS = 16
+
+
+def encodeMessage(messageType: int, body: bytes = b"") -> bytes:
+    if len(body) > MAX_MESSAGE_SIZE:
+        raise NetworkProtocolError("Message is too large to be sent!")
+    return MESSAGE_HEADER.pack(len(body), messageType) + body
+
+
+async def readMessage(reader: asyncio.StreamReader):
+    bodyLength, messageType = MESSAGE_HEADER.unpack(
+        await reader.readexactly(MESSAGE_HEADER.size))
+    if bodyLength > MAX_MESSAGE_SIZE:
+        raise NetworkProtocolError("Received message is too large!")
+    return messageType, await reader.readexactly(bodyLength)
+
+
+# A malformed body makes the struct, number or text decoding fail. The
+# decoders raise a NetworkProtocolError for it, so the peer is dropped
+# instead of the error ending its task.
+
+def protocolDecoder(decoder):
+    @functools.wraps(decoder)
+    def decode(*args):
+        try:
+            return decoder(*args)
+        except (struct.error, ValueError, UnicodeDecodeError) as err:
+            raise NetworkProtocolError(f"Invalid message body: {err}")
+    return decode
+
+
+@protocolDecoder
+def decodeStatus(body: bytes):
+    tipHeight, tipHash, chainWork = STATUS_BODY.unpack(body)
+    return tipHeight, tipHash.hex(), int.from_bytes(chainWork, 'big')
+
+
+@protocolDecoder
+def decodeBlockRange(body: bytes):
+    return BLOCK_RANGE.unpack(body)
+
+
+@protocolDecoder
+def decodeTransaction(body: bytes):
+    transaction, offset = BinaryConverter.decodeTransaction(body)
+    if offset != len(body):
+        raise NetworkProtocolError("Invalid transaction!")
+    return transaction
+
+
+@protocolDecoder
+def decodeBlock(body: bytes):
+    block, offset = BinaryConverter.decodeBlock(body)
+    if offset != len(body):
+        raise NetworkProtocolError("Invalid block!")
+    return block
+
+
+def encodeLocator(locator: list) -> bytes:
+    return LOCATOR_LENGTH.pack(len(locator)) + \
+        b''.join(bytes.fromhex(blockHash) for blockHash in locator)
+
+
+@protocolDecoder
+def decodeLocator(body: bytes) -> list:
+    locatorLength = LOCATOR_LENGTH.unpack_from(body)[0]
+    offset = LOCATOR_LENGTH.size
+    if len(body) != offset + locatorLength * 32:
+        raise NetworkProtocolError("Invalid block locator!")
+    return [body[offset + i * 32:offset + (i + 1) * 32].hex() for i in range(locatorLength)]
+
+
+def encodeBlocks(firstHeight: int, blocks: list) -> bytes:
+    encodedBlocks = [BLOCKS_HEADER.pack(firstHeight, len(blocks))]
+    for block in blocks:
+        encodedBlock = BinaryConverter.encodeBlock(block)
+        encodedBlocks.append(BLOCK_LENGTH.pack(len(encodedBlock)))
+        encodedBlocks.append(encodedBlock)
+    return b''.join(encodedBlocks)
+
+
+@protocolDecoder
+def decodeBlocks(body: bytes):
+    firstHeight, blockCount = BLOCKS_HEADER.unpack_from(body)
+    offset = BLOCKS_HEADER.size
+    blocks = []
+    for i in range(blockCount):
+        offset += BLOCK_LENGTH.size
+        block, offset = BinaryConverter.decodeBlock(body, offset)
+        blocks.append(block)
+    return firstHeight, blocks
+
+
+def encodeHeaders(firstHeight: int, headers: list) -> bytes:
+    return HEADERS_HEADER.pack(firstHeight, len(headers)) + b''.join(headers)
+
+
+@protocolDecoder
+def decodeHeaders(body: bytes):
+    firstHeight, headerCount = HEADERS_HEADER.unpack_from(body)
+    offset = HEADERS_HEADER.size
+    if len(body) != offset + headerCount * BLOCK_HEADER_SIZE:
+        raise NetworkProtocolError("Invalid block headers!")
+    return firstHeight, [body[offset + i * BLOCK_HEADER_SIZE:offset + (i + 1) * BLOCK_HEADER_SIZE]
+                         for i in range(headerCount)]
+
+
+def encodeInventory(items: list) -> bytes:
+    return INVENTORY_LENGTH.pack(len(items)) + b''.join(
+        INVENTORY_ITEM.pack(itemType, bytes.fromhex(itemHash)) for itemType, itemHash in items)
+
+
+@protocolDecoder
+def decodeInventory(body: bytes) -> list:
+    itemCount = INVENTORY_LENGTH.unpack_from(body)[0]
+    if len(body) != INVENTORY_LENGTH.size + itemCount * INVENTORY_ITEM.size:
+        raise NetworkProtocolError("Invalid inventory!")
+    return [(itemType, itemHash.hex()) for itemType, itemHash in
+            INVENTORY_ITEM.iter_unpack(body[INVENTORY_LENGTH.size:])]
+
+
+# Short ids are salted with the block hash, so transactions
+# can't be built ahead to collide with the ids of a block.
+
+def getShortTransactionId(blockHash: str, transactionHash: bytes) -> bytes:
+    return hashlib.sha256(bytes.fromhex(blockHash) + transactionHash).digest()[:SHORT_ID_SIZE]
+
+
+# The last transaction of a block is its reward, which no other
+# node has in its mempool, so it is always sent in full.
+
+def encodeCompactBlock(block) -> bytes:
+    transactionCount = len(block.blockTransactions)
+    prefilledIndexes = [transactionCount - 1] if transactionCount > 0 else []
+    encodedBlock = [BinaryConverter.encodeBlockFields(block, transactionCount)]
+    encodedBlock += [getShortTransactionId(block.blockHash, transaction.getTransactionHashBytes())
+                     for transaction in block.blockTransactions]
+    encodedBlock.append(PREFILLED_LENGTH.pack(len(prefilledIndexes)))
+    encodedBlock += encodeIndexedTransactions(block, prefilledIndexes)
+    return b''.join(encodedBlock)
+
+
+@protocolDecoder
+def decodeCompactBlock(body: bytes):
+    body = memoryview(body)
+    blockFields, transactionCount, offset = BinaryConverter.decodeBlockFields(
+        body)
+    if offset + transactionCount * SHORT_ID_SIZE > len(body):
+        raise NetworkProtocolError("Invalid compact block!")
+    shortIds = [bytes(body[offset + i * SHORT_ID_SIZE:offset + (i + 1) * SHORT_ID_SIZE])
+                for i in range(transactionCount)]
+    offset += transactionCount * SHORT_ID_SIZE
+    prefilledCount = PREFILLED_LENGTH.unpack_from(body, offset)[0]
+    prefilledTransactions = decodeIndexedTransactions(
+        body, offset + PREFILLED_LENGTH.size, prefilledCount)
+    return blockFields, shortIds, prefilledTransactions
+
+
+def encodeIndexedTransactions(block, indexes: list) -> list:
+    return [TRANSACTION_INDEX.pack(index) + BinaryConverter.encodeTransaction(block.blockTransactions[index])
+            for index in indexes]
+
+
+@protocolDecoder
+def decodeIndexedTransactions(body, offset: int, transactionCount: int) -> dict:
+    transactions = {}
+    for i in range(transactionCount):
+        index = TRANSACTION_INDEX.unpack_from(body, offset)[0]
+        transactions[index], offset = BinaryConverter.decodeTransaction(
+            body, offset + TRANSACTION_INDEX.size)
+    return transactions
+
+
+@protocolDecoder
+def decodeBlockTransactionRequest(body: bytes):
+    blockHash, indexCount = BLOCK_TRANSACTIONS_HEADER.unpack_from(body)
+    indexes = [index for index, in TRANSACTION_INDEX.iter_unpack(
+        body[BLOCK_TRANSACTIONS_HEADER.size:])]
+    if len(indexes) != indexCount:
+        raise NetworkProtocolError("Invalid block transaction request!")
+    return blockHash.hex(), indexes
+
+
+@protocolDecoder
+def decodeBlockTransactions(body: bytes):
+    blockHash, transactionCount = BLOCK_TRANSACTIONS_HEADER.unpack_from(body)
+    return blockHash.hex(), decodeIndexedTransactions(
+        memoryview(body), BLOCK_TRANSACTIONS_HEADER.size, transactionCount)
+
+
+# Checks that the headers are linked to each other and to the given
+# previous block hash and that every header has a valid proof of work
+# and the difficulty expected at its height. The first header is at
+# firstHeight. Returns the block hashes of the headers.
+
+def verifyHeaderChain(headers: list, previousBlockHash: str = None,
+                      genesisHashDifficulty: int = 0, firstHeight: int = 0) -> list:
+    blockHashes = []
+    for i, header in enumerate(headers):
+        headerPreviousHash, merkleRoot, hashDifficulty, blockNonce = decodeBlockHeader(
+            header)
+        blockHash = hashlib.sha256(header).hexdigest()
+        if previousBlockHash is not None and headerPreviousHash != previousBlockHash:
+            raise NetworkProtocolError("Block headers aren't linked!")
+        if blockHash[:hashDifficulty] != "0" * hashDifficulty:
+            raise NetworkProtocolError("Block header has an invalid proof of work!")
+        if hashDifficulty < getExpectedHashDifficulty(genesisHashDifficulty, firstHeight + i):
+            raise NetworkProtocolError("Block header has a lower difficulty than expected!")
+        blockHashes.append(blockHash)
+        previousBlockHash = blockHash
+    return blockHashes
+
+
+# Messages to a peer are queued and written by its own writer task, so
+# a sender doesn't wait for a slow peer to read. When more than
+# highWaterMark bytes are queued, senders wait for the queue to drain
+# and the peer is dropped if it doesn't drain in sendTimeout seconds.
+# Gossip uses trySend instead, which never waits for a slow peer.
+
+class Peer():
+    highWaterMark = 4 * 1024 * 1024
+    sendTimeout = 10
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info('peername')
+        self.tipHeight = 0
+        self.tipHash = None
+        self.chainWork = 0
+        self.statusReceived = asyncio.Event()
+        self.pendingRequests = {}
+        self.sendQueue = asyncio.Queue()
+        self.queuedBytes = 0
+        self.belowHighWaterMark = asyncio.Event()
+        self.belowHighWaterMark.set()
+        self.closed = asyncio.Event()
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.writerTask = asyncio.create_task(self.writeMessages())
+
+    async def send(self, messageType: int, body: bytes = b""):
+        if self.closed.is_set():
+            raise ConnectionError("Peer is disconnected")
+        message = encodeMessage(messageType, body)
+        self.queuedBytes += len(message)
+        self.sendQueue.put_nowait(message)
+        if self.queuedBytes <= self.highWaterMark:
+            return
+
+        self.belowHighWaterMark.clear()
+        try:
+            await asyncio.wait_for(self.belowHighWaterMark.wait(), self.sendTimeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Peer {self.address} is too slow, dropping it")
+            await self.close()
+            raise ConnectionError("Peer is too slow")
+
+    # Queues a message only if it keeps the queue under highWaterMark,
+    # otherwise the message is dropped. Returns whether it is queued.
+
+    def trySend(self, messageType: int, body: bytes = b"") -> bool:
+        message = encodeMessage(messageType, body)
+        if self.closed.is_set() or self.queuedBytes + len(message) > self.highWaterMark:
+            return False
+        self.queuedBytes += len(message)
+        self.sendQueue.put_nowait(message)
+        return True
+
+    # A frame is written with a single write call,
+    # so messages never interleave.
+
+    async def writeMessages(self):
+        try:
+            while True:
+                message = await self.sendQueue.get()
+                self.writer.write(message)
+                await self.writer.drain()
+                self.bytesSent += len(message)
+                self.queuedBytes -= len(message)
+                if self.queuedBytes <= self.highWaterMark:
+                    self.belowHighWaterMark.set()
+        except (ConnectionError, OSError):
+            await self.close()
+
+    async def receive(self):
+        messageType, body = await readMessage(self.reader)
+        self.bytesReceived += MESSAGE_HEADER.size + len(body)
+        return messageType, body
+
+    # Sends a request and waits for the response that is
+    # given to resolveRequest with the same key.
+
+    async def request(self, messageType: int, body: bytes, responseKey, timeout: float):
+        response = asyncio.get_running_loop().create_future()
+        self.pendingRequests[responseKey] = response
+        try:
+            await self.send(messageType, body)
+            return await asyncio.wait_for(response, timeout)
+        finally:
+            self.pendingRequests.pop(responseKey, None)
+
+    def resolveRequest(self, responseKey, result):
+        response = self.pendingRequests.get(responseKey)
+        if response is not None and not response.done():
+            response.set_result(result)
+
+    def cancelRequests(self):
+        for response in self.pendingRequests.values():
+            if not response.done():
+                response.set_exception(ConnectionError("Peer is disconnected"))
+
+    async def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        if self.writerTask is not asyncio.current_task():
+            self.writerTask.cancel()
+        # Data that a slow peer hasn't read would keep the socket open.
+        if self.writer.transport.get_write_buffer_size() > 0:
+            self.writer.transport.abort()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+# All peers are served by coroutines on a single event loop. Incoming
+# messages are dispatched by their type to messageHandlers, so new
+# message types only need a new entry there.
+# Peers sync incrementally: both sides send their status when they
+# connect, the side with less work sends a block locator and the other
+# side answers with the blocks after their common ancestor. The chain
+# with the most accumulated work wins: a branch is applied with a reorg
+# of the blocks after the fork point. The whole chain is only sent when
+# the chains don't share a block or the branch doesn't fit a message.
+# A node that is far behind can sync headers first instead, see
+# headersFirstSync. Then the peers only answer its requests.
+# The connections are kept by a PeerManager.
+# New transactions and blocks are gossiped: their hashes are announced
+# to the peers, which only request the objects they haven't seen yet
+# and announce them further. Seen hashes are kept in a rotating bloom
+# filter, so an object is requested and forwarded once per node.
+# Blocks are relayed as compact blocks: the receiver rebuilds the block
+# from the transactions in its own mempool and only requests the ones
+# it doesn't have.
 
 class P2PServer():
-    blockchain = None
-    address = ''
-    PORT = 7500
-    socket = None
-    continuousTransfer = True
+    autoSync = True
+    bodyRangeSize = 16
+    peerRequestWindow = 4
+    requestTimeout = 10
 
-    def __init__(self, address, PORT):
+    def __init__(self, address, PORT, blockchain: Blockchain = None):
         self.address = address
         self.PORT = PORT
-
-    async def addBlockchainData(self, blockchain):
         self.blockchain = blockchain
-        self.setNetworkPreferences()
-        await self.initializeNetwork()
+        self.server = None
+        self.peers = set()
+        self.peerTasks = set()
+        self.blockchainUpdated = None
+        self.blockchainLock = None
+        self.seenInventory = RotatingBloomFilter(SEEN_INVENTORY_CAPACITY)
+        self.partialBlocks = {}
+        self.peerManager = PeerManager(self)
+        self.listeners = []
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.messageHandlers = {
+            GET_BLOCKCHAIN: self.handleGetBlockchain,
+            BLOCKCHAIN: self.handleBlockchain,
+            STATUS: self.handleStatus,
+            GET_BLOCKS: self.handleGetBlocks,
+            BLOCKS: self.handleBlocks,
+            GET_HEADERS: self.handleGetHeaders,
+            HEADERS: self.handleHeaders,
+            GET_BLOCK_BODIES: self.handleGetBlockBodies,
+            BLOCK_BODIES: self.handleBlockBodies,
+            INVENTORY: self.handleInventory,
+            GET_DATA: self.handleGetData,
+            TRANSACTION: self.handleTransaction,
+            BLOCK: self.handleBlock,
+            COMPACT_BLOCK: self.handleCompactBlock,
+            GET_BLOCK_TRANSACTIONS: self.handleGetBlockTransactions,
+            BLOCK_TRANSACTIONS: self.handleBlockTransactions,
+            PING: self.peerManager.handlePing,
+            PONG: self.peerManager.handlePong
+        }
 
-    def setNetworkPreferences(self):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.address = socket.gethostname()
+    async def addBlockchainData(self, blockchain: Blockchain):
+        self.blockchain = blockchain
+        if self.server is None:
+            await self.initializeNetwork()
+        else:
+            await self.broadcastStatus()
 
     async def initializeNetwork(self):
+        self.blockchainUpdated = asyncio.Event()
+        self.blockchainLock = asyncio.Lock()
+        self.server = await asyncio.start_server(
+            self.handleNewConnection, self.address, self.PORT)
+        # Port 0 lets the system pick a free port.
+        self.PORT = self.server.sockets[0].getsockname()[1]
+        self.peerManager.start()
+        logging.info(f"Listening for peers on port {self.PORT}")
+
+    async def serveForever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def connectToPeer(self, address, PORT) -> Peer:
+        if not self.peerManager.canAcceptPeer():
+            raise ConnectionError("Peer pool is full")
+        reader, writer = await asyncio.open_connection(address, PORT)
+        peer = Peer(reader, writer)
+        self.startPeerTask(peer)
+        await self.sendStatus(peer)
+        logging.info(f"Connected to peer {peer.address}")
+        return peer
+
+    async def handleNewConnection(self, reader, writer):
+        if not self.peerManager.canAcceptPeer():
+            logging.warning("Peer pool is full, a new connection is refused")
+            writer.close()
+            return
+        peer = Peer(reader, writer)
+        logging.info(f"New connection from {peer.address}")
+        await self.sendStatus(peer)
+        await self.servePeer(peer)
+
+    def startPeerTask(self, peer: Peer):
+        task = asyncio.create_task(self.servePeer(peer))
+        self.peerTasks.add(task)
+        task.add_done_callback(self.peerTasks.discard)
+
+    async def servePeer(self, peer: Peer):
+        self.peers.add(peer)
         try:
-            self.socket.connect((self.address, self.PORT))
-            print("Connected to network!")
-            while self.continuousTransfer == True:
-                data = self.socket.recv(1024 * 64).decode("utf-8")
-                receivedBlockchain = self.getBlockchainDataAsObject(data)
-                print("Blockchain data is recevied!")
-
-                if len(receivedBlockchain.blockchain) > len(self.blockchain.blockchain):
-                    self.blockchain = receivedBlockchain
-                else:
-                    data = self.getBlockchainDataAsBytes()
-                    self.socket.send(data)
-                    print("New blockchain data is sent to peers")
-
-                time.sleep(10)
+            while True:
+                messageType, body = await peer.receive()
+                handler = self.messageHandlers.get(messageType)
+                if handler is None:
+                    logging.warning(
+                        f"Unknown message type {messageType} from {peer.address}")
+                    continue
+                await handler(peer, body)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logging.info(f"Peer {peer.address} is disconnected")
+        except NetworkProtocolError as err:
+            logging.warning(f"NetworkProtocolError: {peer.address}: {err}")
+        finally:
+            self.peers.discard(peer)
+            peer.cancelRequests()
+            await peer.close()
+            self.bytesSent += peer.bytesSent
+            self.bytesReceived += peer.bytesReceived
+
+    # Bytes sent and received by the node, including the connected peers.
 
+    def getTraffic(self):
+        return self.bytesSent + sum(peer.bytesSent for peer in self.peers), \
+            self.bytesReceived + sum(peer.bytesReceived for peer in self.peers)
+
+    # Listeners are called with an inventory type and a hash when a
+    # transaction or block from a peer is accepted, e.g. to measure
+    # how fast objects spread in the network.
+
+    def notifyListeners(self, itemType: int, itemHash: str):
+        for listener in self.listeners:
+            listener(itemType, itemHash)
+
+    async def handleGetBlockchain(self, peer: Peer, body: bytes):
+        if self.blockchain is None:
+            return
+        await peer.send(BLOCKCHAIN, self.getBlockchainDataAsBytes())
+
+    # The valid blockchain with the most work is kept. The claimed work
+    # of the received chain is compared first, so only a chain that would
+    # replace ours has all of its blocks and transactions validated.
+
+    async def handleBlockchain(self, peer: Peer, body: bytes):
+        try:
+            receivedBlockchain = await asyncio.get_running_loop().run_in_executor(
+                None, self.getBlockchainDataAsObject, body)
         except Exception as err:
-            print(err)
-            self.socket.close()
-            self.setNetworkPreferences()
-            self.socket.bind((self.address, self.PORT))
-            await self.listenForPeers()
-
-    async def listenForPeers(self):
-        self.socket.listen(10)
-        print("Listening for peers..")
-        while self.continuousTransfer:
-            try:
-                newConnection, newAddress = self.socket.accept()
-                newthread = threading.Thread(
-                    target=self.handleNewConnection, args=(newConnection, newAddress))
-                newthread.start()
-                #self.handleNewConnection(newConnection, newAddress)
-            except KeyboardInterrupt:
-                newConnection.close()
-                self.stopNetwork()
+            logging.warning(
+                f"Invalid blockchain data from {peer.address}: {err}")
+            return
+
+        if not self.hasEnoughGenesisDifficulty(receivedBlockchain.blockchain[0]):
+            logging.warning(f"Blockchain from {peer.address} has a lower difficulty")
+            return
+        if self.blockchain is not None and receivedBlockchain.chainWork <= self.blockchain.chainWork:
+            return
+
+        try:
+            receivedBlockchain = await self.runBlockchainTask(
+                self.createBlockchainFromBlocks, list(receivedBlockchain.blockchain),
+                receivedBlockchain.gasPrice)
+        except (BlockchainSequenceError, IllegalAccessError, SignatureError) as err:
+            logging.warning(f"Invalid blockchain from {peer.address}: {err}")
+            return
+
+        if self.blockchain is None or receivedBlockchain.chainWork > self.blockchain.chainWork:
+            self.blockchain = receivedBlockchain
+            self.blockchainUpdated.set()
+            logging.info(f"Blockchain is updated by {peer.address}")
+
+    async def sendStatus(self, peer: Peer):
+        if self.blockchain is None:
+            return
+        await peer.send(STATUS, STATUS_BODY.pack(
+            len(self.blockchain.blockchain),
+            bytes.fromhex(self.blockchain.getCurrentBlock().blockHash),
+            self.blockchain.chainWork.to_bytes(STATUS_BODY.size - 40, 'big')))
+
+    async def broadcastStatus(self):
+        await asyncio.gather(*[self.sendStatus(peer) for peer in list(self.peers)],
+                             return_exceptions=True)
+
+    async def handleStatus(self, peer: Peer, body: bytes):
+        peer.tipHeight, peer.tipHash, peer.chainWork = decodeStatus(body)
+        peer.statusReceived.set()
+        if self.autoSync == True:
+            await self.requestMissingBlocks(peer)
+
+    async def requestMissingBlocks(self, peer: Peer):
+        if self.blockchain is None:
+            await peer.send(GET_BLOCKCHAIN)
+        elif peer.chainWork > self.blockchain.chainWork:
+            await peer.send(GET_BLOCKS, encodeLocator(
+                self.blockchain.getBlockLocator()))
+
+    async def handleGetBlocks(self, peer: Peer, body: bytes):
+        if self.blockchain is None:
+            return
+        ancestorHeight = self.blockchain.findLocatorAncestor(
+            decodeLocator(body))
+        if ancestorHeight is None:
+            await peer.send(BLOCKS, encodeBlocks(0, []))
+            return
+
+        firstHeight = ancestorHeight + 1
+        lastHeight = min(len(self.blockchain.blockchain),
+                         firstHeight + MAX_BLOCKS_PER_MESSAGE)
+        blocks = [self.blockchain.blockchain[height]
+                  for height in range(firstHeight, lastHeight)]
+        await peer.send(BLOCKS, encodeBlocks(firstHeight, blocks))
+
+    # Blocks that follow the current block are appended one by one.
+    # Blocks that fork from the chain are a branch, which is taken when
+    # it has more work than the blocks after the fork point.
+
+    async def handleBlocks(self, peer: Peer, body: bytes):
+        if self.blockchain is None:
+            return
+        firstHeight, blocks = decodeBlocks(body)
+        if firstHeight == 0 or firstHeight > len(self.blockchain.blockchain):
+            if peer.chainWork > self.blockchain.chainWork:
+                await peer.send(GET_BLOCKCHAIN)
+            return
+
+        try:
+            if not await self.runBlockchainTask(self.connectReceivedBlocks, firstHeight, blocks):
+                if peer.chainWork > self.blockchain.chainWork:
+                    await peer.send(GET_BLOCKCHAIN)
+                return
+        except (BlockchainSequenceError, IllegalAccessError, SignatureError) as err:
+            logging.warning(f"Invalid block from {peer.address}: {err}")
+            return
+
+        if len(blocks) > 0:
+            self.blockchainUpdated.set()
+            for block in blocks:
+                self.notifyListeners(INVENTORY_BLOCK, block.blockHash)
+            logging.info(
+                f"{len(blocks)} block(s) are received from {peer.address}")
+            await self.announceBlock(blocks[-1], peer)
+            await self.requestMissingBlocks(peer)
+
+    # Blocks from firstHeight are appended when they follow the current
+    # block and taken as a branch otherwise. Returns whether the blocks
+    # are connected.
+
+    def connectReceivedBlocks(self, firstHeight: int, blocks: list) -> bool:
+        if firstHeight == len(self.blockchain.blockchain):
+            for block in blocks:
+                self.blockchain.appendReceivedBlock(block)
+            return True
+        return self.blockchain.reorganize(firstHeight, blocks)
+
+    # Mining and the validation of received blocks can take long, so they
+    # run in a thread and the event loop keeps serving the peers. The lock
+    # lets one task at a time change the blockchain and its mempool.
+
+    async def runBlockchainTask(self, function, *args):
+        async with self.blockchainLock:
+            return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    # Headers-first sync. The header chain is downloaded from the peer
+    # with the most work and checked first, against the difficulty of our
+    # genesis block or of its own, which can't be lower than ours. Then
+    # the block bodies are downloaded from all given peers in parallel
+    # ranges. The blocks are appended when the headers follow the current
+    # block and applied with a reorg when they fork from it. A chain that
+    # doesn't share a block with the current one is replaced when the
+    # downloaded chain has more work. Every block and its transactions are
+    # validated like a block received on top of the chain.
+
+    async def headersFirstSync(self, peers: list = None, timeout: float = 10):
+        peers = list(self.peers) if peers is None else peers
+        await asyncio.wait_for(asyncio.gather(
+            *[peer.statusReceived.wait() for peer in peers]), timeout)
+        bestPeer = max(peers, key=lambda peer: peer.chainWork)
+        if self.blockchain is not None and bestPeer.chainWork <= self.blockchain.chainWork:
+            return
+
+        firstHeight, headers = await self.downloadHeaders(bestPeer)
+        chainLength = 0 if self.blockchain is None else len(self.blockchain.blockchain)
+        if firstHeight > chainLength:
+            raise NetworkProtocolError("Block headers don't follow the blockchain!")
+
+        previousBlockHash, genesisHashDifficulty = None, 0
+        if firstHeight > 0:
+            previousBlockHash = self.blockchain.blockchain[firstHeight - 1].blockHash
+            genesisHashDifficulty = self.blockchain.blockchain[0].hashDifficulty
+        elif len(headers) > 0:
+            genesisHashDifficulty = decodeBlockHeader(headers[0])[2]
+            if self.blockchain is not None and \
+                    genesisHashDifficulty < self.blockchain.blockchain[0].hashDifficulty:
+                raise NetworkProtocolError("Block headers have a lower difficulty than the blockchain!")
+        blockHashes = verifyHeaderChain(headers, previousBlockHash,
+                                        genesisHashDifficulty, firstHeight)
+        logging.info(
+            f"{len(headers)} block headers are received from {bestPeer.address}")
+
+        blocks = await BlockDownloader(
+            self, peers, firstHeight, blockHashes, self.bodyRangeSize,
+            self.peerRequestWindow, self.requestTimeout).download()
+
+        if firstHeight > 0:
+            if not await self.runBlockchainTask(self.connectReceivedBlocks, firstHeight, blocks):
+                logging.warning(
+                    f"Blocks from {bestPeer.address} don't have more work than ours")
+                return
+        elif self.blockchain is None or sum(getBlockWork(block.hashDifficulty)
+                                            for block in blocks) > self.blockchain.chainWork:
+            self.blockchain = await self.runBlockchainTask(self.createBlockchainFromBlocks, blocks)
+        else:
+            logging.warning(
+                f"Blockchain from {bestPeer.address} doesn't have more work than ours")
+            return
+        self.blockchainUpdated.set()
+        logging.info(f"Blockchain is synced with {len(peers)} peer(s)")
+
+    async def downloadHeaders(self, peer: Peer):
+        locator = [] if self.blockchain is None else self.blockchain.getBlockLocator()
+        firstHeight, headers = await peer.request(
+            GET_HEADERS, encodeLocator(locator), HEADERS, self.requestTimeout)
+
+        while firstHeight + len(headers) < peer.tipHeight and len(headers) > 0:
+            nextLocator = [hashlib.sha256(headers[-1]).hexdigest()]
+            nextHeight, nextHeaders = await peer.request(
+                GET_HEADERS, encodeLocator(nextLocator), HEADERS, self.requestTimeout)
+            if nextHeight != firstHeight + len(headers):
+                raise NetworkProtocolError("Block headers aren't in sequence!")
+            if len(nextHeaders) == 0:
                 break
+            headers += nextHeaders
+
+        return firstHeight, headers
+
+    async def requestBlockBodies(self, peer: Peer, firstHeight: int, count: int,
+                                 timeout: float) -> list:
+        receivedHeight, blocks = await peer.request(
+            GET_BLOCK_BODIES, BLOCK_RANGE.pack(firstHeight, count),
+            (BLOCK_BODIES, firstHeight), timeout)
+        return blocks
+
+    # Blocks received from the genesis block are loaded without a new
+    # genesis block. Every block is validated and connected like a block
+    # received on top of the chain, so the blocks, their difficulty
+    # schedule and their transactions are checked. The chain parameters
+    # are taken from the current blockchain of the node.
+
+    def createBlockchainFromBlocks(self, blocks: list, gasPrice: int = 1) -> Blockchain:
+        if self.blockchain is None:
+            return Blockchain.initializeReceivedBlockchain(gasPrice, blocks)
+        return Blockchain.initializeReceivedBlockchain(
+            self.blockchain.gasPrice, blocks, self.blockchain.miningProcesses,
+            self.blockchain.pendingTransactions.capacity, self.blockchain.verificationProcesses)
+
+    # The blocks of a chain from another node are checked against the
+    # difficulty of its genesis block, which can't be lower than ours.
+
+    def hasEnoughGenesisDifficulty(self, genesisBlock: Block) -> bool:
+        return self.blockchain is None or \
+            genesisBlock.hashDifficulty >= self.blockchain.blockchain[0].hashDifficulty
+
+    # Without a common block the headers start from the genesis block.
+
+    async def handleGetHeaders(self, peer: Peer, body: bytes):
+        if self.blockchain is None:
+            return
+        ancestorHeight = self.blockchain.findLocatorAncestor(
+            decodeLocator(body))
+        firstHeight = 0 if ancestorHeight is None else ancestorHeight + 1
+        lastHeight = min(len(self.blockchain.blockchain),
+                         firstHeight + MAX_HEADERS_PER_MESSAGE)
+        headers = [self.blockchain.blockchain[height].generateBlockHeader()
+                   for height in range(firstHeight, lastHeight)]
+        await peer.send(HEADERS, encodeHeaders(firstHeight, headers))
+
+    async def handleHeaders(self, peer: Peer, body: bytes):
+        peer.resolveRequest(HEADERS, decodeHeaders(body))
+
+    async def handleGetBlockBodies(self, peer: Peer, body: bytes):
+        if self.blockchain is None:
+            return
+        firstHeight, count = decodeBlockRange(body)
+        lastHeight = min(len(self.blockchain.blockchain), firstHeight +
+                         min(count, MAX_BLOCKS_PER_MESSAGE))
+        blocks = [self.blockchain.blockchain[height]
+                  for height in range(firstHeight, lastHeight)]
+        await peer.send(BLOCK_BODIES, encodeBlocks(firstHeight, blocks))
+
+    async def handleBlockBodies(self, peer: Peer, body: bytes):
+        firstHeight, blocks = decodeBlocks(body)
+        peer.resolveRequest((BLOCK_BODIES, firstHeight), (firstHeight, blocks))
+
+    async def announceTransaction(self, transaction, exceptPeer: Peer = None):
+        await self.announce(INVENTORY_TRANSACTION,
+                            transaction.getTransactionHashBytes().hex(), exceptPeer)
 
-    def handleNewConnection(self, newConnection, newAddress):
-        print(f"New request by: {newAddress}")
+    async def announceBlock(self, block, exceptPeer: Peer = None):
+        await self.announce(INVENTORY_BLOCK, block.blockHash, exceptPeer)
+
+    # A slow peer doesn't hold the announcement back for the other peers
+    # or stall the loop of the peer the item came from. The announcement
+    # is skipped for it and it catches up when it syncs again.
+
+    async def announce(self, itemType: int, itemHash: str, exceptPeer: Peer = None):
+        self.seenInventory.add(itemHash)
+        body = encodeInventory([(itemType, itemHash)])
+        for peer in list(self.peers):
+            if peer is not exceptPeer and not peer.trySend(INVENTORY, body):
+                logging.info(f"Peer {peer.address} is too slow, announcement is skipped")
+
+    # Requested items are marked as seen right away,
+    # so the same item isn't requested from other peers.
+
+    async def handleInventory(self, peer: Peer, body: bytes):
+        if self.blockchain is None:
+            return
+        wantedItems = []
+        for itemType, itemHash in decodeInventory(body):
+            if itemHash not in self.seenInventory:
+                self.seenInventory.add(itemHash)
+                if itemType == INVENTORY_BLOCK:
+                    itemType = INVENTORY_COMPACT_BLOCK
+                wantedItems.append((itemType, itemHash))
+        if len(wantedItems) > 0:
+            await peer.send(GET_DATA, encodeInventory(wantedItems))
+
+    async def handleGetData(self, peer: Peer, body: bytes):
+        if self.blockchain is None:
+            return
+        for itemType, itemHash in decodeInventory(body):
+            if itemType == INVENTORY_TRANSACTION:
+                transaction = self.blockchain.pendingTransactions.get(itemHash)
+                if transaction is not None:
+                    await peer.send(TRANSACTION, BinaryConverter.encodeTransaction(transaction))
+            elif itemType == INVENTORY_BLOCK:
+                block = self.findRecentBlock(itemHash)
+                if block is not None:
+                    await peer.send(BLOCK, BinaryConverter.encodeBlock(block))
+            elif itemType == INVENTORY_COMPACT_BLOCK:
+                block = self.findRecentBlock(itemHash)
+                if block is not None:
+                    await peer.send(COMPACT_BLOCK, encodeCompactBlock(block))
+
+    def findRecentBlock(self, blockHash: str):
+        chainLength = len(self.blockchain.blockchain)
+        for height in range(chainLength - 1, max(-1, chainLength - 1 - MAX_RELAY_DEPTH), -1):
+            if self.blockchain.blockchain[height].blockHash == blockHash:
+                return self.blockchain.blockchain[height]
+        return None
+
+    async def handleTransaction(self, peer: Peer, body: bytes):
+        if self.blockchain is None:
+            return
+        transaction = decodeTransaction(body)
         try:
-            data = self.getBlockchainDataAsBytes()
-            newConnection.send(data)
-            print("Blockchain data is sent!")
+            async with self.blockchainLock:
+                self.blockchain.addReceivedTransaction(transaction)
+        except (SignatureError, BalanceError, TransactionDataConflictError, MempoolError) as err:
+            logging.warning(
+                f"Invalid transaction from {peer.address}: {type(err).__name__}")
+            return
+        self.notifyListeners(INVENTORY_TRANSACTION,
+                             transaction.getTransactionHashBytes().hex())
+        await self.announceTransaction(transaction, peer)
 
-            receivedData = newConnection.recv(1024 * 16).decode("utf-8")
-            receivedBlockchain = self.getBlockchainDataAsObject(receivedData)
+    # A block that doesn't follow the current block means that blocks
+    # are missing, they are requested with a block locator.
 
-            if len(receivedBlockchain.blockchain) > len(self.blockchain.blockchain):
-                self.blockchain = receivedBlockchain
+    async def handleBlock(self, peer: Peer, body: bytes):
+        if self.blockchain is None:
+            return
+        await self.appendRelayedBlock(peer, decodeBlock(body))
 
-        except Exception as err:
-            print(f"Peer: {err}")
-            newConnection.close()
+    async def appendRelayedBlock(self, peer: Peer, block: Block):
+        if block.previousBlockHash != self.blockchain.getCurrentBlock().blockHash:
+            await peer.send(GET_BLOCKS, encodeLocator(
+                self.blockchain.getBlockLocator()))
+            return
+
+        try:
+            await self.runBlockchainTask(self.blockchain.appendReceivedBlock, block)
+        except (BlockchainSequenceError, IllegalAccessError, SignatureError) as err:
+            logging.warning(f"Invalid block from {peer.address}: {err}")
+            return
+        self.blockchainUpdated.set()
+        self.notifyListeners(INVENTORY_BLOCK, block.blockHash)
+        await self.announceBlock(block, peer)
+
+    # Transactions are matched by their short ids against the mempool.
+    # The block is built from approved copies, so the mempool
+    # stays as it is until the block is appended.
+
+    async def handleCompactBlock(self, peer: Peer, body: bytes):
+        if self.blockchain is None:
+            return
+        blockFields, shortIds, transactions = decodeCompactBlock(body)
+        blockHash = blockFields[1]
+        async with self.blockchainLock:
+            mempoolTransactions = {
+                getShortTransactionId(blockHash, transaction.getTransactionHashBytes()): transaction
+                for transaction in self.blockchain.pendingTransactions}
+
+        for index, shortId in enumerate(shortIds):
+            if index not in transactions and shortId in mempoolTransactions:
+                transactions[index] = mempoolTransactions[shortId].getApprovedCopy()
+
+        missingIndexes = [index for index in range(len(shortIds))
+                          if index not in transactions]
+        if len(missingIndexes) == 0:
+            await self.appendCompactBlock(peer, blockFields, len(shortIds), transactions)
+            return
+
+        if len(self.partialBlocks) >= MAX_PARTIAL_BLOCKS:
+            del self.partialBlocks[next(iter(self.partialBlocks))]
+        self.partialBlocks[blockHash] = (
+            blockFields, len(shortIds), transactions)
+        await peer.send(GET_BLOCK_TRANSACTIONS, BLOCK_TRANSACTIONS_HEADER.pack(
+            bytes.fromhex(blockHash), len(missingIndexes)) +
+            b''.join(TRANSACTION_INDEX.pack(index) for index in missingIndexes))
+
+    async def handleGetBlockTransactions(self, peer: Peer, body: bytes):
+        if self.blockchain is None:
+            return
+        blockHash, indexes = decodeBlockTransactionRequest(body)
+        block = self.findRecentBlock(blockHash)
+        if block is None:
+            return
+        if any(index >= len(block.blockTransactions) for index in indexes):
+            raise NetworkProtocolError("Invalid block transaction request!")
+        await peer.send(BLOCK_TRANSACTIONS, BLOCK_TRANSACTIONS_HEADER.pack(
+            bytes.fromhex(blockHash), len(indexes)) + b''.join(encodeIndexedTransactions(block, indexes)))
+
+    async def handleBlockTransactions(self, peer: Peer, body: bytes):
+        blockHash, receivedTransactions = decodeBlockTransactions(body)
+        partialBlock = self.partialBlocks.pop(blockHash, None)
+        if partialBlock is None:
+            return
+        blockFields, blockTransactionCount, transactions = partialBlock
+        transactions.update(receivedTransactions)
+        await self.appendCompactBlock(peer, blockFields, blockTransactionCount, transactions)
+
+    # A short id can collide with another transaction in the mempool,
+    # then the merkle root doesn't match and the full block is requested.
 
-        print(f"Request is handled with {newAddress}")
-        # newConnection.close()
+    async def appendCompactBlock(self, peer: Peer, blockFields: tuple, transactionCount: int,
+                                 transactions: dict):
+        block = Block.initializeBlock(
+            *blockFields, [transactions.get(index) for index in range(transactionCount)])
+        if None in block.blockTransactions or block.generateMerkleRoot() != block.merkleRoot:
+            logging.warning(
+                f"Compact block {block.blockHash} couldn't be rebuilt, requesting the full block")
+            await peer.send(GET_DATA, encodeInventory([(INVENTORY_BLOCK, block.blockHash)]))
+            return
+        await self.appendRelayedBlock(peer, block)
 
     def getBlockchainDataAsBytes(self) -> bytes:
-        blockchainData = DataConverter().dumBlochcainDataAsStr(self.blockchain)
-        return bytes(blockchainData, encoding='utf8')
+        return DataConverter().dumpBlockchainDataAsBytes(self.blockchain)
 
     def getBlockchainDataAsObject(self, data) -> Blockchain:
-        return DataConverter().loadBlockchainData(data)
+        return DataConverter().loadBlockchainDataFromBytes(data, verify=True)
 
-    def stopNetwork(self):
-        self.continuousTransfer = False
-        self.socket.close()
+    async def stopNetwork(self):
+        await self.peerManager.stop()
+        if self.server is not None:
+            self.server.close()
+        for peer in list(self.peers):
+            await peer.close()
+        for task in list(self.peerTasks):
+            task.cancel()
+        await asyncio.gather(*self.peerTasks, return_exceptions=True)
+        if self.server is not None:
+            await self.server.wait_closed()
+            self.server = None
@@ -0,0 +1,93 @@
+# ---------------------------------------------
+# Keeps the peer connections of a P2P server:
+# a bounded pool, keepalive pings and
+# reconnects to the known peer addresses.
+# Copyright (c) 2022 Berk Kırtay
+# ---------------------------------------------
+
+import asyncio
+import logging
+import os
+from src.BlockchainExceptionHandler.BlockchainExceptionHandler import NetworkProtocolError
+
+PING = 17
+PONG = 18
+
+
+# At most maxPeers peers are connected at once, inbound and outbound
+# together. Every peer is pinged every pingInterval seconds and dropped
+# when it doesn't answer in pingTimeout seconds. The connections to the
+# added peer addresses are kept open: a lost connection is opened again
+# after a delay that doubles with every failed attempt.
+
+class PeerManager():
+    maxPeers = 32
+    pingInterval = 30
+    pingTimeout = 10
+    reconnectDelay = 0.5
+    maxReconnectDelay = 30
+
+    def __init__(self, server):
+        self.server = server
+        self.peerAddresses = {}
+        self.tasks = set()
+        self.connectionAttempts = 0
+
+    def start(self):
+        self.startTask(self.keepAlive())
+
+    async def stop(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def startTask(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def canAcceptPeer(self) -> bool:
+        return len(self.server.peers) < self.maxPeers
+
+    def addPeerAddress(self, address, PORT):
+        if (address, PORT) not in self.peerAddresses:
+            self.peerAddresses[(address, PORT)] = None
+            self.startTask(self.maintainConnection(address, PORT))
+
+    async def maintainConnection(self, address, PORT):
+        delay = self.reconnectDelay
+        while True:
+            try:
+                self.connectionAttempts += 1
+                peer = await self.server.connectToPeer(address, PORT)
+                self.peerAddresses[(address, PORT)] = peer
+                delay = self.reconnectDelay
+                await peer.closed.wait()
+                logging.info(f"Connection to {address}:{PORT} is lost")
+            except (ConnectionError, OSError) as err:
+                logging.warning(f"Couldn't connect to {address}:{PORT}: {err}")
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.maxReconnectDelay)
+
+    async def keepAlive(self):
+        while True:
+            await asyncio.sleep(self.pingInterval)
+            await asyncio.gather(*[self.pingPeer(peer) for peer in list(self.server.peers)],
+                                 return_exceptions=True)
+
+    async def pingPeer(self, peer):
+        nonce = os.urandom(8)
+        try:
+            await peer.request(PING, nonce, (PONG, nonce), self.pingTimeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Peer {peer.address} doesn't answer pings, dropping it")
+            await peer.close()
+
+    async def handlePing(self, peer, body: bytes):
+        if len(body) != 8:
+            raise NetworkProtocolError("Invalid ping!")
+        await peer.send(PONG, body)
+
+    async def handlePong(self, peer, body: bytes):
+        peer.resolveRequest((PONG, body), body)
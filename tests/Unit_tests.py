@@ -3,13 +3,34 @@
 # Copyright (c) 2022 Berk Kırtay
 # ----------------------------------------
 
-from src.DataConverter.DataConverter import BlockDataIO
+from src.DataConverter.DataConverter import BlockDataIO, DataConverter
 from src.Wallet.Wallet import Wallet
 from src.Transaction.Transaction import Transaction
-from src.Transaction.TransactionSignature import TransactionSignature
-from src.Blockchain.Blockchain import Blockchain
+from src.Transaction.TransactionSignature import TransactionSignature, getKeyCacheInfo, clearKeyCache, \
+    BATCH_VALIDATION_THRESHOLD, RSA_SIGNATURE_SCHEME, ED25519_SIGNATURE_SCHEME, getValidationExecutor
+from src.Blockchain.Blockchain import Blockchain, Block, BLOCK_HEADER_SIZE, verifyTransactionProof, \
+    getMiningExecutor, getMiningStopEvent, searchNonces, NONCE_BATCH_SIZE
+from src.Mempool.Mempool import Mempool
+from src.Blockchain.BalanceIndex import BalanceIndex
+from src.BloomFilter.BloomFilter import RotatingBloomFilter
+from src.KeyPairPool.KeyPairPool import KeyPairPool
+from src.BlockStore.BlockStore import BlockStore
+from src.BlockStore.SQLiteBlockStore import SQLiteBlockStore
+from src.blockchain_p2p_nodes.P2PServer import P2PServer, encodeMessage, readMessage, GET_BLOCK_BODIES, \
+    TRANSACTION, BLOCK, COMPACT_BLOCK, BLOCK_TRANSACTIONS, PING, INVENTORY_TRANSACTION, INVENTORY_BLOCK, \
+    encodeCompactBlock, STATUS
+from src.blockchain_p2p_nodes.PeerManager import PONG
+from src.blockchain_p2p_nodes.BlockchainNode import Node
+from src.DataConverter import BinaryConverter
 from src.BlockchainExceptionHandler.BlockchainExceptionHandler import *
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+import asyncio
+import hashlib
+import os
 import random
+import threading
+import time
 import pytest
 
 
@@ -30,6 +51,16 @@ class BlockchainFactory:
 blockchainFactory = BlockchainFactory()
 
 
+# Waits for a condition of the network tests for up to five seconds.
+
+async def waitUntil(condition):
+    for i in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise TimeoutError()
+
+
 def test_blockchainsShouldBeUnique():
     blockchain1 = blockchainFactory.getBlockchain(2, 1)
     blockchain2 = blockchainFactory.getBlockchain(2, 1)
@@ -200,11 +231,13 @@ def test_shouldBeInvalidWhenAttemptIllegalChange():
     blockchain.blockchain[3].blockTransactions.append(Transaction(
         wallet2.publicKey, wallet1.publicKey, 1000, wallet2.privateKey))
 
-    # Now try to attempt a normal transaction:
+    # Validated blocks aren't rehashed by new blocks,
+    # so the change is found by a full audit:
     with pytest.raises(IllegalAccessError) as err:
         blockchain.addTransaction(Transaction(
             wallet1.publicKey, "someone", 10000, wallet1.privateKey))
         blockchain.handleTransactions(wallet1.publicKey)
+        blockchain.auditBlockchain()
 
     assert "Changed block properties found! The corresponding block is corrupted!" in str(
         err.value)
@@ -223,6 +256,1558 @@ def test_shouldRaiseErrWhenAttemptToUseDifferentDataType():
         err.value)
 
 
+def test_parallelMiningShouldProduceValidBlocks():
+    wallet1 = Wallet("person")
+    blockchain = Blockchain(3, 1, miningProcesses=2)
+    blockchain.forceTransaction(wallet1.publicKey, 1000)
+
+    for block in blockchain.blockchain:
+        assert block.blockHash[:3] == "000"
+        assert block.generateBlockHash() == block.blockHash
+
+    blockchain.validateBlockchain()
+    assert blockchain.validationFlag == True
+    assert wallet1.getBalance(blockchain) == 1000
+
+    # The mining processes are reused for the next blocks.
+    executor = getMiningExecutor(2)
+    blockchain.forceTransaction(wallet1.publicKey, 500)
+    assert getMiningExecutor(2) is executor
+
+    # A dead mining process doesn't stop the miner.
+    with pytest.raises(BrokenProcessPool):
+        executor.submit(os._exit, 1).result()
+    blockchain.forceTransaction(wallet1.publicKey, 250)
+    assert getMiningExecutor(2) is not executor
+    blockchain.validateBlockchain()
+    assert wallet1.getBalance(blockchain) == 1750
+
+
+
+def test_miningProcessesShouldStopOnceAHashIsFound(monkeypatch):
+    headerPrefix = bytes(BLOCK_HEADER_SIZE - 8)
+    nonceCount = 3 * NONCE_BATCH_SIZE
+
+    # The stop event is checked between the batches of nonces.
+    stopEvent = threading.Event()
+    monkeypatch.setattr("src.Blockchain.Blockchain.SEARCH_STOP_EVENT", stopEvent)
+    assert searchNonces(headerPrefix, 64, 0, 1, nonceCount) == (None, None, nonceCount)
+    stopEvent.set()
+    assert searchNonces(headerPrefix, 64, 0, 1, nonceCount) == (None, None, 0)
+
+    # A mining process gives up its search once the event is set.
+    executor = getMiningExecutor(2)
+    search = executor.submit(searchNonces, headerPrefix, 64, 0, 1, 10 ** 12)
+    getMiningStopEvent().set()
+    assert search.result(timeout=60)[2] < 10 ** 12
+
+    wallet1 = Wallet("person")
+    blockchain = Blockchain(3, 1, miningProcesses=2)
+    blockchain.forceTransaction(wallet1.publicKey, 1000)
+    assert getMiningStopEvent().is_set()
+    blockchain.validateBlockchain()
+    assert wallet1.getBalance(blockchain) == 1000
+
+
+def test_blockHeaderShouldHaveFixedSize():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+
+    for i in range(3):
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", 10, wallet1.privateKey))
+    blockchain.handleTransactions(wallet1.publicKey)
+
+    for block in blockchain.blockchain:
+        header = block.generateBlockHeader()
+        assert len(header) == BLOCK_HEADER_SIZE
+        assert hashlib.sha256(header).hexdigest() == block.blockHash
+
+
+def test_transactionShouldBeProvenWithMerkleProof():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+
+    transactions = []
+    for i in range(5):
+        transaction = Transaction(
+            wallet1.publicKey, "someone", i + 1, wallet1.privateKey)
+        blockchain.addTransaction(transaction)
+        transactions.append(transaction)
+    blockchain.handleTransactions(wallet1.publicKey)
+
+    for transaction in transactions:
+        proof = blockchain.getTransactionProof(transaction.transactionHash)
+        assert verifyTransactionProof(
+            transaction.transactionHash, proof["proof"], proof["blockHeader"]) == True
+
+    otherProof = blockchain.getTransactionProof(transactions[0].transactionHash)
+    assert verifyTransactionProof(
+        transactions[1].transactionHash, otherProof["proof"], otherProof["blockHeader"]) == False
+    assert blockchain.getTransactionProof("00" * 32) is None
+
+
+def test_blockWithRepeatedTransactionsShouldBeRejected():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    converter = DataConverter()
+    otherBlockchain = converter.loadBlockchainDataFromBytes(
+        converter.dumpBlockchainDataAsBytes(blockchain))
+
+    for amount in [10, 20]:
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", amount, wallet1.privateKey))
+    blockchain.handleTransactions(wallet1.publicKey)
+    block = blockchain.getCurrentBlock()
+
+    # Repeating the last transaction of an odd level must not keep the root.
+    forgedBlock = Block.initializeBlock(
+        block.previousBlockHash, block.blockHash, block.merkleRoot, block.blockNonce,
+        block.hashDifficulty, block.blockBalance, block.blockFee, block.validationTime,
+        block.blockTransactions + [block.blockTransactions[-1]])
+    assert forgedBlock.generateMerkleRoot() != block.merkleRoot
+    with pytest.raises(IllegalAccessError):
+        otherBlockchain.appendReceivedBlock(forgedBlock)
+
+    # A mined block with a repeated transaction is invalid as well.
+    repeatedBlock = Block(otherBlockchain.getCurrentBlock().blockHash, 1,
+                          block.blockTransactions[:1] * 2)
+    with pytest.raises(IllegalAccessError):
+        otherBlockchain.validateBranch(
+            otherBlockchain.getCurrentBlock().blockHash, [repeatedBlock],
+            len(otherBlockchain.blockchain))
+
+    otherBlockchain.appendReceivedBlock(block)
+    assert otherBlockchain.getBalance(wallet1.publicKey) == \
+        blockchain.getBalance(wallet1.publicKey)
+
+
+def test_newBlocksShouldOnlyValidateTheirOwnLink(monkeypatch):
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        0, 10, wallet1.publicKey, 100000)
+
+    for i in range(5):
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", 10, wallet1.privateKey))
+        blockchain.handleTransactions(wallet1.publicKey)
+
+    assert blockchain.validatedHeight == len(blockchain.blockchain)
+
+    rehashedBlocks = []
+    generateBlockHash = Block.generateBlockHash
+    monkeypatch.setattr(Block, "generateBlockHash", lambda block: rehashedBlocks.append(
+        block) or generateBlockHash(block))
+
+    blockchain.addTransaction(Transaction(
+        wallet1.publicKey, "someone", 10, wallet1.privateKey))
+    blockchain.handleTransactions(wallet1.publicKey)
+
+    assert all(block is blockchain.getCurrentBlock()
+               for block in rehashedBlocks)
+    assert blockchain.validatedHeight == len(blockchain.blockchain)
+
+    rehashedBlocks.clear()
+    blockchain.auditBlockchain()
+    assert len(rehashedBlocks) == len(blockchain.blockchain)
+
+
+def scanBalance(blockchain, address):
+    balance = 0
+    for block in blockchain.blockchain:
+        for transaction in block.blockTransactions:
+            if transaction.destination == address:
+                balance += transaction.balance
+            if transaction.source == address:
+                balance -= transaction.balance + transaction.fee
+    for transaction in blockchain.pendingTransactions:
+        if transaction.destination == address:
+            balance += transaction.balance
+        if transaction.source == address:
+            balance -= transaction.balance + transaction.fee
+    return balance
+
+
+def test_balanceIndexShouldMatchChainScan():
+    wallet1 = Wallet("person1")
+    wallet2 = Wallet("person2")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        0, 3, wallet1.publicKey, 10000)
+
+    for i in range(4):
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, wallet2.publicKey, random.randint(1, 900), wallet1.privateKey))
+    blockchain.handleTransactions(wallet2.publicKey)
+    blockchain.addTransaction(Transaction(
+        wallet2.publicKey, wallet1.publicKey, 100, wallet2.privateKey))
+
+    for address in [wallet1.publicKey, wallet2.publicKey]:
+        assert blockchain.getBalance(address) == scanBalance(blockchain, address)
+
+    # A block that isn't linked to the chain is rolled back
+    # together with the balances it has given.
+    balanceBeforeFork = blockchain.getBalance(wallet2.publicKey)
+    forkTransaction = Transaction(
+        wallet1.publicKey, wallet2.publicKey, 500, wallet1.privateKey)
+    forkTransaction.approve()
+    blockchain.insertBlockAndReevaluateDifficulty(
+        Block("ab" * 32, 0, [forkTransaction]))
+    assert blockchain.getBalance(wallet2.publicKey) == balanceBeforeFork + 500
+
+    blockchain.validateBlockchain()
+    assert blockchain.getBalance(wallet2.publicKey) == balanceBeforeFork
+    for address in [wallet1.publicKey, wallet2.publicKey]:
+        assert blockchain.getBalance(address) == scanBalance(blockchain, address)
+
+
+def createTransactionWithFee(wallet, fee):
+    transaction = Transaction(wallet.publicKey, "null", 1, wallet.privateKey)
+    transaction.fee = fee
+    return transaction
+
+
+def test_mempoolShouldPopByFeeAndKeepSenderOrder():
+    wallet1 = Wallet("person1")
+    wallet2 = Wallet("person2")
+    mempool = Mempool(10)
+
+    first = createTransactionWithFee(wallet1, 1)
+    second = createTransactionWithFee(wallet1, 9)
+    third = createTransactionWithFee(wallet2, 5)
+    for transaction in [first, second, third]:
+        assert mempool.push(transaction) == []
+
+    # wallet1's second transaction pays more but has to wait for the first one.
+    assert mempool.popTransactions(3) == [third, first, second]
+    assert len(mempool) == 0
+
+
+def test_mempoolShouldEvictLowestFeeWhenFull():
+    wallet1 = Wallet("person1")
+    wallet2 = Wallet("person2")
+    mempool = Mempool(2)
+
+    cheap = createTransactionWithFee(wallet1, 1)
+    cheapFollower = createTransactionWithFee(wallet1, 7)
+    expensive = createTransactionWithFee(wallet2, 5)
+    mempool.push(cheap)
+    mempool.push(cheapFollower)
+
+    # The follower can't be mined without the cheap one, so both are evicted.
+    assert mempool.push(expensive) == [cheap, cheapFollower]
+    assert len(mempool) == 1
+
+    # A full mempool doesn't take a transaction that doesn't pay more.
+    assert mempool.push(createTransactionWithFee(wallet1, 5)) == []
+    rejected = createTransactionWithFee(wallet1, 5)
+    assert mempool.push(rejected) == [rejected]
+    assert len(mempool) == 2
+    assert mempool.pop() is expensive
+
+
+def test_pendingTransactionShouldOnlyBeAddedOnce():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        0, 1, wallet1.publicKey, 1000)
+    blockchain.pendingTransactions.capacity = 2
+
+    transaction = Transaction(
+        wallet1.publicKey, "someone", 10, wallet1.privateKey)
+    blockchain.addTransaction(transaction)
+    relayedTransaction = transaction.getPendingCopy()
+    for repeatedTransaction in [transaction, relayedTransaction]:
+        with pytest.raises(MempoolError):
+            blockchain.addTransaction(repeatedTransaction)
+    assert len(blockchain.pendingTransactions) == 1
+
+    # A transaction that doesn't fit in a full mempool isn't added either.
+    blockchain.addTransaction(Transaction(
+        wallet1.publicKey, "someone", 10, wallet1.privateKey))
+    with pytest.raises(MempoolError):
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", 10, wallet1.privateKey))
+
+    blockchain.handleTransactions("null")
+    assert [transaction.balance for transaction in blockchain.getCurrentBlock().blockTransactions][:-1] == \
+        [10, 10]
+    assert blockchain.getBalance("someone") == 20
+
+
+def test_evictedTransactionsShouldGiveBackTheirBalances():
+    wallet1 = Wallet("person1")
+    wallet2 = Wallet("person2")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        0, 1, wallet1.publicKey, 1000)
+    blockchain.forceTransaction(wallet2.publicKey, 10000)
+    blockchain.pendingTransactions.capacity = 2
+
+    # Fees grow with the digits of the amounts, so the first transaction
+    # of wallet1 has the lowest fee and the second one pays more than
+    # the transaction of wallet2.
+    blockchain.addTransaction(Transaction(
+        wallet1.publicKey, "someone", 1, wallet1.privateKey))
+    blockchain.addTransaction(Transaction(
+        wallet2.publicKey, "someone", 1000, wallet2.privateKey))
+    secondTransaction = Transaction(wallet1.publicKey, "someone", 100, wallet1.privateKey)
+    with pytest.raises(MempoolError):
+        blockchain.addTransaction(secondTransaction)
+
+    # Both transactions of wallet1 are evicted and their balances are given back.
+    assert [transaction.source for transaction in blockchain.pendingTransactions] == \
+        [wallet2.publicKey]
+    assert blockchain.getBalance(wallet1.publicKey) == 1000
+    assert blockchain.getBalance("someone") == 1000
+    blockchain.handleTransactions("null")
+    for address in [wallet1.publicKey, wallet2.publicKey, "someone"]:
+        assert blockchain.getBalance(address) == scanBalance(blockchain, address)
+
+
+def test_brokenSignatureShouldOnlyDropItsTransaction(monkeypatch):
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        0, 1, wallet1.publicKey, 1000)
+    for amount in [10, 20]:
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", amount, wallet1.privateKey))
+
+    # The first transaction's validation raises a SignatureError.
+    validateTransactions = blockchain.validateTransactions
+    monkeypatch.setattr(blockchain, "validateTransactions", lambda transactions:
+                        [None] + validateTransactions(transactions[1:]))
+    blockchain.handleTransactions("null")
+    assert len(blockchain.pendingTransactions) == 0
+    assert [transaction.balance for transaction in blockchain.getCurrentBlock().blockTransactions][:-1] == \
+        [20]
+    for address in [wallet1.publicKey, "someone"]:
+        assert blockchain.getBalance(address) == scanBalance(blockchain, address)
+
+
+def test_samePaymentsShouldHaveDifferentHashes(tmp_path):
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        0, 1, wallet1.publicKey, 1000)
+    transactions = [Transaction(wallet1.publicKey, "someone", 10, wallet1.privateKey)
+                    for i in range(2)]
+    assert transactions[0].getTransactionHashBytes() != transactions[1].getTransactionHashBytes()
+    for transaction in transactions:
+        blockchain.addTransaction(transaction)
+    blockchain.handleTransactions("null")
+    assert blockchain.getBalance("someone") == 20
+
+    # The nonce is kept by every format, so the hashes are generated again.
+    converter = DataConverter()
+    blockStore = SQLiteBlockStore(str(tmp_path / "chain.db"))
+    blockStore.appendBlock(blockchain.getCurrentBlock())
+    for block in [converter.loadBlock(converter.dumpBlock(blockchain.getCurrentBlock(), 0)),
+                  BinaryConverter.decodeBlock(BinaryConverter.encodeBlock(blockchain.getCurrentBlock()))[0],
+                  blockStore.readBlock(0)]:
+        for transaction in block.blockTransactions:
+            assert transaction.getPendingCopy().getTransactionHashBytes() == \
+                transaction.getTransactionHashBytes()
+
+    # Transactions of chains from before the nonce keep their hashes.
+    transaction = transactions[0]
+    oldTransaction = Transaction.initializeTransaction(
+        transaction.source, transaction.destination, transaction.balance, transaction.gas,
+        transaction.fee, transaction.transactionMessage, "", "", transaction.validationTime)
+    oldTransaction.generateTransactionHash()
+    assert oldTransaction.transactionHash.hexdigest() == hashlib.sha256(
+        (transaction.source + "someone" + "10" + transaction.validationTime).encode()).hexdigest()
+
+
+def test_repeatedSenderShouldHitKeyCache():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        0, 1, wallet1.publicKey, 10000)
+
+    clearKeyCache()
+    for i in range(3):
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", 10, wallet1.privateKey))
+    blockchain.handleTransactions("null")
+
+    # The block reward is signed with the genesis key, which is the
+    # other signer miss.
+    keyCacheInfo = getKeyCacheInfo()
+    assert keyCacheInfo["signerMisses"] == 2
+    assert keyCacheInfo["signerHits"] == 2
+    assert keyCacheInfo["verifierMisses"] == 1
+    assert keyCacheInfo["verifierHits"] == 2
+
+
+def test_batchValidationShouldMatchSerialValidation():
+    wallet1 = Wallet("person1")
+    wallet2 = Wallet("person2")
+    transactionSigner = TransactionSignature()
+
+    items = []
+    for i in range(BATCH_VALIDATION_THRESHOLD):
+        # Every third transaction is signed by a fraud wallet.
+        signer = wallet2 if i % 3 == 0 else wallet1
+        transaction = Transaction(
+            wallet1.publicKey, "someone", i + 1, signer.privateKey)
+        items.append((transaction.transactionHash,
+                     transaction.transactionSignature, transaction.source))
+    items.append((items[0][0], items[0][1], "not a key"))
+
+    serialResults = transactionSigner.validateTransactions(items)
+    batchResults = transactionSigner.validateTransactions(items, 2)
+
+    assert batchResults == serialResults
+    assert serialResults[:3] == [False, True, True]
+    assert serialResults[-1] is None
+
+    # The worker processes are kept for the next batches.
+    executor = getValidationExecutor(2)
+    assert transactionSigner.validateTransactions(items, 2) == serialResults
+    assert getValidationExecutor(2) is executor
+
+    # A batch is still validated when a worker process dies.
+    with pytest.raises(BrokenProcessPool):
+        executor.submit(os._exit, 1).result()
+    assert transactionSigner.validateTransactions(items, 2) == serialResults
+    assert getValidationExecutor(2) is not executor
+
+
+def test_importShouldNotMineOrGenerateKeys(monkeypatch):
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    blockchain.addTransaction(Transaction(
+        wallet1.publicKey, "someone", 10, wallet1.privateKey))
+    blockchain.handleTransactions(wallet1.publicKey)
+    blockchainData = DataConverter().dumpBlochcainDataAsStr(blockchain)
+
+    def fail(*args):
+        raise AssertionError("Import must not mine or generate keys!")
+
+    monkeypatch.setattr(Block, "proofOfWork", fail)
+    monkeypatch.setattr(Block, "generateBlockHash", fail)
+    monkeypatch.setattr(
+        "src.Blockchain.Blockchain.getKeyPairPool", fail)
+    loadedBlockchain = DataConverter().loadBlockchainData(blockchainData)
+    monkeypatch.undo()
+
+    assert [block.blockHash for block in loadedBlockchain.blockchain] == \
+        [block.blockHash for block in blockchain.blockchain]
+    assert loadedBlockchain.chainSize == blockchain.chainSize
+    assert wallet1.getBalance(loadedBlockchain) == wallet1.getBalance(blockchain)
+
+    # Verification is a separate step.
+    loadedBlockchain.auditBlockchain()
+    assert loadedBlockchain.validatedHeight == len(blockchain.blockchain)
+    assert Transaction(wallet1.publicKey, "someone", 1,
+                       wallet1.privateKey).transactionSignature != ''
+
+
+def test_streamedChainShouldMatchExportedChain():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    for i in range(3):
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", 10, wallet1.privateKey))
+        blockchain.handleTransactions(wallet1.publicKey)
+
+    blockDataIO = BlockDataIO()
+    blockDataIO.exportStream(blockchain, "blockchainStream.jsonl")
+
+    streamedHashes = [block.blockHash for block in blockDataIO.streamBlocks(
+        "blockchainStream.jsonl")]
+    assert streamedHashes == [
+        block.blockHash for block in blockchain.blockchain]
+
+    loadedBlockchain = blockDataIO.importStream(
+        "blockchainStream.jsonl", verify=True)
+    assert loadedBlockchain.chainSize == blockchain.chainSize
+    assert wallet1.getBalance(loadedBlockchain) == wallet1.getBalance(blockchain)
+    assert loadedBlockchain.getBalance("someone") == 30
+
+
+def test_blockStoreShouldPersistEveryBlock(tmp_path):
+    wallet1 = Wallet("person")
+    blockStore = BlockStore(str(tmp_path) + "/")
+    blockchain = Blockchain(1, 1, blockStore=blockStore)
+    blockchain.forceTransaction(wallet1.publicKey, 1000)
+    for i in range(3):
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", 10, wallet1.privateKey))
+        blockchain.handleTransactions(wallet1.publicKey)
+
+    assert len(blockStore) == len(blockchain.blockchain)
+    assert blockStore.readBlock(2).blockHash == blockchain.blockchain[2].blockHash
+    assert blockStore.readBlock(-1).merkleRoot == blockchain.getCurrentBlock().merkleRoot
+
+    # A block that is dropped by the chain is dropped by the store too.
+    blockchain.insertBlockAndReevaluateDifficulty(Block("ab" * 32, 1, []))
+    assert len(blockStore) == len(blockchain.blockchain)
+    blockchain.validateBlockchain()
+    assert len(blockStore) == len(blockchain.blockchain)
+    blockStore.close()
+
+    reopenedStore = BlockStore(str(tmp_path) + "/")
+    assert [block.blockHash for block in reopenedStore] == \
+        [block.blockHash for block in blockchain.blockchain]
+
+    # A new blockchain doesn't wipe the stored blocks, a node goes on
+    # from them and appends its new blocks to the store.
+    with pytest.raises(BlockStoreError):
+        Blockchain(1, 1, blockStore=reopenedStore)
+    assert len(reopenedStore) == len(blockchain.blockchain)
+    resumedBlockchain = Blockchain.initializeBlockchain(
+        blockchain.hashDifficulty, 1, chainSize=blockchain.chainSize, blockStore=reopenedStore)
+    resumedBlockchain.addTransaction(Transaction(
+        wallet1.publicKey, "someone", 25, wallet1.privateKey))
+    resumedBlockchain.handleTransactions(wallet1.publicKey)
+    assert len(reopenedStore) == len(blockchain.blockchain) + 1
+    assert reopenedStore.readBlock(-1).blockHash == resumedBlockchain.getCurrentBlock().blockHash
+    assert resumedBlockchain.getBalance("someone") == 55
+    reopenedStore.close()
+
+
+def test_lazyBlockchainShouldKeepBoundedBlocksInMemory(tmp_path):
+    wallet1 = Wallet("person")
+    blockStore = BlockStore(str(tmp_path) + "/")
+    blockchain = Blockchain(1, 1, blockStore=blockStore, blockCacheSize=2)
+    blockchain.forceTransaction(wallet1.publicKey, 1000)
+    for i in range(5):
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", 10, wallet1.privateKey))
+        blockchain.handleTransactions(wallet1.publicKey)
+
+    assert len(blockchain.blockchain) == len(blockStore) == 7
+    assert len(blockchain.blockchain.blockCache) <= 2
+    assert blockchain.blockchain[1].blockHash == blockStore.readBlock(1).blockHash
+    assert [block.blockHash for block in blockchain.blockchain] == \
+        [block.blockHash for block in blockStore]
+
+    blockchain.auditBlockchain()
+    assert len(blockchain.blockchain.blockCache) <= 2
+    assert blockchain.getBalance("someone") == 50
+
+    # A long running node can open the same store again and go on.
+    reloadedBlockchain = Blockchain.initializeBlockchain(
+        1, 1, chainSize=blockchain.chainSize, blockStore=blockStore, blockCacheSize=2)
+    reloadedBlockchain.auditBlockchain()
+    assert reloadedBlockchain.getBalance("someone") == 50
+    reloadedBlockchain.addTransaction(Transaction(
+        wallet1.publicKey, "someone", 25, wallet1.privateKey))
+    reloadedBlockchain.handleTransactions(wallet1.publicKey)
+    assert len(blockStore) == 8
+    assert blockStore.readBlock(-1).blockHash == reloadedBlockchain.getCurrentBlock().blockHash
+    assert reloadedBlockchain.getBalance("someone") == 75
+    blockStore.close()
+
+
+def test_sqliteBlockStoreShouldAnswerTransactionQueries(tmp_path):
+    wallet1 = Wallet("person1")
+    wallet2 = Wallet("person2")
+    blockStore = SQLiteBlockStore(str(tmp_path / "blockchain.db"))
+    blockchain = Blockchain(1, 1, blockStore=blockStore)
+    blockchain.forceTransaction(wallet1.publicKey, 1000)
+
+    transactions = []
+    for i in range(3):
+        transaction = Transaction(
+            wallet1.publicKey, wallet2.publicKey, i + 1, wallet1.privateKey)
+        blockchain.addTransaction(transaction)
+        blockchain.handleTransactions("null")
+        transactions.append(transaction)
+
+    assert len(blockStore) == len(blockchain.blockchain)
+    assert blockStore.readBlock(-1).blockHash == blockchain.getCurrentBlock().blockHash
+
+    result = blockchain.findTransaction(transactions[1].transactionHash)
+    assert result["blockNumber"] == 3
+    assert result["transaction"].balance == 2
+
+    storedTransactions = blockchain.getTransactionsOfAddress(wallet2.publicKey)
+    assert [result["transaction"].transactionHash for result in storedTransactions] == \
+        [transaction.transactionHash for transaction in transactions]
+
+    # The indexed queries give the same results as walking the chain.
+    blockchain.blockStore = None
+    assert [result["blockNumber"] for result in blockchain.getTransactionsOfAddress(wallet1.publicKey)] == \
+        [result["blockNumber"] for result in blockStore.getTransactionsOfAddress(wallet1.publicKey)]
+    assert blockchain.findTransaction("00" * 32) is None
+    blockStore.close()
+
+    reopenedStore = SQLiteBlockStore(str(tmp_path / "blockchain.db"))
+    with pytest.raises(BlockStoreError):
+        Blockchain(1, 1, blockStore=reopenedStore)
+    resumedBlockchain = Blockchain.initializeBlockchain(
+        blockchain.hashDifficulty, 1, chainSize=blockchain.chainSize, blockStore=reopenedStore)
+    resumedBlockchain.addTransaction(Transaction(
+        wallet1.publicKey, wallet2.publicKey, 4, wallet1.privateKey))
+    resumedBlockchain.handleTransactions("null")
+    assert len(reopenedStore) == len(blockchain.blockchain) + 1
+    assert len(resumedBlockchain.getTransactionsOfAddress(wallet2.publicKey)) == 4
+    reopenedStore.close()
+
+
+def test_binaryFormatShouldMatchJsonFormat():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 2, wallet1.publicKey, 1000)
+    for i in range(3):
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", 10 * (i + 1), wallet1.privateKey))
+    blockchain.handleTransactions(wallet1.publicKey)
+    blockchain.forceTransaction(wallet1.publicKey, 10.5)
+
+    converter = DataConverter()
+    binaryData = converter.dumpBlockchainDataAsBytes(blockchain)
+    loadedBlockchain = converter.loadBlockchainDataFromBytes(
+        memoryview(binaryData), verify=True)
+
+    assert converter.dumpBlockchainData(loadedBlockchain) == \
+        converter.dumpBlockchainData(blockchain)
+    assert len(binaryData) < len(converter.dumpBlochcainDataAsStr(blockchain))
+
+    block = blockchain.getCurrentBlock()
+    assert converter.loadBlockFromBytes(converter.dumpBlockAsBytes(
+        block)).generateBlockHash() == block.blockHash
+
+
+def test_snapshotWithDeltasShouldRebuildTheChain():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    blockDataIO = BlockDataIO()
+    blockDataIO.exportSnapshot(blockchain, "snapshot.jsonl")
+
+    for deltaNumber in range(2):
+        for i in range(2):
+            blockchain.addTransaction(Transaction(
+                wallet1.publicKey, "someone", 10, wallet1.privateKey))
+            blockchain.handleTransactions(wallet1.publicKey)
+        blockDataIO.exportDelta(blockchain, f"delta{deltaNumber}.jsonl")
+
+    deltaBlocks = list(blockDataIO.streamBlocks("delta1.jsonl"))
+    assert [block.blockHash for block in deltaBlocks] == \
+        [block.blockHash for block in blockchain.blockchain[-2:]]
+
+    loadedBlockchain = blockDataIO.importWithDeltas(
+        "snapshot.jsonl", ["delta0.jsonl", "delta1.jsonl"], verify=True)
+    assert [block.blockHash for block in loadedBlockchain.blockchain] == \
+        [block.blockHash for block in blockchain.blockchain]
+    assert loadedBlockchain.getBalance("someone") == 40
+
+    # Deltas can't be skipped or applied to another chain.
+    with pytest.raises(BlockchainSequenceError):
+        blockDataIO.importWithDeltas("snapshot.jsonl", ["delta1.jsonl"])
+
+
+def test_messageFramingShouldSplitTheStreamIntoMessages():
+    async def readMessages():
+        data = encodeMessage(1) + encodeMessage(2, bytes(range(256)) * 1000)
+        reader = asyncio.StreamReader()
+        for i in range(0, len(data), 1000):
+            reader.feed_data(data[i:i + 1000])
+        reader.feed_eof()
+        return [await readMessage(reader), await readMessage(reader)]
+
+    messages = asyncio.run(readMessages())
+    assert messages == [(1, b""), (2, bytes(range(256)) * 1000)]
+
+
+def test_malformedMessagesShouldOnlyDropTheirPeer():
+    blockchain = Blockchain(1, 1)
+    blockBody = BinaryConverter.encodeBlock(blockchain.getCurrentBlock())
+    malformedMessages = [
+        encodeMessage(STATUS, b"short"),
+        encodeMessage(TRANSACTION, bytes(10)),
+        encodeMessage(BLOCK, blockBody[:len(blockBody) // 2]),
+        encodeMessage(COMPACT_BLOCK, encodeCompactBlock(blockchain.getCurrentBlock())[:-1]),
+        encodeMessage(BLOCK_TRANSACTIONS, bytes(35))]
+
+    async def sendMalformedMessages():
+        server = P2PServer("127.0.0.1", 0, blockchain)
+        await server.initializeNetwork()
+        closedConnections = 0
+        for message in malformedMessages:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.PORT)
+            writer.write(message)
+            await writer.drain()
+            # The server closes the connection after its status message.
+            await asyncio.wait_for(reader.read(), 5)
+            closedConnections += 1
+            writer.close()
+        await waitUntil(lambda: len(server.peers) == 0)
+        isServing = server.server.is_serving()
+        await server.stopNetwork()
+        return closedConnections, isServing
+
+    assert asyncio.run(sendMalformedMessages()) == (len(malformedMessages), True)
+
+
+def test_miningShouldNotBlockTheEventLoop(monkeypatch):
+    blockchain = Blockchain(1, 1)
+    monkeypatch.setattr(blockchain, "handleTransactions",
+                        lambda rewardAddress: time.sleep(0.5))
+
+    async def mineWhileTicking():
+        node = Node("null")
+        await node.initializeNode("127.0.0.1", 0, blockchain)
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        ticker = asyncio.create_task(tick())
+        minedBlocks = await node.mineBlock()
+        ticker.cancel()
+        await node.stopNode()
+        return minedBlocks, ticks
+
+    minedBlocks, ticks = asyncio.run(mineWhileTicking())
+    assert minedBlocks == []
+    assert ticks > 10
+
+
+def test_peersShouldReceiveTheLongestBlockchain():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    blockchain.addTransaction(Transaction(
+        wallet1.publicKey, "someone", 10, wallet1.privateKey))
+    blockchain.handleTransactions(wallet1.publicKey)
+
+    async def syncPeers():
+        server = P2PServer("127.0.0.1", 0, blockchain)
+        await server.initializeNetwork()
+        peers = [P2PServer("127.0.0.1", 0, Blockchain(1, 1)) for i in range(3)]
+        for peer in peers:
+            await peer.initializeNetwork()
+            await peer.connectToPeer("127.0.0.1", server.PORT)
+        await asyncio.wait_for(asyncio.gather(
+            *[peer.blockchainUpdated.wait() for peer in peers]), 10)
+        for node in [server] + peers:
+            await node.stopNetwork()
+        return [peer.blockchain for peer in peers]
+
+    for receivedBlockchain in asyncio.run(syncPeers()):
+        assert [block.blockHash for block in receivedBlockchain.blockchain] == \
+            [block.blockHash for block in blockchain.blockchain]
+        assert receivedBlockchain.getBalance("someone") == 10
+
+
+def test_receivedBlockchainWithInvalidTransactionsShouldBeRejected():
+    wallet1 = Wallet("person")
+    wallet2 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    converter = DataConverter()
+    forgedBlockchain = converter.loadBlockchainDataFromBytes(
+        converter.dumpBlockchainDataAsBytes(blockchain))
+
+    # The forged block has a valid proof of work but its reward isn't paid
+    # from fees, so only the transaction checks can find it.
+    for i in range(2):
+        reward = Transaction(wallet2.publicKey, wallet2.publicKey, 10 ** 9, wallet2.privateKey)
+        forgedBlockchain.insertBlockAndReevaluateDifficulty(Block(
+            forgedBlockchain.getCurrentBlock().blockHash, forgedBlockchain.hashDifficulty,
+            [reward.getApprovedCopy()]))
+    forgedBlockchain.auditBlockchain()
+    blockchain.addTransaction(Transaction(
+        wallet1.publicKey, "someone", 10, wallet1.privateKey))
+    blockchain.handleTransactions(wallet1.publicKey)
+    assert forgedBlockchain.chainWork > blockchain.chainWork
+
+    async def receiveBlockchains():
+        nodeBlockchain = Blockchain(1, 1)
+        node = P2PServer("127.0.0.1", 0, nodeBlockchain)
+        node.blockchainUpdated = asyncio.Event()
+        node.blockchainLock = asyncio.Lock()
+        peer = SimpleNamespace(address=("127.0.0.1", 0))
+        await node.handleBlockchain(peer, converter.dumpBlockchainDataAsBytes(forgedBlockchain))
+        forgedIsRejected = node.blockchain is nodeBlockchain
+        await node.handleBlockchain(peer, converter.dumpBlockchainDataAsBytes(blockchain))
+        return forgedIsRejected, node.blockchain
+
+    forgedIsRejected, receivedBlockchain = asyncio.run(receiveBlockchains())
+    assert forgedIsRejected
+    assert [block.blockHash for block in receivedBlockchain.blockchain] == \
+        [block.blockHash for block in blockchain.blockchain]
+    assert receivedBlockchain.getBalance("someone") == 10
+    assert receivedBlockchain.getBalance(wallet2.publicKey) == 0
+
+
+def test_peersShouldOnlySendMissingBlocks():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    converter = DataConverter()
+    peerBlockchain = converter.loadBlockchainDataFromBytes(
+        converter.dumpBlockchainDataAsBytes(blockchain))
+    for i in range(3):
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", 10, wallet1.privateKey))
+        blockchain.handleTransactions(wallet1.publicKey)
+
+    async def syncPeers():
+        server = P2PServer("127.0.0.1", 0, blockchain)
+        await server.initializeNetwork()
+        peer = P2PServer("127.0.0.1", 0, peerBlockchain)
+        await peer.initializeNetwork()
+        await peer.connectToPeer("127.0.0.1", server.PORT)
+        while len(peer.blockchain.blockchain) < len(blockchain.blockchain):
+            await asyncio.wait_for(peer.blockchainUpdated.wait(), 10)
+            peer.blockchainUpdated.clear()
+        await peer.stopNetwork()
+        await server.stopNetwork()
+        return peer.blockchain
+
+    # Missing blocks are appended to the same blockchain.
+    assert asyncio.run(syncPeers()) is peerBlockchain
+    assert [block.blockHash for block in peerBlockchain.blockchain] == \
+        [block.blockHash for block in blockchain.blockchain]
+    assert peerBlockchain.getBalance("someone") == 30
+    assert blockchain.getBlockLocator()[0] == blockchain.getCurrentBlock().blockHash
+    assert blockchain.findLocatorAncestor(
+        peerBlockchain.getBlockLocator()) == len(blockchain.blockchain) - 1
+
+
+def test_headersFirstSyncShouldDownloadBlocksFromManyPeers():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    for i in range(5):
+        blockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", 10, wallet1.privateKey))
+        blockchain.handleTransactions(wallet1.publicKey)
+    converter = DataConverter()
+    blockchainData = converter.dumpBlockchainDataAsBytes(blockchain)
+
+    async def syncNode():
+        servers = [P2PServer("127.0.0.1", 0, converter.loadBlockchainDataFromBytes(blockchainData))
+                   for i in range(3)]
+        requestCounts = [0, 0, 0]
+        for i, server in enumerate(servers):
+            await server.initializeNetwork()
+            handler = server.messageHandlers[GET_BLOCK_BODIES]
+
+            async def countRequests(peer, body, i=i, handler=handler):
+                requestCounts[i] += 1
+                # The first peer is too slow to answer.
+                if i > 0:
+                    await handler(peer, body)
+            server.messageHandlers[GET_BLOCK_BODIES] = countRequests
+
+        node = P2PServer("127.0.0.1", 0, Blockchain(1, 1))
+        node.autoSync = False
+        node.bodyRangeSize = 1
+        node.requestTimeout = 0.5
+        await node.initializeNetwork()
+        for server in servers:
+            await node.connectToPeer("127.0.0.1", server.PORT)
+        await node.headersFirstSync()
+
+        for server in servers + [node]:
+            await server.stopNetwork()
+        return node.blockchain, requestCounts
+
+    syncedBlockchain, requestCounts = asyncio.run(syncNode())
+    assert [block.blockHash for block in syncedBlockchain.blockchain] == \
+        [block.blockHash for block in blockchain.blockchain]
+    assert syncedBlockchain.getBalance("someone") == 50
+    # Ranges of the slow peer are downloaded again from the others.
+    assert requestCounts[0] > 0
+    assert requestCounts[1] + requestCounts[2] >= len(blockchain.blockchain)
+
+
+def test_headersFirstSyncShouldRejectInvalidTransactions():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    # The block has a valid header but mints a reward from no fees.
+    reward = Transaction(wallet1.publicKey, wallet1.publicKey, 10 ** 9, wallet1.privateKey)
+    for i in range(2):
+        blockchain.insertBlockAndReevaluateDifficulty(Block(
+            blockchain.getCurrentBlock().blockHash, blockchain.hashDifficulty,
+            [reward.getApprovedCopy()]))
+    blockchain.auditBlockchain()
+
+    # A chain with more work from a lower genesis difficulty is refused
+    # by its headers.
+    easyBlockchain = Blockchain(1, 1)
+    while easyBlockchain.chainWork <= Blockchain(2, 1).chainWork:
+        easyBlockchain.forceTransaction(wallet1.publicKey, 10)
+
+    async def syncNode(serverBlockchain, nodeHashDifficulty, expectedError):
+        server = P2PServer("127.0.0.1", 0, serverBlockchain)
+        await server.initializeNetwork()
+        nodeBlockchain = Blockchain(nodeHashDifficulty, 1)
+        node = P2PServer("127.0.0.1", 0, nodeBlockchain)
+        node.autoSync = False
+        await node.initializeNetwork()
+        await node.connectToPeer("127.0.0.1", server.PORT)
+        await waitUntil(lambda: len(node.peers) == 1)
+        try:
+            with pytest.raises(expectedError):
+                await node.headersFirstSync()
+        finally:
+            for peer in [server, node]:
+                await peer.stopNetwork()
+        return node.blockchain is nodeBlockchain
+
+    assert asyncio.run(syncNode(blockchain, 1, IllegalAccessError))
+    assert asyncio.run(syncNode(easyBlockchain, 2, NetworkProtocolError))
+
+
+def test_rotatingBloomFilterShouldRememberRecentItems():
+    seenItems = RotatingBloomFilter(100)
+    for i in range(250):
+        seenItems.add(f"item{i}")
+    assert all(f"item{i}" in seenItems for i in range(150, 250))
+    assert sum(f"other{i}" in seenItems for i in range(1000)) < 10
+    assert len(seenItems.currentFilter.bits) == len(
+        seenItems.previousFilter.bits)
+
+
+def test_receivedTransactionShouldNotBeReplayed():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        0, 1, wallet1.publicKey, 1000)
+    transaction = Transaction(
+        wallet1.publicKey, "someone", 10, wallet1.privateKey)
+
+    blockchain.addReceivedTransaction(transaction.getApprovedCopy())
+    with pytest.raises(MempoolError):
+        blockchain.addReceivedTransaction(transaction.getApprovedCopy())
+    blockchain.handleTransactions("null")
+    balance = blockchain.getBalance(wallet1.publicKey)
+
+    for i in range(3):
+        with pytest.raises(MempoolError):
+            blockchain.addReceivedTransaction(transaction.getApprovedCopy())
+    assert blockchain.getBalance(wallet1.publicKey) == balance
+    assert len(blockchain.pendingTransactions) == 0
+
+    # A rolled back transaction isn't confirmed anymore.
+    blockchain.disconnectBlocks(len(blockchain.blockchain) - 1)
+    assert not blockchain.isConfirmedTransaction(transaction.getTransactionHashBytes())
+
+
+def test_olderTransactionsShouldBeLookedUpInTheBlocks(monkeypatch, tmp_path):
+    wallet1 = Wallet("person")
+    for blockStore in [None, SQLiteBlockStore(str(tmp_path / "chain.db"))]:
+        blockchain = Blockchain(0, 1, blockStore=blockStore)
+        blockchain.balanceIndex = BalanceIndex(2)
+        blockchain.rebuildBalanceIndex()
+        blockchain.forceTransaction(wallet1.publicKey, 1000)
+        transaction = Transaction(wallet1.publicKey, "someone", 10, wallet1.privateKey)
+        blockchain.addTransaction(transaction)
+        blockchain.handleTransactions("null")
+        for i in range(3):
+            blockchain.forceTransaction("someone", 1)
+
+        # Only the transactions of the last two blocks are kept.
+        assert len(blockchain.balanceIndex.recentTransactions) <= 4
+        lookups = []
+        findTransaction = blockchain.findTransaction
+        monkeypatch.setattr(blockchain, "findTransaction", lambda transactionHash:
+                            lookups.append(transactionHash) or findTransaction(transactionHash))
+        with pytest.raises(MempoolError):
+            blockchain.addReceivedTransaction(transaction.getApprovedCopy())
+        assert lookups == [transaction.getTransactionHashBytes().hex()]
+
+        # A new transaction isn't in the filter, so no block is searched.
+        blockchain.addReceivedTransaction(Transaction(
+            wallet1.publicKey, "someone", 10, wallet1.privateKey).getApprovedCopy())
+        assert len(lookups) == 1
+        assert blockchain.getBalance("someone") == 23
+        if blockStore is not None:
+            blockStore.close()
+
+
+def test_transactionsAndBlocksShouldBeGossipedOnce():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    converter = DataConverter()
+    blockchainData = converter.dumpBlockchainDataAsBytes(blockchain)
+
+    async def gossip():
+        nodes = [P2PServer("127.0.0.1", 0, converter.loadBlockchainDataFromBytes(blockchainData))
+                 for i in range(4)]
+        deliveries = []
+        for i, node in enumerate(nodes):
+            node.autoSync = False
+            await node.initializeNetwork()
+            handler = node.handleTransaction
+
+            async def countDeliveries(peer, body, i=i, handler=handler):
+                deliveries.append(i)
+                await handler(peer, body)
+            node.messageHandlers[TRANSACTION] = countDeliveries
+
+        # Every node can hear about an object from two peers.
+        for i, j in [(0, 1), (0, 2), (1, 3), (2, 3)]:
+            await nodes[i].connectToPeer("127.0.0.1", nodes[j].PORT)
+        await waitUntil(lambda: all(len(node.peers) == 2 for node in nodes))
+
+        transaction = Transaction(
+            wallet1.publicKey, "someone", 10, wallet1.privateKey)
+        nodes[0].blockchain.addTransaction(transaction)
+        await nodes[0].announceTransaction(transaction)
+        await waitUntil(lambda: all(len(node.blockchain.pendingTransactions) == 1 for node in nodes))
+
+        minedHeight = len(nodes[0].blockchain.blockchain)
+        nodes[0].blockchain.handleTransactions(wallet1.publicKey)
+        await nodes[0].announceBlock(nodes[0].blockchain.blockchain[minedHeight])
+        await waitUntil(lambda: all(len(node.blockchain.blockchain) == minedHeight + 1 for node in nodes))
+
+        for node in nodes:
+            await node.stopNetwork()
+        return nodes, deliveries
+
+    nodes, deliveries = asyncio.run(gossip())
+    assert sorted(deliveries) == [1, 2, 3]
+    for node in nodes:
+        assert node.blockchain.getCurrentBlock().blockHash == \
+            nodes[0].blockchain.getCurrentBlock().blockHash
+        assert len(node.blockchain.pendingTransactions) == 0
+        assert node.blockchain.getBalance("someone") == 10
+
+
+def test_compactBlocksShouldBeRebuiltFromTheMempool():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    converter = DataConverter()
+    blockchainData = converter.dumpBlockchainDataAsBytes(blockchain)
+
+    async def relayBlock():
+        miner, node = [P2PServer("127.0.0.1", 0, converter.loadBlockchainDataFromBytes(blockchainData))
+                       for i in range(2)]
+        receivedMessages = []
+        for messageType in [BLOCK, COMPACT_BLOCK, BLOCK_TRANSACTIONS]:
+            handler = node.messageHandlers[messageType]
+
+            async def recordMessage(peer, body, messageType=messageType, handler=handler):
+                receivedMessages.append((messageType, len(body)))
+                await handler(peer, body)
+            node.messageHandlers[messageType] = recordMessage
+
+        for server in [miner, node]:
+            server.autoSync = False
+            await server.initializeNetwork()
+        await node.connectToPeer("127.0.0.1", miner.PORT)
+        await waitUntil(lambda: len(miner.peers) == 1)
+
+        # The node has every transaction of the block except the last one.
+        # Transactions of the same second only differ by their amounts.
+        for i in range(20):
+            transaction = Transaction(
+                wallet1.publicKey, "someone", i + 1, wallet1.privateKey)
+            miner.blockchain.addTransaction(transaction)
+            if i < 19:
+                await miner.announceTransaction(transaction)
+        await waitUntil(lambda: len(node.blockchain.pendingTransactions) == 19)
+
+        minedHeight = len(miner.blockchain.blockchain)
+        miner.blockchain.handleTransactions(wallet1.publicKey)
+        minedBlock = miner.blockchain.blockchain[minedHeight]
+        await miner.announceBlock(minedBlock)
+        await waitUntil(lambda: len(node.blockchain.blockchain) == minedHeight + 1)
+
+        for server in [miner, node]:
+            await server.stopNetwork()
+        return node.blockchain, minedBlock, receivedMessages
+
+    nodeBlockchain, minedBlock, receivedMessages = asyncio.run(relayBlock())
+    assert nodeBlockchain.getCurrentBlock().blockHash == minedBlock.blockHash
+    assert nodeBlockchain.getBalance("someone") == 210
+    assert len(nodeBlockchain.pendingTransactions) == 0
+
+    # Only the compact block and the missing transaction are received.
+    assert [messageType for messageType, size in receivedMessages] == [
+        COMPACT_BLOCK, BLOCK_TRANSACTIONS]
+    receivedSize = sum(size for messageType, size in receivedMessages)
+    assert receivedSize * 4 < len(converter.dumpBlockAsBytes(minedBlock))
+
+
+def test_branchWithMoreWorkShouldReorganizeTheBlockchain():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    converter = DataConverter()
+    otherBlockchain = converter.loadBlockchainDataFromBytes(
+        converter.dumpBlockchainDataAsBytes(blockchain))
+    forkHeight = len(blockchain.blockchain)
+
+    blockchain.addTransaction(Transaction(
+        wallet1.publicKey, "someone", 10, wallet1.privateKey))
+    blockchain.handleTransactions(wallet1.publicKey)
+    for amount in [20, 30]:
+        otherBlockchain.addTransaction(Transaction(
+            wallet1.publicKey, "someone", amount, wallet1.privateKey))
+        otherBlockchain.handleTransactions(wallet1.publicKey)
+    branch = otherBlockchain.blockchain[forkHeight:]
+
+    # A branch with less work than the replaced blocks isn't taken.
+    assert otherBlockchain.reorganize(
+        forkHeight, blockchain.blockchain[forkHeight:]) == False
+    assert blockchain.reorganize(forkHeight, branch) == True
+    assert [block.blockHash for block in blockchain.blockchain] == \
+        [block.blockHash for block in otherBlockchain.blockchain]
+    assert blockchain.chainWork == otherBlockchain.chainWork
+
+    # The transaction of the rolled back block is back in the mempool.
+    assert len(blockchain.pendingTransactions) == 1
+    assert blockchain.getBalance("someone") == 60
+    blockchain.handleTransactions(wallet1.publicKey)
+    blockchain.auditBlockchain()
+    assert len(blockchain.pendingTransactions) == 0
+    assert blockchain.getBalance("someone") == 60
+    assert blockchain.getBalance(wallet1.publicKey) == \
+        otherBlockchain.getBalance(wallet1.publicKey) - 10
+
+
+def test_receivedBlocksWithInvalidTransactionsShouldBeRejected():
+    wallet1 = Wallet("person")
+    wallet2 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    forkHeight = len(blockchain.blockchain)
+
+    def createTransaction(amount: int, signer: Wallet = wallet1):
+        transaction = Transaction(wallet1.publicKey, "someone", amount, signer.privateKey)
+        transaction.calculateTransactionFee(blockchain.gasPrice)
+        return transaction.getApprovedCopy()
+
+    # The last transaction is the block reward, which pays the fees to the miner.
+    def createBlock(previousBlockHash: str, transactions: list, rewardAmount: int = None):
+        if rewardAmount is None:
+            rewardAmount = sum(transaction.fee for transaction in transactions)
+        reward = Transaction(wallet2.publicKey, "miner", rewardAmount, wallet2.privateKey)
+        return Block(previousBlockHash, blockchain.hashDifficulty,
+                     transactions + [reward.getApprovedCopy()])
+
+    validBlock = createBlock(blockchain.getCurrentBlock().blockHash, [createTransaction(100)])
+    negativeFeeTransaction = createTransaction(10)
+    negativeFeeTransaction.fee = -10 ** 6
+    invalidBlocks = [createBlock(validBlock.blockHash, transactions, rewardAmount)
+                     for transactions, rewardAmount in [
+                         ([createTransaction(5000)], None),
+                         ([createTransaction(10, wallet2)], None),
+                         ([validBlock.blockTransactions[0]], None),
+                         ([negativeFeeTransaction], None),
+                         ([], 10 ** 9),
+                         ([createTransaction(10)], 1000)]]
+    balance = blockchain.getBalance(wallet1.publicKey)
+
+    # A branch with an invalid block is rolled back.
+    for invalidBlock in invalidBlocks:
+        with pytest.raises(IllegalAccessError):
+            blockchain.reorganize(forkHeight, [validBlock, invalidBlock])
+        assert len(blockchain.blockchain) == forkHeight
+        assert blockchain.getBalance(wallet1.publicKey) == balance
+
+    blockchain.appendReceivedBlock(validBlock)
+    for invalidBlock in invalidBlocks:
+        with pytest.raises(IllegalAccessError):
+            blockchain.appendReceivedBlock(invalidBlock)
+    assert blockchain.getCurrentBlock().blockHash == validBlock.blockHash
+    assert blockchain.getBalance("someone") == 100
+    assert blockchain.getBalance("miner") == validBlock.blockTransactions[0].fee
+    assert blockchain.getBalance(wallet1.publicKey) == \
+        balance - 100 - validBlock.blockTransactions[0].fee
+
+
+def test_failedBranchShouldLeaveTheBlockchainAsItWas(monkeypatch):
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    converter = DataConverter()
+    otherBlockchain = converter.loadBlockchainDataFromBytes(
+        converter.dumpBlockchainDataAsBytes(blockchain))
+    forkHeight = len(blockchain.blockchain)
+
+    blockchain.addTransaction(Transaction(
+        wallet1.publicKey, "a", 10, wallet1.privateKey))
+    blockchain.handleTransactions(wallet1.publicKey)
+    tipHash = blockchain.getCurrentBlock().blockHash
+    otherBlockchain.addTransaction(Transaction(
+        wallet1.publicKey, "b", 20, wallet1.privateKey))
+    otherBlockchain.handleTransactions(wallet1.publicKey)
+
+    # A transaction with an unknown signature scheme.
+    unknownSchemeTransaction = Transaction(
+        wallet1.publicKey, "b", 30, wallet1.privateKey).getApprovedCopy()
+    unknownSchemeTransaction.signatureScheme = 9
+    branch = [otherBlockchain.getCurrentBlock(),
+              Block(otherBlockchain.getCurrentBlock().blockHash, blockchain.hashDifficulty,
+                    [unknownSchemeTransaction])]
+
+    # The transaction that the branch takes from the mempool is put back.
+    blockchain.addReceivedTransaction(branch[0].blockTransactions[0].getApprovedCopy())
+    with pytest.raises(IllegalAccessError):
+        blockchain.reorganize(forkHeight, branch)
+    assert blockchain.getCurrentBlock().blockHash == tipHash
+    assert len(blockchain.pendingTransactions) == 1
+    assert blockchain.balanceIndex.confirmedBalances.get("a") == 10
+    assert blockchain.balanceIndex.confirmedBalances.get("b") is None
+
+    # Any other error rolls the branch back too.
+    def failOnSecondBlock(block):
+        if block is branch[1]:
+            raise RuntimeError()
+    monkeypatch.setattr(blockchain, "validateBlockTransactions", failOnSecondBlock)
+    with pytest.raises(RuntimeError):
+        blockchain.reorganize(forkHeight, branch)
+    assert blockchain.getCurrentBlock().blockHash == tipHash
+    assert blockchain.balanceIndex.confirmedBalances.get("a") == 10
+    assert blockchain.balanceIndex.confirmedBalances.get("b") is None
+    blockchain.auditBlockchain()
+    assert len(blockchain.blockchain) == forkHeight + 1
+
+
+def test_rolledBackReceivedTransactionsShouldBeCheckedAgain():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    converter = DataConverter()
+    blockchainData = converter.dumpBlockchainDataAsBytes(blockchain)
+    minerBlockchain = converter.loadBlockchainDataFromBytes(blockchainData)
+    otherBlockchain = converter.loadBlockchainDataFromBytes(blockchainData)
+    forkHeight = len(blockchain.blockchain)
+
+    # The transactions of a received block were never in the mempool.
+    for destination, amount in [("someone", 100), ("another", 850)]:
+        minerBlockchain.addTransaction(Transaction(
+            wallet1.publicKey, destination, amount, wallet1.privateKey))
+    minerBlockchain.handleTransactions(wallet1.publicKey)
+    blockchain.appendReceivedBlock(minerBlockchain.getCurrentBlock())
+    assert len(blockchain.pendingTransactions) == 0
+
+    for amount in [800, 5]:
+        otherBlockchain.addTransaction(Transaction(
+            wallet1.publicKey, "other", amount, wallet1.privateKey))
+        otherBlockchain.handleTransactions(wallet1.publicKey)
+    assert blockchain.reorganize(
+        forkHeight, otherBlockchain.blockchain[forkHeight:]) == True
+
+    # The transaction that the branch double spends isn't restored.
+    assert len(blockchain.pendingTransactions) == 1
+    assert blockchain.getBalance("someone") == 100
+    assert blockchain.getBalance("another") == 0
+    assert blockchain.getBalance(wallet1.publicKey) >= 0
+    blockchain.handleTransactions(wallet1.publicKey)
+    blockchain.auditBlockchain()
+    assert blockchain.getBalance("someone") == 100
+
+
+def test_chainWithoutItsClaimedWorkShouldBeRejected():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    converter = DataConverter()
+    blockchainData = converter.dumpBlockchainDataAsBytes(blockchain)
+
+    def getForgedBlockchainData(hashDifficulty: int) -> bytes:
+        forgedBlockchain = converter.loadBlockchainDataFromBytes(blockchainData)
+        block = forgedBlockchain.getCurrentBlock()
+        for i in range(3):
+            forgedBlock = Block.initializeBlock(
+                block.blockHash, "", block.merkleRoot, 0, hashDifficulty, block.blockBalance,
+                block.blockFee, block.validationTime, block.blockTransactions)
+            forgedBlock.blockHash = forgedBlock.generateBlockHash()
+            forgedBlockchain.appendStoredBlock(forgedBlock)
+            block = forgedBlock
+        return converter.dumpBlockchainDataAsBytes(forgedBlockchain)
+
+    class TestPeer():
+        address = "test"
+
+    # A chain that claims more work than it has, and one with blocks
+    # below the expected difficulty, don't replace the blockchain.
+    server = P2PServer("127.0.0.1", 0, blockchain)
+    for hashDifficulty in [30, 0]:
+        forgedBlockchainData = getForgedBlockchainData(hashDifficulty)
+        with pytest.raises(IllegalAccessError):
+            converter.loadBlockchainDataFromBytes(forgedBlockchainData, verify=True)
+        asyncio.run(server.handleBlockchain(TestPeer(), forgedBlockchainData))
+        assert server.blockchain is blockchain
+
+    lowDifficultyBlockchain = Blockchain(0, 1)
+    lowDifficultyBlockchain.forceTransaction(wallet1.publicKey, 1000)
+    for i in range(40):
+        lowDifficultyBlockchain.forceTransaction(wallet1.publicKey, i + 1)
+    assert lowDifficultyBlockchain.chainWork > blockchain.chainWork
+    asyncio.run(server.handleBlockchain(
+        TestPeer(), converter.dumpBlockchainDataAsBytes(lowDifficultyBlockchain)))
+    assert server.blockchain is blockchain
+
+
+def test_unlinkedBlockShouldBeDroppedWithTheBlocksAfterIt():
+    blockchain = blockchainFactory.getBlockchain(0, 1)
+    for i in range(5):
+        blockchain.forceTransaction("someone", 10)
+    blockchain.blockchain[3] = blockchainFactory.getBlockchain(
+        0, 1).getCurrentBlock()
+
+    blockchain.auditBlockchain()
+    assert len(blockchain.blockchain) == 3
+    assert blockchain.validationFlag == True
+    assert blockchain.validatedHeight == 3
+
+
+def test_peerManagerShouldKeepABoundedPoolOfLiveConnections():
+    async def managePeers():
+        server = P2PServer("127.0.0.1", 0, Blockchain(0, 1))
+        server.peerManager.maxPeers = 2
+        await server.initializeNetwork()
+        nodes = [P2PServer("127.0.0.1", 0, Blockchain(0, 1)) for i in range(3)]
+        for node in nodes:
+            node.peerManager.pingInterval = 0.1
+            node.peerManager.pingTimeout = 0.2
+            node.peerManager.reconnectDelay = 0.05
+            await node.initializeNetwork()
+        for node in nodes:
+            node.peerManager.addPeerAddress("127.0.0.1", server.PORT)
+            await waitUntil(lambda: len(server.peers) == min(2, nodes.index(node) + 1))
+        await asyncio.sleep(0.3)
+        peerCount = len(server.peers)
+
+        # A server that stops answering pings is dropped and
+        # the node connects to it again with a backoff.
+        firstPeer = nodes[0].peerManager.peerAddresses[("127.0.0.1", server.PORT)]
+        del server.messageHandlers[PING]
+        await waitUntil(lambda: firstPeer.closed.is_set())
+        server.messageHandlers[PING] = server.peerManager.handlePing
+        await waitUntil(lambda: nodes[0].peerManager.peerAddresses[
+            ("127.0.0.1", server.PORT)] is not firstPeer)
+        await waitUntil(lambda: len(server.peers) == 2)
+
+        for node in nodes + [server]:
+            await node.stopNetwork()
+        return peerCount
+
+    assert asyncio.run(managePeers()) == 2
+
+
+def test_slowPeerShouldBeDropped():
+    async def sendToSilentPeer():
+        # This peer never reads its messages.
+        silentServer = await asyncio.start_server(
+            lambda reader, writer: asyncio.sleep(10), "127.0.0.1", 0)
+        node = P2PServer("127.0.0.1", 0, Blockchain(0, 1))
+        await node.initializeNetwork()
+        peer = await node.connectToPeer(
+            "127.0.0.1", silentServer.sockets[0].getsockname()[1])
+        peer.highWaterMark = 1024 * 1024
+        peer.sendTimeout = 0.2
+
+        # Announcements to a peer over its high-water mark are skipped
+        # without waiting for it. The socket buffers are filled first,
+        # so the queue doesn't drain anymore.
+        for i in range(100):
+            while peer.trySend(TRANSACTION, bytes(64 * 1024)):
+                pass
+            await asyncio.sleep(0.02)
+            if peer.queuedBytes > peer.highWaterMark // 2:
+                break
+        while peer.trySend(PING):
+            pass
+        queuedBytes = peer.queuedBytes
+        await asyncio.wait_for(node.announceBlock(node.blockchain.getCurrentBlock()), 0.1)
+        assert peer.queuedBytes == queuedBytes and not peer.closed.is_set()
+
+        with pytest.raises(ConnectionError):
+            for i in range(256):
+                await peer.send(TRANSACTION, bytes(1024 * 1024))
+        isClosed = peer.closed.is_set()
+
+        await node.stopNetwork()
+        silentServer.close()
+        return isClosed
+
+    assert asyncio.run(sendToSilentPeer()) == True
+
+
+def test_nodeWithoutBlockchainShouldIgnoreRelayedObjects():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    transaction = Transaction(wallet1.publicKey, "someone", 10, wallet1.privateKey)
+
+    async def relayToEmptyNode():
+        node = P2PServer("127.0.0.1", 0)
+        await node.initializeNetwork()
+        reader, writer = await asyncio.open_connection("127.0.0.1", node.PORT)
+        writer.write(encodeMessage(TRANSACTION, BinaryConverter.encodeTransaction(
+            transaction.getApprovedCopy())))
+        writer.write(encodeMessage(COMPACT_BLOCK, encodeCompactBlock(
+            blockchain.getCurrentBlock())))
+        writer.write(encodeMessage(PING, bytes(8)))
+
+        # The node is still serving the connection after the relayed objects.
+        messageType = None
+        while messageType != PONG:
+            messageType, body = await asyncio.wait_for(readMessage(reader), 5)
+        writer.close()
+        await node.stopNetwork()
+        return node.blockchain
+
+    assert asyncio.run(relayToEmptyNode()) is None
+
+def test_listenersShouldSeeAcceptedObjectsAndTrafficShouldBeCounted():
+    wallet1 = Wallet("person")
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        1, 1, wallet1.publicKey, 1000)
+    converter = DataConverter()
+    blockchainData = converter.dumpBlockchainDataAsBytes(blockchain)
+
+    async def relay():
+        nodes = [P2PServer("127.0.0.1", 0, converter.loadBlockchainDataFromBytes(blockchainData))
+                 for i in range(2)]
+        events = []
+        for node in nodes:
+            node.autoSync = False
+            await node.initializeNetwork()
+        nodes[1].listeners.append(
+            lambda itemType, itemHash: events.append((itemType, itemHash)))
+        await nodes[0].connectToPeer("127.0.0.1", nodes[1].PORT)
+        await waitUntil(lambda: all(len(node.peers) == 1 for node in nodes))
+
+        transaction = Transaction(
+            wallet1.publicKey, "someone", 10, wallet1.privateKey)
+        nodes[0].blockchain.addTransaction(transaction)
+        await nodes[0].announceTransaction(transaction)
+        await waitUntil(lambda: len(events) == 1)
+
+        minedHeight = len(nodes[0].blockchain.blockchain)
+        nodes[0].blockchain.handleTransactions(wallet1.publicKey)
+        block = nodes[0].blockchain.blockchain[minedHeight]
+        await nodes[0].announceBlock(block)
+        await waitUntil(lambda: len(events) == 2)
+
+        liveTraffic = [node.getTraffic() for node in nodes]
+        for node in nodes:
+            await node.stopNetwork()
+        closedTraffic = [node.getTraffic() for node in nodes]
+        return events, transaction, block, liveTraffic, closedTraffic
+
+    events, transaction, block, liveTraffic, closedTraffic = asyncio.run(relay())
+    assert events == [(INVENTORY_TRANSACTION, transaction.getTransactionHashBytes().hex()),
+                      (INVENTORY_BLOCK, block.blockHash)]
+    assert liveTraffic == closedTraffic
+    # Every byte one node sends is received by the other.
+    assert liveTraffic[0][0] == liveTraffic[1][1] > 0
+    assert liveTraffic[1][0] == liveTraffic[0][1] > 0
+
+
+def test_ed25519AndRSATransactionsShouldBeMixedInABlockchain(tmp_path):
+    wallet1 = Wallet("person1")
+    wallet2 = Wallet("person2", ED25519_SIGNATURE_SCHEME)
+    fraudWallet = Wallet("fraud", ED25519_SIGNATURE_SCHEME)
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        0, 1, wallet1.publicKey, 1000)
+    blockchain.forceTransaction(wallet2.publicKey, 1000)
+
+    blockchain.addTransaction(Transaction(
+        wallet1.publicKey, "someone", 10, wallet1.privateKey))
+    blockchain.addTransaction(Transaction(
+        wallet2.publicKey, "someone", 20, wallet2.privateKey,
+        signatureScheme=ED25519_SIGNATURE_SCHEME))
+    blockchain.addTransaction(Transaction(
+        wallet2.publicKey, "someone", 30, fraudWallet.privateKey,
+        signatureScheme=ED25519_SIGNATURE_SCHEME))
+    blockchain.handleTransactions("null")
+
+    assert blockchain.getBalance("someone") == 30
+    schemes = [transaction.signatureScheme
+               for transaction in blockchain.getCurrentBlock().blockTransactions]
+    assert sorted(schemes) == [RSA_SIGNATURE_SCHEME, RSA_SIGNATURE_SCHEME, ED25519_SIGNATURE_SCHEME]
+
+    # The scheme is kept by every format and the signatures still verify.
+    converter = DataConverter()
+    blockStore = SQLiteBlockStore(str(tmp_path / "blockchain.db"))
+    for block in blockchain.blockchain:
+        blockStore.appendBlock(block)
+    loadedBlocks = [converter.loadBlockchainDataFromBytes(
+        converter.dumpBlockchainDataAsBytes(blockchain)).getCurrentBlock(),
+        converter.loadBlockchainData(
+            converter.dumpBlochcainDataAsStr(blockchain)).getCurrentBlock(),
+        blockStore.readBlock(-1)]
+    blockStore.close()
+    for loadedBlock in loadedBlocks:
+        assert [transaction.signatureScheme for transaction in loadedBlock.blockTransactions] == schemes
+        for transaction in loadedBlock.blockTransactions[:-1]:
+            pendingTransaction = transaction.getPendingCopy()
+            assert blockchain.validateTransaction(
+                pendingTransaction, pendingTransaction.source) == True
+
+
+def test_receivedEd25519TransactionShouldBeValidated():
+    wallet1 = Wallet("person", ED25519_SIGNATURE_SCHEME)
+    blockchain = blockchainFactory.getBlockchainWithFundedWallet(
+        0, 1, wallet1.publicKey, 1000)
+    transaction = Transaction(wallet1.publicKey, "someone", 10, wallet1.privateKey,
+                              signatureScheme=ED25519_SIGNATURE_SCHEME)
+    assert len(transaction.transactionSignature) == 64
+
+    # A received transaction can't switch to another scheme.
+    tamperedTransaction = transaction.getApprovedCopy()
+    tamperedTransaction.signatureScheme = RSA_SIGNATURE_SCHEME
+    with pytest.raises(SignatureError):
+        blockchain.addReceivedTransaction(tamperedTransaction)
+
+    blockchain.addReceivedTransaction(transaction.getApprovedCopy())
+    blockchain.handleTransactions("null")
+    assert blockchain.getBalance("someone") == 10
+    assert Wallet.importWallet("person").publicKey == wallet1.publicKey
+
+
+def test_keyPairPoolShouldGenerateKeyPairsInTheBackground():
+    pool = KeyPairPool(ED25519_SIGNATURE_SCHEME, poolSize=4, workerCount=2)
+    pool.start()
+    for i in range(500):
+        if len(pool) == 4:
+            break
+        time.sleep(0.01)
+    assert len(pool) == 4
+
+    keyPairs = [pool.getKeyPair() for i in range(6)]
+    pool.stop()
+    assert len(set(privateKey for publicKey, privateKey in keyPairs)) == 6
+    for publicKey, privateKey in keyPairs:
+        transaction = Transaction(publicKey, "someone", 1, privateKey,
+                                  signatureScheme=ED25519_SIGNATURE_SCHEME)
+        assert TransactionSignature().validateTransaction(
+            transaction.transactionHash, transaction.transactionSignature,
+            publicKey, ED25519_SIGNATURE_SCHEME) == True
+
+    with pytest.raises(SignatureError):
+        KeyPairPool(99)
+
+
+def test_importedWalletShouldNotGenerateOrExportKeys(monkeypatch):
+    wallet1 = Wallet("imported")
+    with open("./key_pair_exports/imported_key_pair.json", encoding="utf-8") as f:
+        exportedKeyPair = f.read()
+
+    def fail(*args):
+        raise AssertionError("Import must not generate keys!")
+
+    monkeypatch.setattr("src.Wallet.Wallet.getKeyPairPool", fail)
+    monkeypatch.setattr(Wallet, "exportKeyPair", fail)
+    wallet2 = Wallet.importWallet("imported")
+    monkeypatch.undo()
+
+    with open("./key_pair_exports/imported_key_pair.json", encoding="utf-8") as f:
+        assert f.read() == exportedKeyPair
+    assert (wallet2.publicKey, wallet2.privateKey, wallet2.signatureScheme) == \
+        (wallet1.publicKey, wallet1.privateKey, wallet1.signatureScheme)
+
+
 def test_integration_blockchainDataIO():
     blockchain = Blockchain(3, 0)
 
@@ -260,3 +1845,5 @@ def test_integration_blockchainDataIO():
         usersBalanceAfterExport += wallets[i].getBalance(newBlockchain)
 
     assert usersBalanceBeforeExport == usersBalanceAfterExport
+    assert newBlockchain.getCurrentBlock().merkleRoot == \
+        blockchain.getCurrentBlock().merkleRoot